@@ -0,0 +1,267 @@
+import os
+import hmac
+import json
+import hashlib
+import secrets
+import argparse
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import table
+import unhashing
+import user_creation
+from approver_dashboard import approve_request_in_sheet, reject_request_in_sheet
+from request_index import request_parties, normalize_email, STATUS_COLUMNS
+from submissions import submission_token
+from refresh_cache import start_reference_refresher
+
+# Bearer token automation sends in the Authorization header; the API refuses to start without one
+API_TOKEN = os.environ.get('ACCESS_API_TOKEN', '')
+# Per-approver bearer tokens for approve/reject, stored as {approver email: sha256 of the token}
+APPROVER_TOKENS_FILE = os.environ.get('ACCESS_API_APPROVER_TOKENS', 'api_approver_tokens.json')
+API_HOST = os.environ.get('ACCESS_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('ACCESS_API_PORT', '8600'))
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def load_approver_tokens(path=APPROVER_TOKENS_FILE):
+    """{approver email: token digest}; empty if no approver has been issued a token"""
+    try:
+        with open(path, encoding='utf-8') as tokens_file:
+            return json.load(tokens_file)
+    except FileNotFoundError:
+        return {}
+
+def issue_approver_token(approver_email, path=APPROVER_TOKENS_FILE):
+    """Create (or replace) an approver's token; only its digest is stored, so it is shown once"""
+    token = secrets.token_urlsafe(32)
+    tokens = load_approver_tokens(path)
+    tokens[normalize_email(approver_email)] = token_digest(token)
+    temp_path = f"{path}.tmp"
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as tokens_file:
+        json.dump(tokens, tokens_file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+    return token
+
+def approver_for_token(token, path=APPROVER_TOKENS_FILE):
+    """Approver email a bearer token was issued to, or None"""
+    digest = token_digest(token)
+    for approver_email, stored in load_approver_tokens(path).items():
+        if hmac.compare_digest(stored, digest):
+            return approver_email
+    return None
+
+def find_requester(users, rm_approvers, email):
+    """The snf_user record of an email and its RM approver, or (None, '')"""
+    email = normalize_email(email)
+    user = next((user for user in users if normalize_email(user['email']) == email), None)
+    if not user:
+        return None, ''
+    rm_entry = next((r for r in rm_approvers if r['user_email'] == user['email']), None)
+    return user, rm_entry['approver'] if rm_entry else ''
+
+def table_field(value):
+    """JSON value of a table request field as the CSV upload would read it"""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ';'.join(str(item) for item in value)
+    return str(value)
+
+def idempotency_token(kind, email, key):
+    """Token of a client-supplied Idempotency-Key; without one the submission's content is the key"""
+    return submission_token(kind, email, ['key', key]) if key else None
+
+def submit_table_requests(body, key=None):
+    """POST /api/table-requests: {"email", "requests": [{object_source, database, schema,
+    tables, grantee, validity, reason, requesting_for}]}; validated like the CSV upload"""
+    users, rm_approvers, data_approvers, table_data = table.fetch_all_sheet_data()
+    user, rm_approver = find_requester(users, rm_approvers, body.get('email'))
+    if not user:
+        return 404, {'error': "Unknown user"}
+    items = body.get('requests')
+    if not isinstance(items, list) or not items:
+        return 400, {'error': "requests must be a non-empty list"}
+    if not all(isinstance(item, dict) for item in items):
+        return 400, {'error': "Every request must be an object"}
+
+    numbered_rows = [
+        (number, {column: table_field(item.get(column)) for column in table.BULK_CSV_COLUMNS + ['requesting_for']})
+        for number, item in enumerate(items, start=1)
+    ]
+    requests, errors = table.validate_table_requests(
+        numbered_rows, user['email'], user['entity'], rm_approver, data_approvers, table_data, header_number=0
+    )
+    if errors:
+        return 422, {'errors': [{'item': number, 'message': message} for number, message in errors]}
+
+    user_name = user['email'].split('@')[0]
+    saved, mail_sent, mail_error = table.submit_table_requests(
+        requests, user_name, user['email'], user['entity'], user['role'],
+        token=idempotency_token('table', user['email'], key)
+    )
+    if not saved:
+        return 502, {'error': "Failed to save requests"}
+    if mail_sent is None:
+        return 200, {'request_ids': [request['request_id'] for request in requests], 'duplicate': True}
+    return 201, {'request_ids': [request['request_id'] for request in requests],
+                 'email_sent': mail_sent, 'email_error': mail_error}
+
+def submit_column_request(body, key=None):
+    """POST /api/column-requests: {"email", object_source, database, schema, table,
+    columns (list or "ALL"), grantee, validity, reason, requesting_for}"""
+    users, rm_approvers, data_approvers, table_data, column_data = unhashing.fetch_sheet_data()
+    user, rm_approver = find_requester(users, rm_approvers, body.get('email'))
+    if not user:
+        return 404, {'error': "Unknown user"}
+
+    request, errors = unhashing.validate_column_request(
+        body, user['email'], rm_approver, data_approvers, table_data, column_data
+    )
+    if errors:
+        return 422, {'errors': [{'item': 1, 'message': message} for message in errors]}
+
+    request_id = unhashing.generate_request_id()
+    user_name = user['email'].split('@')[0]
+    saved_id, mail_sent, mail_error = unhashing.submit_column_request(
+        request_id, request, user_name, user['email'], user['entity'], user['role'],
+        token=idempotency_token('column', user['email'], key)
+    )
+    if not saved_id:
+        return 502, {'error': "Failed to save request"}
+    if mail_sent is None:
+        return 200, {'request_id': saved_id, 'duplicate': True}
+    return 201, {'request_id': saved_id, 'email_sent': mail_sent, 'email_error': mail_error}
+
+def submit_user_creation_request(body, key=None):
+    """POST /api/user-creation-requests: {"email", "entity", "bu"}"""
+    user_email = str(body.get('email') or '').strip()
+    entity = str(body.get('entity') or '').strip()
+    bu = str(body.get('bu') or '').strip()
+    entity_bu_mapping, user_manager_dict = user_creation.load_dropdown_data()
+    manager_email = user_manager_dict.get(user_email, "")
+
+    token = (idempotency_token('user', user_email, key)
+             or user_creation.user_creation_token(user_email, manager_email, entity, bu))
+    # Checked against the token first, so a retry gets its original request back rather than a pending-request error
+    error = user_creation.validate_new_user_creation(token, user_email, manager_email, entity, bu, entity_bu_mapping)
+    if error:
+        return 422, {'errors': [{'item': 1, 'message': error}]}
+
+    request_id = user_creation.generate_request_id()
+    saved_id, email_sent = user_creation.submit_user_creation(request_id, user_email, manager_email, entity, bu, token=token)
+    if not saved_id:
+        return 502, {'error': "Failed to save request"}
+    if email_sent is None:
+        return 200, {'request_id': saved_id, 'duplicate': True}
+    return 201, {'request_id': saved_id, 'email_sent': email_sent}
+
+def decide_request(request_id, action, body, approver):
+    """POST /api/requests/<id>/approve|reject: {"approver_type": rm|data|manager, "reason": ...};
+    the approver is whoever the bearer token was issued to, never a field of the body"""
+    approver_type = body.get('approver_type')
+    if approver_type not in STATUS_COLUMNS:
+        return 400, {'error': f"approver_type must be one of {', '.join(STATUS_COLUMNS)}"}
+
+    parties = request_parties(request_id, approver_type)
+    if parties is None:
+        return 404, {'error': "Request ID not found"}
+    assigned, requester = parties
+    if normalize_email(assigned) != normalize_email(approver):
+        return 403, {'error': f"Only the assigned {approver_type} approver can decide this request"}
+    if normalize_email(requester) == normalize_email(approver):
+        return 403, {'error': "Approvers cannot decide their own requests"}
+
+    if action == 'approve':
+        success, message = approve_request_in_sheet(request_id, approver_type, approver)
+    else:
+        success, message = reject_request_in_sheet(request_id, approver_type, approver,
+                                                   reason=str(body.get('reason', '')))
+    if not success:
+        return 409 if message.startswith("Request is already") else 502, {'error': message}
+    return 200, {'request_id': request_id, 'message': message}
+
+def route(method, path, body, key=None, approver=None):
+    """(status, payload) for a request; key is the Idempotency-Key header of a submission,
+    approver the email an approver token belongs to (None for the shared automation token)"""
+    parts = [part for part in urlsplit(path).path.split('/') if part]
+    if method != 'POST':
+        return 405, {'error': "Only POST is supported"}
+    if len(parts) == 4 and parts[:2] == ['api', 'requests'] and parts[3] in ('approve', 'reject'):
+        if not approver:
+            return 403, {'error': "Approving and rejecting need the approver's own API token"}
+        return decide_request(parts[2], parts[3], body, approver)
+    if approver:
+        return 403, {'error': "Approver tokens can only approve or reject"}
+    if parts == ['api', 'table-requests']:
+        return submit_table_requests(body, key)
+    if parts == ['api', 'column-requests']:
+        return submit_column_request(body, key)
+    if parts == ['api', 'user-creation-requests']:
+        return submit_user_creation_request(body, key)
+    return 404, {'error': "Not found"}
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP for automation; the same validation and storage code as the forms, without reruns"""
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def caller(self):
+        """(authorized, approver email) of the bearer token; the approver is None for the automation token"""
+        supplied = self.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {API_TOKEN}".encode('utf-8')):
+            return True, None
+        if supplied.startswith('Bearer '):
+            approver = approver_for_token(supplied[len('Bearer '):])
+            if approver:
+                return True, approver
+        return False, None
+
+    def handle_request(self):
+        authorized, approver = self.caller()
+        if not authorized:
+            return self.send_json(401, {'error': "Missing or invalid API token"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self.send_json(400, {'error': "Body must be JSON"})
+        if not isinstance(body, dict):
+            return self.send_json(400, {'error': "Body must be a JSON object"})
+        try:
+            status, payload = route(self.command, self.path, body, self.headers.get('Idempotency-Key'), approver)
+        except Exception as e:
+            status, payload = 500, {'error': f"Internal error: {e}"}
+        self.send_json(status, payload)
+
+    do_POST = handle_request
+    do_GET = handle_request
+
+def main():
+    """Serve the JSON API next to the Streamlit app"""
+    parser = argparse.ArgumentParser(description="Headless JSON API for submitting and deciding requests")
+    parser.add_argument('--host', default=API_HOST, help=f"interface to listen on (default {API_HOST})")
+    parser.add_argument('--port', type=int, default=API_PORT, help=f"port to listen on (default {API_PORT})")
+    parser.add_argument('--issue-approver-token', metavar='EMAIL',
+                        help="create an approver's token for approve/reject, print it and exit")
+    args = parser.parse_args()
+
+    if args.issue_approver_token:
+        print(issue_approver_token(args.issue_approver_token))
+        return
+
+    if not API_TOKEN:
+        parser.error("set ACCESS_API_TOKEN before starting the API")
+    start_reference_refresher()
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print(f"Serving the access request API on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,35 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from expiry import track_approved_row
+from request_ids import request_sort_key
+from request_index import (get_request_index, transition_status, request_index_stamp,
+                           sheet_values_to_frame, row_last_values)
+from query_cache import budget_cached
+from storage import read_available_tabs
 from config import *
 
-def get_sheets_service():
-    """Initialize and return Google Sheets service with cached credentials"""
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('sheets', 'v4', credentials=creds)
+ROLE_SHEETS = ['rm approvers', 'data approvers', 'user_manager']
+PENDING_COLUMNS = ['request_id', 'request_type', 'user', 'entity', 'approver_type', 'status',
+                   'business_unit', 'submitted_date', 'comments', 'database', 'schema', 'table',
+                   'column', 'manager_email', 'role']
+
+def optional_column(frame, col):
+    """Column values or blanks when the column is not present in the sheet"""
+    return frame[col].fillna('') if col >= 0 else pd.Series('', index=frame.index)
 
 @st.cache_data(ttl=CACHE_TTL)
 def get_user_approver_roles(user_email):
     """Check if user is an RM, Data approver, or Manager"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
         roles = {'rm': False, 'data': False, 'manager': False}
         
+        # Read all three reference tabs in one round trip
+        values_by_range = read_available_tabs(ROLE_SHEETS)
+        
         # Check RM approvers from rm approvers sheet
         try:
-            result = sheet.values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='rm approvers'
-            ).execute()
-            
-            values = result.get('values', [])
+            values = values_by_range['rm approvers']
             if values and len(values) >= 2:
                 header = values[0]
                 try:
@@ -59,12 +50,7 @@ def get_user_approver_roles(user_email):
         
         # Check Data approvers from data approvers sheet
         try:
-            result = sheet.values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='data approvers'
-            ).execute()
-            
-            values = result.get('values', [])
+            values = values_by_range['data approvers']
             if values and len(values) >= 2:
                 header = values[0]
                 try:
@@ -86,12 +72,7 @@ def get_user_approver_roles(user_email):
         
         # Check Managers from user_manager sheet
         try:
-            result = sheet.values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='user_manager'
-            ).execute()
-            
-            values = result.get('values', [])
+            values = values_by_range['user_manager']
             if values and len(values) >= 2:
                 header = values[0]
                 try:
@@ -115,24 +96,20 @@ def get_user_approver_roles(user_email):
         st.error(f"Error checking approver roles: {e}")
         return {'rm': False, 'data': False, 'manager': False}
 
-@st.cache_data(ttl=CACHE_TTL)
+@budget_cached(request_index_stamp)
 def get_pending_approvals_for_user(user_email, approver_roles):
-    """Get requests pending approval for specific user"""
+    """Get requests pending approval for specific user as a frame"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
+        # Read from the shared request index, which approvals and submissions patch in place
+        index = get_request_index()
         
-        pending_requests = []
+        pending_frames = []
+        user_email = user_email.lower()
         
         # Fetch from responses sheet (Table and Column requests)
         if approver_roles['rm'] or approver_roles['data']:
             try:
-                result = sheet.values().get(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range='responses'
-                ).execute()
-                
-                values = result.get('values', [])
+                values = index.approver_values('responses', user_email, ['rm', 'data'])
                 if values and len(values) >= 2:
                     header = values[0]
                     
@@ -170,61 +147,40 @@ def get_pending_approvals_for_user(user_email, approver_roles):
                         if column_col == -1:
                             column_col = header.index('Column') if 'Column' in header else -1
                         
-                        for row in values[1:]:
-                            if len(row) > max(request_id_col, user_col, request_type_col, entity_col):
-                                rm_status = row[rm_status_col] if rm_status_col < len(row) else 'Pending'
-                                data_status = row[data_status_col] if data_status_col and data_status_col < len(row) else 'Pending'
-                                
-                                # Get assigned approvers for this request
-                                rm_approver = row[rm_approver_col] if rm_approver_col >= 0 and len(row) > rm_approver_col else ""
-                                data_approver = row[data_approver_col] if data_approver_col >= 0 and len(row) > data_approver_col else ""
-                                
-                                # Get additional details
-                                database = row[database_col] if database_col >= 0 and len(row) > database_col else ""
-                                schema = row[schema_col] if schema_col >= 0 and len(row) > schema_col else ""
-                                table = row[table_col] if table_col >= 0 and len(row) > table_col else ""
-                                column = row[column_col] if column_col >= 0 and len(row) > column_col else ""
-                                
-                                # Check if this request needs approval from this specific user
-                                # Only show RM requests if current user is the assigned RM approver
-                                if (approver_roles['rm'] and rm_status == 'Pending' and 
-                                    rm_approver.strip().lower() == user_email.lower()):
-                                    request_data = {
-                                        'request_id': row[request_id_col],
-                                        'request_type': row[request_type_col],
-                                        'user': row[user_col],
-                                        'entity': row[entity_col],
-                                        'approver_type': 'rm',
-                                        'status': rm_status,
-                                        'business_unit': row[3] if len(row) > 3 else '',
-                                        'submitted_date': row[0] if len(row) > 0 else '',
-                                        'comments': row[-1] if len(row) > 0 else '',
-                                        'database': database,
-                                        'schema': schema,
-                                        'table': table,
-                                        'column': column
-                                    }
-                                    pending_requests.append(request_data)
-                                
-                                # Only show Data requests if current user is the assigned Data approver
-                                if (approver_roles['data'] and data_status == 'Pending' and 
-                                    data_approver.strip().lower() == user_email.lower()):
-                                    request_data = {
-                                        'request_id': row[request_id_col],
-                                        'request_type': row[request_type_col],
-                                        'user': row[user_col],
-                                        'entity': row[entity_col],
-                                        'approver_type': 'data',
-                                        'status': data_status,
-                                        'business_unit': row[3] if len(row) > 3 else '',
-                                        'submitted_date': row[0] if len(row) > 0 else '',
-                                        'comments': row[-1] if len(row) > 0 else '',
-                                        'database': database,
-                                        'schema': schema,
-                                        'table': table,
-                                        'column': column
-                                    }
-                                    pending_requests.append(request_data)
+                        frame = sheet_values_to_frame(values)
+                        # Skip rows too short to carry the core request fields
+                        frame = frame[frame[max(request_id_col, user_col, request_type_col, entity_col)].notna()]
+                        
+                        rm_status = frame[rm_status_col].fillna('Pending')
+                        data_status = frame[data_status_col].fillna('Pending') if data_status_col is not None else pd.Series('Pending', index=frame.index)
+                        rm_approver = optional_column(frame, rm_approver_col).str.strip().str.lower()
+                        data_approver = optional_column(frame, data_approver_col).str.strip().str.lower()
+                        
+                        requests = pd.DataFrame({
+                            'request_id': frame[request_id_col],
+                            'request_type': frame[request_type_col],
+                            'user': frame[user_col],
+                            'entity': frame[entity_col],
+                            'business_unit': frame[3].fillna('') if 3 in frame else '',
+                            'submitted_date': frame[0].fillna(''),
+                            'comments': row_last_values(frame),
+                            'database': optional_column(frame, database_col),
+                            'schema': optional_column(frame, schema_col),
+                            'table': optional_column(frame, table_col),
+                            'column': optional_column(frame, column_col),
+                            'manager_email': '',
+                            'role': ''
+                        })
+                        
+                        # Only show RM requests if current user is the assigned RM approver
+                        if approver_roles['rm']:
+                            rm_mask = (rm_status == 'Pending') & (rm_approver == user_email)
+                            pending_frames.append(requests[rm_mask].assign(approver_type='rm', status=rm_status[rm_mask]))
+                        
+                        # Only show Data requests if current user is the assigned Data approver
+                        if approver_roles['data']:
+                            data_mask = (data_status == 'Pending') & (data_approver == user_email)
+                            pending_frames.append(requests[data_mask].assign(approver_type='data', status=data_status[data_mask]))
                     except ValueError as e:
                         st.warning(f"Required columns not found in responses sheet: {e}")
             except Exception as e:
@@ -233,12 +189,7 @@ def get_pending_approvals_for_user(user_email, approver_roles):
         # Fetch from user_responses sheet (User Creation requests)
         if approver_roles['manager']:
             try:
-                result = sheet.values().get(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range='user_responses'
-                ).execute()
-                
-                values = result.get('values', [])
+                values = index.approver_values('user_responses', user_email, ['manager'])
                 if values and len(values) >= 2:
                     header = values[0]
                     
@@ -262,182 +213,80 @@ def get_pending_approvals_for_user(user_email, approver_roles):
                         
                         role_col = header.index('Role') if 'Role' in header else -1
                         
-                        for row in values[1:]:
-                            if len(row) > max(request_id_col, user_col, entity_col, approval_status_col):
-                                if row[approval_status_col] == 'Pending':
-                                    # Get additional details for user creation
-                                    manager_email = row[manager_email_col] if manager_email_col >= 0 and len(row) > manager_email_col else ""
-                                    role = row[role_col] if role_col >= 0 and len(row) > role_col else ""
-                                    
-                                    # Only show manager requests if current user is the assigned manager
-                                    if manager_email.strip().lower() == user_email.lower():
-                                        request_data = {
-                                            'request_id': row[request_id_col],
-                                            'request_type': 'User Creation',
-                                            'user': row[user_col],
-                                            'entity': row[entity_col],
-                                            'approver_type': 'manager',
-                                            'status': row[approval_status_col],
-                                            'business_unit': row[bu_col] if bu_col < len(row) else '',
-                                            'submitted_date': row[0] if len(row) > 0 else '',
-                                            'comments': row[-1] if len(row) > 0 else '',
-                                            'database': "",
-                                            'schema': "",
-                                            'table': "",
-                                            'column': "",
-                                            'manager_email': manager_email,
-                                            'role': role
-                                        }
-                                        pending_requests.append(request_data)
+                        frame = sheet_values_to_frame(values)
+                        frame = frame[frame[max(request_id_col, user_col, entity_col, approval_status_col)].notna()]
+                        manager_email = optional_column(frame, manager_email_col)
+                        
+                        # Only show manager requests if current user is the assigned manager
+                        manager_mask = ((frame[approval_status_col] == 'Pending') &
+                                        (manager_email.str.strip().str.lower() == user_email))
+                        frame = frame[manager_mask]
+                        
+                        pending_frames.append(pd.DataFrame({
+                            'request_id': frame[request_id_col],
+                            'request_type': 'User Creation',
+                            'user': frame[user_col],
+                            'entity': frame[entity_col],
+                            'approver_type': 'manager',
+                            'status': frame[approval_status_col],
+                            'business_unit': frame[bu_col].fillna(''),
+                            'submitted_date': frame[0].fillna(''),
+                            'comments': row_last_values(frame),
+                            'database': "",
+                            'schema': "",
+                            'table': "",
+                            'column': "",
+                            'manager_email': manager_email[manager_mask],
+                            'role': optional_column(frame, role_col)
+                        }))
                     except ValueError as e:
                         st.warning(f"Required columns not found in user_responses sheet: {e}")
             except Exception as e:
                 st.warning(f"Could not fetch from user_responses sheet: {e}")
         
-        # Sort by request ID (latest first)
-        pending_requests.sort(key=lambda x: x['request_id'], reverse=True)
+        if not pending_frames:
+            return pd.DataFrame(columns=PENDING_COLUMNS)
         
-        return pending_requests
+        pending_requests = pd.concat(pending_frames, ignore_index=True)[PENDING_COLUMNS]
+        pending_requests['request_type'] = pending_requests['request_type'].astype('category')
+        pending_requests['approver_type'] = pending_requests['approver_type'].astype('category')
+        
+        # Latest submission first; legacy IDs carry local time, current ones UTC
+        return pending_requests.sort_values('request_id', ascending=False, ignore_index=True,
+                                            key=lambda ids: ids.map(request_sort_key))
     except Exception as e:
         st.error(f"Error fetching pending approvals: {e}")
-        return []
+        return pd.DataFrame(columns=PENDING_COLUMNS)
 
 def approve_request_in_sheet(request_id, approver_type, user_email):
     """Approve a request and update Google Sheets"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
-        # Determine which sheet and column to update
-        if approver_type == 'rm':
-            sheet_range = 'responses'
-            status_column = 'RM_APPROVER_STATUS'
-        elif approver_type == 'data':
-            sheet_range = 'responses'
-            status_column = 'DATA_APPROVER_STATUS'
-        elif approver_type == 'manager':
-            sheet_range = 'user_responses'
-            status_column = 'Approval_status'
-        
-        # Find the row with matching REQUEST_ID
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=sheet_range
-        ).execute()
-        
-        values = result.get('values', [])
-        header = values[0]
-        
-        # Find column indices
-        request_id_col = header.index('REQUEST_ID') if 'REQUEST_ID' in header else header.index('Request_id')
-        status_col = header.index(status_column)
+        success, message, approved_row = transition_status(request_id, approver_type, "Approved", actor=user_email)
+        if not success:
+            return False, message
         
-        # Find row to update
-        row_to_update = None
-        for idx, row in enumerate(values[1:], start=2):
-            if len(row) > request_id_col and row[request_id_col] == request_id:
-                row_to_update = idx
-                break
+        # Fully approved table/column grants start their validity countdown
+        if approver_type in ('rm', 'data'):
+            track_approved_row(get_request_index().header('responses'), approved_row)
         
-        if row_to_update:
-            # Update the status to "Approved"
-            # Convert column index to letter (A=0, B=1, ..., Z=25, AA=26, etc.)
-            def col_to_letter(col_idx):
-                result = ""
-                while col_idx >= 0:
-                    col_idx, remainder = divmod(col_idx, 26)
-                    result = chr(65 + remainder) + result
-                    col_idx -= 1
-                return result
-            
-            col_letter = col_to_letter(status_col)
-            update_range = f"{sheet_range}!{col_letter}{row_to_update}"
-            sheet.values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=update_range,
-                valueInputOption="RAW",
-                body={"values": [["Approved"]]}
-            ).execute()
-            
-            return True, "Request approved successfully"
-        else:
-            return False, "Request ID not found"
-            
+        return True, "Request approved successfully"
     except Exception as e:
         return False, f"Error approving request: {e}"
 
-def reject_request_in_sheet(request_id, approver_type, user_email):
-    """Reject a request and update Google Sheets"""
+def reject_request_in_sheet(request_id, approver_type, user_email, reason=''):
+    """Reject a request and update Google Sheets; the reason is kept in the event log"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
-        # Determine which sheet and column to update
-        if approver_type == 'rm':
-            sheet_range = 'responses'
-            status_column = 'RM_APPROVER_STATUS'
-        elif approver_type == 'data':
-            sheet_range = 'responses'
-            status_column = 'DATA_APPROVER_STATUS'
-        elif approver_type == 'manager':
-            sheet_range = 'user_responses'
-            status_column = 'Approval_status'
-        
-        # Find the row with matching REQUEST_ID
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=sheet_range
-        ).execute()
-        
-        values = result.get('values', [])
-        header = values[0]
+        success, message, _ = transition_status(request_id, approver_type, "Rejected", actor=user_email, reason=reason)
+        if not success:
+            return False, message
         
-        # Find column indices
-        request_id_col = header.index('REQUEST_ID') if 'REQUEST_ID' in header else header.index('Request_id')
-        status_col = header.index(status_column)
-        
-        # Find row to update
-        row_to_update = None
-        for idx, row in enumerate(values[1:], start=2):
-            if len(row) > request_id_col and row[request_id_col] == request_id:
-                row_to_update = idx
-                break
-        
-        if row_to_update:
-            # Update the status to "Rejected"
-            # Convert column index to letter (A=0, B=1, ..., Z=25, AA=26, etc.)
-            def col_to_letter(col_idx):
-                result = ""
-                while col_idx >= 0:
-                    col_idx, remainder = divmod(col_idx, 26)
-                    result = chr(65 + remainder) + result
-                    col_idx -= 1
-                return result
-            
-            col_letter = col_to_letter(status_col)
-            update_range = f"{sheet_range}!{col_letter}{row_to_update}"
-            sheet.values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=update_range,
-                valueInputOption="RAW",
-                body={"values": [["Rejected"]]}
-            ).execute()
-            
-
-            
-            return True, "Request rejected successfully"
-        else:
-            return False, "Request ID not found"
-            
+        return True, "Request rejected successfully"
     except Exception as e:
         return False, f"Error rejecting request: {e}"
 
 def show_complete_request_details(request_id, approver_type):
     """Show ALL columns from Google Sheet for specific request"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
         # Determine which sheet to fetch from
         if approver_type in ['rm', 'data']:
             sheet_range = 'responses'
@@ -447,14 +296,9 @@ def show_complete_request_details(request_id, approver_type):
             st.error("Invalid approver type")
             return
         
-        # Fetch the complete row from the appropriate sheet
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=sheet_range
-        ).execute()
-        
-        values = result.get('values', [])
-        if not values or len(values) < 2:
+        # Fetch the complete row from the shared request index
+        values = get_request_index().request_values(sheet_range, request_id)
+        if not values:
             st.error("No data found")
             return
         
@@ -546,7 +390,7 @@ def create_approver_dashboard():
     with st.spinner("Loading pending approvals..."):
         pending_requests = get_pending_approvals_for_user(user_email, approver_roles)
     
-    if not pending_requests:
+    if pending_requests.empty:
         st.info("No pending approvals found. All requests have been processed!")
         return
     
@@ -556,43 +400,45 @@ def create_approver_dashboard():
     with col1:
         type_filter = st.selectbox(
             "Filter by Type",
-            ["All"] + list(set([req['request_type'] for req in pending_requests])),
+            ["All"] + list(pending_requests['request_type'].unique()),
             key="approver_type_filter"
         )
     
     with col2:
         approver_type_filter = st.selectbox(
             "Filter by Approver Type",
-            ["All"] + list(set([req['approver_type'] for req in pending_requests])),
+            ["All"] + list(pending_requests['approver_type'].unique()),
             key="approver_role_filter"
         )
     
     with col3:
         search_term = st.text_input("Search by Request ID", key="approver_search_filter")
     
-    # Apply filters
-    filtered_requests = pending_requests.copy()
+    # Apply filters as one combined mask
+    mask = pd.Series(True, index=pending_requests.index)
     
     if type_filter != "All":
-        filtered_requests = [req for req in filtered_requests if req['request_type'] == type_filter]
+        mask &= pending_requests['request_type'] == type_filter
     
     if approver_type_filter != "All":
-        filtered_requests = [req for req in filtered_requests if req['approver_type'] == approver_type_filter]
+        mask &= pending_requests['approver_type'] == approver_type_filter
     
     if search_term:
-        filtered_requests = [req for req in filtered_requests if search_term.lower() in req['request_id'].lower()]
+        mask &= pending_requests['request_id'].str.contains(search_term, case=False, regex=False)
+    
+    filtered_requests = pending_requests[mask]
     
     # Action buttons and summary
     col1, col2, col3 = st.columns([1, 1, 2])
     
     with col1:
         if st.button("✅ Approve All", key="approve_all_btn", type="primary"):
-            if filtered_requests:
+            if not filtered_requests.empty:
                 success_count = 0
                 error_count = 0
                 with st.spinner("Processing approvals..."):
-                    for req in filtered_requests:
-                        success, message = approve_request_in_sheet(req['request_id'], req['approver_type'], user_email)
+                    for req in filtered_requests.itertuples(index=False):
+                        success, message = approve_request_in_sheet(req.request_id, req.approver_type, user_email)
                         if success:
                             success_count += 1
                         else:
@@ -608,17 +454,18 @@ def create_approver_dashboard():
     
     with col2:
         if st.button("❌ Reject All", key="reject_all_btn", type="secondary"):
-            if filtered_requests:
+            if not filtered_requests.empty:
                 st.session_state["show_reject_all"] = True
             else:
                 st.warning("No requests to reject.")
     
     with col3:
         # Summary statistics
+        type_counts = filtered_requests['approver_type'].value_counts()
         total_requests = len(filtered_requests)
-        rm_requests = len([req for req in filtered_requests if req['approver_type'] == 'rm'])
-        data_requests = len([req for req in filtered_requests if req['approver_type'] == 'data'])
-        manager_requests = len([req for req in filtered_requests if req['approver_type'] == 'manager'])
+        rm_requests = type_counts.get('rm', 0)
+        data_requests = type_counts.get('data', 0)
+        manager_requests = type_counts.get('manager', 0)
         
         st.markdown(f"**Summary:** Total: {total_requests} | RM: {rm_requests} | Data: {data_requests} | Manager: {manager_requests}")
     
@@ -639,8 +486,8 @@ def create_approver_dashboard():
                     success_count = 0
                     error_count = 0
                     with st.spinner("Processing rejections..."):
-                        for req in filtered_requests:
-                            success, message = reject_request_in_sheet(req['request_id'], req['approver_type'], user_email, rejection_reason)
+                        for req in filtered_requests.itertuples(index=False):
+                            success, message = reject_request_in_sheet(req.request_id, req.approver_type, user_email, rejection_reason)
                             if success:
                                 success_count += 1
                             else:
@@ -663,10 +510,10 @@ def create_approver_dashboard():
     st.markdown("---")
     
     # Display only actions section
-    if filtered_requests:
+    if not filtered_requests.empty:
         st.markdown("### Actions")
         
-        for req in filtered_requests:
+        for req in filtered_requests.to_dict('records'):
             request_id = req['request_id']
             
             # Create a container for each request with action buttons
@@ -0,0 +1,126 @@
+import streamlit as st
+import argparse
+import datetime
+from storage import get_storage, read_fresh_tabs
+from request_ids import request_timestamp
+from expiry import EXPIRED_STATUS
+from config import *
+
+# Finalized rows older than this are moved out of the active tabs
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_TAB_SUFFIX = '_archive_'
+
+# Request ID and status columns of each active tab
+SHEET_LAYOUTS = {
+    'responses': {'request_id': 'REQUEST_ID', 'statuses': ['RM_APPROVER_STATUS', 'DATA_APPROVER_STATUS']},
+    'user_responses': {'request_id': 'Request_id', 'statuses': ['Approval_status']},
+}
+
+def is_finalized(statuses):
+    """A request is final once any approver rejected it, its grant expired, or every approver approved it"""
+    return REJECTED_STATUS in statuses or EXPIRED_STATUS in statuses or all(status == APPROVED_STATUS for status in statuses)
+
+def archive_tab_name(sheet_name, timestamp):
+    """Per-month archive tab for a sheet, e.g. responses_archive_2025_01"""
+    return f"{sheet_name}{ARCHIVE_TAB_SUFFIX}{timestamp.strftime('%Y_%m')}"
+
+def archive_finalized_requests(sheet_name, max_age_days=ARCHIVE_AFTER_DAYS, dry_run=False):
+    """Move finalized rows older than max_age_days from an active tab into per-month archive tabs.
+
+    Rows are appended to the archive before they are deleted from the active tab, so an
+    interrupted run can leave a duplicate in the archive but never loses a request.
+    Rows are deleted by the row number their request ID has right before the delete,
+    so rows moved in the meantime (by hand, or by another host) are still the right ones.
+    This runs as its own process and takes no lock the servers see: their request
+    indexes keep the old row numbers until the next rebuild, and transition_status
+    notices the moved row by its request ID, finds it again and rebuilds the index.
+    Returns a dict of archive tab name -> number of rows moved.
+    """
+    layout = SHEET_LAYOUTS[sheet_name]
+    storage = get_storage()
+
+    values = read_fresh_tabs([sheet_name])[sheet_name]
+    if len(values) < 2:
+        return {}
+
+    header = values[0]
+    request_id_col = header.index(layout['request_id'])
+    status_cols = [header.index(column) for column in layout['statuses']]
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+
+    # Group archivable rows by target tab, remembering their request IDs
+    rows_by_tab = {}
+    archived_ids = set()
+    for row in values[1:]:
+        request_id = row[request_id_col] if request_id_col < len(row) else ''
+        timestamp = request_timestamp(request_id)
+        if not timestamp or timestamp >= cutoff:
+            continue
+        statuses = [row[col] if col < len(row) else PENDING_STATUS for col in status_cols]
+        if not is_finalized(statuses):
+            continue
+        rows_by_tab.setdefault(archive_tab_name(sheet_name, timestamp), []).append(row)
+        archived_ids.add(request_id)
+
+    moved = {tab: len(rows) for tab, rows in rows_by_tab.items()}
+    if dry_run or not rows_by_tab:
+        return moved
+
+    # Create missing archive tabs with the active tab's header
+    existing_tabs = set(storage.list_tabs())
+    storage.add_tabs([tab for tab in rows_by_tab if tab not in existing_tabs], header)
+
+    for tab, rows in rows_by_tab.items():
+        storage.append_rows(tab, rows)
+
+    # Remove the archived rows from the active tab in one batch, found again by request ID
+    request_ids = storage.read_columns(sheet_name, [request_id_col])[0]
+    row_numbers = [row_number for row_number, request_id in enumerate(request_ids, start=1)
+                   if row_number > 1 and request_id in archived_ids]
+    storage.delete_rows(sheet_name, row_numbers)
+
+    return moved
+
+@st.cache_data(ttl=CACHE_TTL)
+def get_archived_values(sheet_name):
+    """All archived rows of an active tab, under a single header, for history views"""
+    try:
+        storage = get_storage()
+
+        prefix = f"{sheet_name}{ARCHIVE_TAB_SUFFIX}"
+        archive_tabs = sorted(tab for tab in storage.list_tabs() if tab.startswith(prefix))
+        if not archive_tabs:
+            return []
+
+        values_by_tab = storage.read_tabs(archive_tabs)
+        archived_values = []
+        for tab in archive_tabs:
+            values = values_by_tab[tab]
+            if not values:
+                continue
+            if not archived_values:
+                archived_values.append(values[0])
+            archived_values.extend(values[1:])
+        return archived_values
+    except Exception as e:
+        st.warning(f"Could not fetch archived {sheet_name}: {e}")
+        return []
+
+def main():
+    """Archive finalized requests from the command line (e.g. from a nightly cron job)"""
+    parser = argparse.ArgumentParser(description="Move finalized requests into per-month archive tabs")
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"archive finalized requests older than this many days (default {ARCHIVE_AFTER_DAYS})")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would be archived")
+    args = parser.parse_args()
+
+    for sheet_name in SHEET_LAYOUTS:
+        moved = archive_finalized_requests(sheet_name, args.days, args.dry_run)
+        action = "Would move" if args.dry_run else "Moved"
+        if not moved:
+            print(f"{sheet_name}: nothing to archive")
+        for tab, count in sorted(moved.items()):
+            print(f"{sheet_name}: {action} {count} rows to {tab}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import csv
+import sys
+import argparse
+from approver_dashboard import get_user_approver_roles, get_pending_approvals_for_user
+from expiry import track_approved_row
+from request_index import get_request_index, record_status_change, STATUS_COLUMNS
+from storage import get_storage
+from config import *
+
+DECISIONS = {
+    'approve': APPROVED_STATUS, 'approved': APPROVED_STATUS,
+    'reject': REJECTED_STATUS, 'rejected': REJECTED_STATUS,
+}
+
+def read_decisions(path):
+    """Parse a CSV of request_id,decision,reason lines (an optional header and # comments are skipped).
+    Returns (decisions, errors); decisions are dicts and errors (line number, message) pairs"""
+    decisions = []
+    errors = []
+    seen = set()
+    with open(path, newline='', encoding='utf-8-sig') as decisions_file:
+        for line_number, row in enumerate(csv.reader(decisions_file), start=1):
+            row = [cell.strip() for cell in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            if line_number == 1 and row[0].lower() == 'request_id':
+                continue
+
+            request_id = row[0]
+            decision = row[1].lower() if len(row) > 1 else ''
+            reason = row[2] if len(row) > 2 else ''
+            status = DECISIONS.get(decision)
+            if not status:
+                errors.append((line_number, f"Unknown decision '{decision}' (use approve or reject)"))
+            elif status == REJECTED_STATUS and not reason:
+                errors.append((line_number, "A reason is required to reject"))
+            elif request_id in seen:
+                errors.append((line_number, f"{request_id} is listed more than once"))
+            else:
+                seen.add(request_id)
+                decisions.append({'line': line_number, 'request_id': request_id,
+                                  'status': status, 'reason': reason})
+    return decisions, errors
+
+def plan_decisions(decisions, approver_email):
+    """Match decisions to the approver's pending queue, the same one the dashboard shows.
+    A request pending for the approver under several roles gets the decision for each.
+    Returns (planned, skipped)"""
+    approver_roles = get_user_approver_roles(approver_email)
+    pending = get_pending_approvals_for_user(approver_email, approver_roles)
+    approver_types = {}
+    for request_id, approver_type in zip(pending['request_id'], pending['approver_type']):
+        approver_types.setdefault(request_id, []).append(approver_type)
+
+    planned = []
+    skipped = []
+    for decision in decisions:
+        types = approver_types.get(decision['request_id'])
+        if not types:
+            skipped.append(dict(decision, message=f"Not pending for {approver_email}"))
+            continue
+        planned.extend(dict(decision, approver_type=approver_type) for approver_type in types)
+    return planned, skipped
+
+def commit_decisions(planned, approver_email):
+    """Write the planned statuses with one column read and one batched write per tab.
+    Like transition_status, this is a compare-and-set by re-read: each status is read
+    again right before the write, so a request decided earlier is reported as a conflict
+    rather than overwritten. The batch approver is its own process and holds no lock the
+    dashboards see, so a decision made between that read and the write can still be lost.
+    Returns (committed, conflicts)"""
+    index = get_request_index()
+    storage = get_storage()
+    by_sheet = {}
+    for decision in planned:
+        by_sheet.setdefault(STATUS_COLUMNS[decision['approver_type']][0], []).append(decision)
+
+    committed = []
+    conflicts = []
+    for sheet_name, decisions in by_sheet.items():
+        sheet_index = index.sheets[sheet_name]
+        header = sheet_index.header
+        status_cols = {decision['approver_type']: header.index(STATUS_COLUMNS[decision['approver_type']][1])
+                       for decision in decisions}
+        cols = [sheet_index.request_id_col] + sorted(set(status_cols.values()))
+        columns = dict(zip(cols, storage.read_columns(sheet_name, cols)))
+        row_numbers = {request_id: row_number
+                       for row_number, request_id in enumerate(columns[sheet_index.request_id_col], start=1)
+                       if row_number > 1 and request_id}
+
+        updates = []
+        ready = []
+        for decision in decisions:
+            row_number = row_numbers.get(decision['request_id'])
+            if not row_number:
+                conflicts.append(dict(decision, message="Request ID not found"))
+                continue
+            col = status_cols[decision['approver_type']]
+            status_cells = columns[col]
+            current_status = (status_cells[row_number - 1] if row_number <= len(status_cells) else '') or PENDING_STATUS
+            if current_status != PENDING_STATUS:
+                conflicts.append(dict(decision, message=f"Request is already {current_status}"))
+                continue
+            updates.append((row_number, col, decision['status']))
+            ready.append(decision)
+
+        try:
+            storage.update_cells(sheet_name, updates)
+        except Exception as e:
+            conflicts.extend(dict(decision, message=f"Write failed: {e}") for decision in ready)
+            continue
+
+        for decision in ready:
+            record_status_change(decision['request_id'], decision['approver_type'], decision['status'],
+                                 actor=approver_email, reason=decision['reason'])
+            # Fully approved table/column grants start their validity countdown
+            if sheet_name == 'responses' and decision['status'] == APPROVED_STATUS:
+                values = index.request_values(sheet_name, decision['request_id'])
+                if len(values) > 1:
+                    track_approved_row(header, values[1])
+            committed.append(decision)
+    return committed, conflicts
+
+def print_decisions(label, decisions):
+    for decision in decisions:
+        approver_type = decision.get('approver_type', '-')
+        message = decision.get('message', '')
+        print(f"{label:<10} line {decision['line']:<5} {decision['request_id']:<40} {approver_type:<8} "
+              f"{decision['status']:<9} {message}".rstrip())
+
+def main():
+    """Apply a file of approval decisions from the command line"""
+    parser = argparse.ArgumentParser(description="Approve or reject many requests from a CSV of request_id,decision,reason")
+    parser.add_argument('decisions_file', help="CSV with request_id, decision (approve/reject) and reason")
+    parser.add_argument('--approver', required=True, help="email of the approver making the decisions")
+    parser.add_argument('--dry-run', action='store_true', help="check every decision without writing")
+    args = parser.parse_args()
+
+    decisions, errors = read_decisions(args.decisions_file)
+    for line_number, message in errors:
+        print(f"error      line {line_number:<5} {message}")
+    if errors:
+        print(f"{len(errors)} problem(s) in {args.decisions_file}; nothing was written")
+        sys.exit(1)
+
+    # Start from the current sheet rather than an index cached by an earlier run
+    get_request_index.clear()
+    planned, skipped = plan_decisions(decisions, args.approver)
+    print_decisions('skipped', skipped)
+
+    if args.dry_run:
+        print_decisions('would set', planned)
+        print(f"Dry run: {len(planned)} decision(s) would be written, {len(skipped)} skipped")
+        return
+
+    committed, conflicts = commit_decisions(planned, args.approver)
+    print_decisions('done', committed)
+    print_decisions('conflict', conflicts)
+    approved = sum(1 for decision in committed if decision['status'] == APPROVED_STATUS)
+    print(f"{approved} approved, {len(committed) - approved} rejected, "
+          f"{len(skipped)} skipped, {len(conflicts)} conflict(s)")
+    if conflicts:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
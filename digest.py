@@ -0,0 +1,213 @@
+import streamlit as st
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import closing
+from request_index import get_request_index, normalize_email, STATUS_COLUMNS
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Minutes approval notifications are held so each approver gets one digest; 0 sends them one by one
+DIGEST_WINDOW = int(os.environ.get('APPROVAL_DIGEST_MINUTES', '0')) * 60
+# Queue shared by every server process (and the API) on the host
+DIGEST_QUEUE_FILE = os.environ.get('APPROVAL_DIGEST_QUEUE', 'approval_digest.db')
+DIGEST_FLUSH_INTERVAL = 60   # seconds between checks for digests that are due
+DIGEST_CLAIM_LEASE = 10 * 60  # seconds claimed notifications stay reserved for the flush that took them
+
+def digest_enabled():
+    return DIGEST_WINDOW > 0
+
+def connect(path=DIGEST_QUEUE_FILE):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS queued_notifications ('
+        'id INTEGER PRIMARY KEY AUTOINCREMENT, approver TEXT NOT NULL, approver_type TEXT NOT NULL, '
+        'request_id TEXT NOT NULL, details TEXT NOT NULL, approve_link TEXT NOT NULL, '
+        'reject_link TEXT NOT NULL, queued_at REAL NOT NULL, claimed_at REAL)'
+    )
+    # Queues created before claims were leased lack the column
+    if 'claimed_at' not in [column[1] for column in connection.execute('PRAGMA table_info(queued_notifications)')]:
+        connection.execute('ALTER TABLE queued_notifications ADD COLUMN claimed_at REAL')
+    return connection
+
+def queue_notification(approver, approver_type, request_id, details, approve_link, reject_link):
+    """Hold one approval notification for the approver's next digest; approvers are keyed
+    by normalized email. details is a list of (label, value) pairs shown for the request"""
+    with closing(connect()) as connection, connection:
+        connection.execute(
+            'INSERT INTO queued_notifications (approver, approver_type, request_id, details, '
+            'approve_link, reject_link, queued_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (normalize_email(approver), approver_type, request_id, json.dumps(details), approve_link, reject_link, time.time())
+        )
+
+def approval_link(base_url, request_id, link_type, action, approver, **params):
+    """Approve/reject link in the same format as the per-request emails"""
+    extra = "".join(f"&{key}={value}" for key, value in params.items())
+    return f"{base_url}?approve_id={request_id}&type={link_type}&action={action}{extra}&approver={approver}"
+
+def queue_request(request_id, details, approvers, base_url, link_type=None, **params):
+    """Queue a request for each (approver type, approver email) pair; link_type overrides
+    the type used in the links (user creation links use 'user')"""
+    for approver_type, approver in approvers:
+        if not approver:
+            continue
+        queue_notification(
+            approver, approver_type, request_id, details,
+            approval_link(base_url, request_id, link_type or approver_type, 'approve', approver, **params),
+            approval_link(base_url, request_id, link_type or approver_type, 'reject', approver, **params)
+        )
+
+def claim_due(now, force=False):
+    """Lease every queued notification of approvers whose oldest one has waited a full window.
+
+    Claimed rows stay in the queue, marked with the claim time, until delete_claimed
+    runs after their digest went out. A flush that dies before that leaves them to be
+    claimed again once DIGEST_CLAIM_LEASE has passed, so no digest is lost.
+    """
+    with closing(connect()) as connection, connection:
+        # BEGIN IMMEDIATE so two processes flushing at once never claim the same rows
+        connection.execute('BEGIN IMMEDIATE')
+        cutoff = now if force else now - DIGEST_WINDOW
+        available = '(claimed_at IS NULL OR claimed_at < ?)'
+        # Rows queued before approvers were normalized may differ in case or spacing
+        approver_key = 'lower(trim(approver))'
+        approvers = [approver for (approver,) in connection.execute(
+            f'SELECT {approver_key} FROM queued_notifications WHERE {available} '
+            f'GROUP BY {approver_key} HAVING MIN(queued_at) <= ?', (now - DIGEST_CLAIM_LEASE, cutoff))]
+        if not approvers:
+            return []
+        placeholders = ','.join('?' * len(approvers))
+        rows = connection.execute(
+            'SELECT approver, approver_type, request_id, details, approve_link, reject_link, queued_at, id '
+            f'FROM queued_notifications WHERE {available} AND {approver_key} IN ({placeholders}) ORDER BY id',
+            [now - DIGEST_CLAIM_LEASE] + approvers
+        ).fetchall()
+        connection.executemany('UPDATE queued_notifications SET claimed_at = ? WHERE id = ?',
+                               [(now, row[-1]) for row in rows])
+        return rows
+
+def delete_claimed(rows):
+    """Remove claimed notifications once they were sent (or no longer need sending)"""
+    with closing(connect()) as connection, connection:
+        connection.executemany('DELETE FROM queued_notifications WHERE id = ?', [(row[-1],) for row in rows])
+
+def release_claimed(rows):
+    """Hand claimed notifications back to the queue after a failed send"""
+    with closing(connect()) as connection, connection:
+        connection.executemany('UPDATE queued_notifications SET claimed_at = NULL WHERE id = ?',
+                               [(row[-1],) for row in rows])
+
+def still_pending(request_id, approver_type):
+    """Whether the approver has yet to decide the request (unknown requests are kept)"""
+    sheet_name, column = STATUS_COLUMNS[approver_type]
+    values = get_request_index().request_values(sheet_name, request_id)
+    if len(values) < 2 or column not in values[0]:
+        return True
+    header, row = values[0], values[1]
+    col = header.index(column)
+    return (row[col] if col < len(row) else '') in ('', PENDING_STATUS)
+
+def digest_body(rows):
+    """One HTML message listing every request with its approve and reject links"""
+    request_rows = "".join(f"""
+        <tr>
+            <td style="padding: 6px; border-bottom: 1px solid #dee2e6;">{request_id}</td>
+            <td style="padding: 6px; border-bottom: 1px solid #dee2e6;">{'<br>'.join(f'<strong>{label}:</strong> {value}' for label, value in json.loads(details))}</td>
+            <td style="padding: 6px; border-bottom: 1px solid #dee2e6;">
+                <a href='{approve_link}' style="color: #28a745; font-weight: bold;">✅ Approve</a>
+                &nbsp;
+                <a href='{reject_link}' style="color: #dc3545; font-weight: bold;">❌ Reject</a>
+            </td>
+        </tr>""" for _, _, request_id, details, approve_link, reject_link, _, _ in rows)
+
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #2c3e50;">{len(rows)} Request(s) Awaiting Your Approval</h2>
+        <table style="border-collapse: collapse; width: 100%;">
+            <tr style="background-color: #f8f9fa;">
+                <th style="padding: 6px; text-align: left;">Request ID</th>
+                <th style="padding: 6px; text-align: left;">Details</th>
+                <th style="padding: 6px; text-align: left;">Action</th>
+            </tr>
+            {request_rows}
+        </table>
+    </body>
+    </html>
+    """
+
+def flush_digests(now=None, force=False):
+    """Send every due digest over one SMTP session; returns {approver: requests listed}.
+    Each approver's notifications leave the queue as soon as their digest is sent;
+    those of approvers not reached when the send failed go back to the queue."""
+    # notifications imports this module for queue_request, so it is imported on use
+    from notifications import send_messages
+
+    rows = claim_due(now or time.time(), force)
+    by_approver = {}
+    decided = []
+    for row in rows:
+        if still_pending(row[2], row[1]):
+            by_approver.setdefault(normalize_email(row[0]), []).append(row)
+        else:
+            decided.append(row)
+    delete_claimed(decided)
+    if not by_approver:
+        return {}
+
+    approvers = list(by_approver)
+    sent = {}
+
+    def digest_sent(position):
+        approver = approvers[position]
+        delete_claimed(by_approver[approver])
+        sent[approver] = len(by_approver[approver])
+
+    success, error = send_messages(
+        [(approver, None, f"Approval Needed: {len(approver_rows)} Pending Request(s)", digest_body(approver_rows))
+         for approver, approver_rows in by_approver.items()],
+        on_sent=digest_sent
+    )
+    if not success:
+        release_claimed([row for approver, approver_rows in by_approver.items()
+                         if approver not in sent for row in approver_rows])
+        raise RuntimeError(f"Could not send approval digests: {error}")
+    return sent
+
+@st.cache_resource
+def start_digest_scheduler(interval=DIGEST_FLUSH_INTERVAL):
+    """Start one background digest sender per server process; returns its stop event"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                flush_digests()
+            except Exception:
+                logger.exception("Digest flush failed")
+
+    threading.Thread(target=run, name="digest-sender", daemon=True).start()
+    return stop
+
+def main():
+    """Inspect or flush the approval digest queue from the command line"""
+    parser = argparse.ArgumentParser(description="Approval notification digests")
+    parser.add_argument('--flush', action='store_true', help="send every queued digest now")
+    args = parser.parse_args()
+
+    if args.flush:
+        for approver, count in flush_digests(force=True).items():
+            print(f"{approver}: {count} request(s)")
+        return
+    with closing(connect()) as connection:
+        for approver, count in connection.execute(
+                'SELECT approver, COUNT(*) FROM queued_notifications GROUP BY approver ORDER BY approver'):
+            print(f"{approver}: {count} queued")
+
+if __name__ == "__main__":
+    main()
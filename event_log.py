@@ -0,0 +1,192 @@
+import streamlit as st
+import os
+import glob
+import json
+import fcntl
+import argparse
+import datetime
+import threading
+from contextlib import contextmanager
+
+# Local append-only record of every request state transition
+EVENT_LOG_FILE = 'request_events.jsonl'
+EVENT_SNAPSHOT_FILE = 'request_events.snapshot.json'
+# Compacted logs are kept as dated segments for audit queries
+EVENT_SEGMENT_PATTERN = 'request_events.*.jsonl'
+
+SUBMITTED_EVENT = 'submitted'
+STATUS_EVENT = 'status'
+
+_write_lock = threading.Lock()
+
+@contextmanager
+def locked_log():
+    """The live log opened for appending, under an exclusive flock that every process on the
+    host takes; if a compaction renamed the log while waiting for the lock, the new one is opened"""
+    while True:
+        log = open(EVENT_LOG_FILE, 'a', encoding='utf-8')
+        try:
+            fcntl.flock(log, fcntl.LOCK_EX)
+            stat = os.fstat(log.fileno())
+            if file_id(EVENT_LOG_FILE) == (stat.st_dev, stat.st_ino):
+                yield log
+                return
+        finally:
+            # Closing flushes the write and then drops the lock
+            log.close()
+
+def append_event(event, request_id, **fields):
+    """Append one event to the log; each line is written with a single call so appends never interleave"""
+    record = {'at': datetime.datetime.now().isoformat(timespec='milliseconds'),
+              'event': event, 'request_id': request_id, **fields}
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    with _write_lock, locked_log() as log:
+        log.write(line)
+
+def apply_event(state, record):
+    """Fold one event into the request_id -> current request state mapping"""
+    request_id = record.get('request_id')
+    if not request_id:
+        return
+    if record.get('event') == SUBMITTED_EVENT:
+        state[request_id] = {
+            'sheet': record.get('sheet', ''),
+            'requester': record.get('requester', ''),
+            'submitted_at': record['at'],
+            'updated_at': record['at'],
+            'statuses': dict(record.get('statuses', {})),
+        }
+    elif record.get('event') == STATUS_EVENT:
+        request = state.setdefault(request_id, {
+            'sheet': record.get('sheet', ''), 'requester': '', 'submitted_at': '',
+            'updated_at': '', 'statuses': {},
+        })
+        request['statuses'][record.get('approver_type', '')] = record.get('status', '')
+        request['updated_at'] = record['at']
+
+def read_events(path, offset=0):
+    """Events in a log file from a byte offset; returns (events, end offset). A torn last line is left for later"""
+    events = []
+    if not os.path.exists(path):
+        return events, 0
+    with open(path, 'rb') as log:
+        log.seek(offset)
+        for line in log:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events, offset
+
+def load_snapshot():
+    """State as of the last compaction"""
+    if not os.path.exists(EVENT_SNAPSHOT_FILE):
+        return {}
+    with open(EVENT_SNAPSHOT_FILE, encoding='utf-8') as snapshot:
+        return json.load(snapshot).get('requests', {})
+
+def replay():
+    """Current state of every request: the snapshot plus the events logged since"""
+    state = load_snapshot()
+    events, _ = read_events(EVENT_LOG_FILE)
+    for record in events:
+        apply_event(state, record)
+    return state
+
+def compact():
+    """Fold the log into the snapshot and start a new log; returns the number of events folded.
+
+    The log is first renamed to a dated segment so new appends go to a fresh file,
+    then the whole segment is folded into the snapshot, which is replaced atomically.
+    The rename happens under the lock appends take in every process, and an append
+    that was waiting for it writes to the new log, so nothing lands in the segment
+    after it is read. Segments are kept for request_history(). Run it from one
+    process (e.g. cron).
+    """
+    if not os.path.exists(EVENT_LOG_FILE):
+        return 0
+    segment = f"request_events.{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl"
+    with _write_lock, locked_log():
+        os.replace(EVENT_LOG_FILE, segment)
+
+    state = load_snapshot()
+    events, _ = read_events(segment)
+    for record in events:
+        apply_event(state, record)
+
+    temp_file = f"{EVENT_SNAPSHOT_FILE}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as snapshot:
+        json.dump({'compacted_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'requests': state}, snapshot)
+    os.replace(temp_file, EVENT_SNAPSHOT_FILE)
+    return len(events)
+
+def request_history(request_id):
+    """Every logged event of one request, oldest first, across compacted segments and the live log"""
+    history = []
+    for path in sorted(glob.glob(EVENT_SEGMENT_PATTERN)) + [EVENT_LOG_FILE]:
+        events, _ = read_events(path)
+        history.extend(record for record in events if record.get('request_id') == request_id)
+    return history
+
+def file_id(path):
+    """Identity of a file that changes when it is replaced, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_dev, stat.st_ino)
+    except OSError:
+        return None
+
+class EventState:
+    """Request state kept current by reading only the events appended since the last call"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}
+        self.offset = 0
+        self.version = None
+
+    def refresh(self):
+        with self.lock:
+            # A compaction replaced the log and the snapshot: start again from the new snapshot
+            version = (file_id(EVENT_LOG_FILE), file_id(EVENT_SNAPSHOT_FILE))
+            if version != self.version:
+                self.state = load_snapshot()
+                self.offset = 0
+                self.version = version
+            events, self.offset = read_events(EVENT_LOG_FILE, self.offset)
+            for record in events:
+                apply_event(self.state, record)
+            return self.state
+
+@st.cache_resource
+def get_event_state():
+    """Shared incremental replay of the event log"""
+    return EventState()
+
+def current_status(request_id):
+    """Statuses of one request from the local log, or None if it was never logged"""
+    request = get_event_state().refresh().get(request_id)
+    return dict(request['statuses']) if request else None
+
+def main():
+    """Inspect or compact the request event log from the command line"""
+    parser = argparse.ArgumentParser(description="Request state transition log")
+    parser.add_argument('--compact', action='store_true', help="fold the log into the snapshot")
+    parser.add_argument('--history', metavar='REQUEST_ID', help="print every event of a request")
+    args = parser.parse_args()
+
+    if args.compact:
+        print(f"Compacted {compact()} event(s)")
+    if args.history:
+        for record in request_history(args.history):
+            print(json.dumps(record))
+    if not args.compact and not args.history:
+        state = replay()
+        print(f"{len(state)} request(s) in the log")
+
+if __name__ == "__main__":
+    main()
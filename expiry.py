@@ -0,0 +1,260 @@
+import streamlit as st
+import os
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+from bisect import bisect_left, bisect_right, insort
+from contextlib import closing
+from storage import get_storage
+from request_index import record_status_change
+from request_ids import request_timestamp
+from event_log import get_event_state
+from config import *
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_STATUS = 'Expired'
+EXPIRY_SWEEP_INTERVAL = 15 * 60        # seconds between background sweeps
+EXPIRY_INDEX_REBUILD = 6 * 60 * 60     # seconds before the index is rebuilt from the sheet
+STATUS_COLUMNS = ['RM_APPROVER_STATUS', 'DATA_APPROVER_STATUS']
+VALIDITY_COLUMNS = ['VALIDITY', 'Validity']
+# Approval times of grants, which the sheet does not record; shared by every process on the host
+GRANT_LEDGER_FILE = os.environ.get('GRANT_LEDGER', 'grants.db')
+
+def grant_expiry(approved_at, validity):
+    """Expiry time of a grant: the time it was approved plus its validity in days"""
+    try:
+        days = int(float(validity))
+    except (TypeError, ValueError):
+        return None
+    if not approved_at or days <= 0:
+        return None
+    return approved_at + datetime.timedelta(days=days)
+
+class GrantLedger:
+    """When each approved grant was approved, kept in SQLite so index rebuilds and restarts keep it.
+
+    A grant is recorded when it is approved. One found approved without a record
+    (approved on another host, before approvals were recorded, or after the ledger
+    was lost) is recorded with the best time known for it; see first_known_approval.
+    """
+
+    def __init__(self, path=GRANT_LEDGER_FILE):
+        self.path = path
+        with closing(self.connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS grants (request_id TEXT PRIMARY KEY, approved_at REAL NOT NULL)')
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def approved_at(self, approval_times):
+        """{request_id: approval time}; grants not recorded yet are recorded at the time given for them"""
+        with closing(self.connect()) as connection, connection:
+            connection.executemany('INSERT OR IGNORE INTO grants (request_id, approved_at) VALUES (?, ?)',
+                                   [(request_id, approved_at.timestamp())
+                                    for request_id, approved_at in approval_times.items()])
+            return {
+                request_id: datetime.datetime.fromtimestamp(connection.execute(
+                    'SELECT approved_at FROM grants WHERE request_id = ?', (request_id,)
+                ).fetchone()[0])
+                for request_id in approval_times
+            }
+
+    def forget(self, request_ids):
+        with closing(self.connect()) as connection, connection:
+            connection.executemany('DELETE FROM grants WHERE request_id = ?', [(request_id,) for request_id in request_ids])
+
+    def keep_only(self, request_ids):
+        """Drop the records of grants no longer approved (expired, archived or removed)"""
+        with closing(self.connect()) as connection, connection:
+            recorded = {request_id for (request_id,) in connection.execute('SELECT request_id FROM grants')}
+            connection.executemany('DELETE FROM grants WHERE request_id = ?',
+                                   [(request_id,) for request_id in recorded - set(request_ids)])
+
+@st.cache_resource
+def get_grant_ledger():
+    return GrantLedger()
+
+class ExpiryIndex:
+    """Approved grants of the responses tab ordered by expiry time"""
+
+    def __init__(self, header):
+        self.request_id_col = header.index('REQUEST_ID')
+        self.status_cols = [header.index(column) for column in STATUS_COLUMNS]
+        self.validity_col = next((header.index(column) for column in VALIDITY_COLUMNS if column in header), None)
+        self.entries = []    # sorted (expires_at, request_id)
+        self.expiries = {}   # request_id -> expires_at
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, request_id, expires_at):
+        """Track (or re-time) an approved grant"""
+        with self.lock:
+            self._discard(request_id)
+            self.expiries[request_id] = expires_at
+            insort(self.entries, (expires_at, request_id))
+
+    def remove(self, request_ids):
+        """Stop tracking the given grants"""
+        with self.lock:
+            for request_id in request_ids:
+                self._discard(request_id)
+
+    def _discard(self, request_id):
+        expires_at = self.expiries.pop(request_id, None)
+        if expires_at is not None:
+            position = bisect_left(self.entries, (expires_at, request_id))
+            del self.entries[position]
+
+    def due(self, now):
+        """Grants that expire at or before now, earliest first"""
+        with self.lock:
+            return self.entries[:bisect_right(self.entries, (now, '\uffff'))]
+
+    def next_expiry(self):
+        """Earliest tracked expiry, or None when nothing is tracked"""
+        with self.lock:
+            return self.entries[0][0] if self.entries else None
+
+    def approved_grant(self, row):
+        """(request_id, validity) of a responses row every approver has approved, else None"""
+        if self.validity_col is None:
+            return None
+        statuses = [row[col] if col < len(row) else PENDING_STATUS for col in self.status_cols]
+        if not all(status == APPROVED_STATUS for status in statuses):
+            return None
+        request_id = row[self.request_id_col] if self.request_id_col < len(row) else ''
+        validity = row[self.validity_col] if self.validity_col < len(row) else ''
+        return (request_id, validity) if request_id else None
+
+    def track(self, request_id, validity, approved_at):
+        expires_at = grant_expiry(approved_at, validity)
+        if expires_at:
+            self.add(request_id, expires_at)
+
+def first_known_approval(request_id, logged_requests, now):
+    """Approval time of a grant with no ledger record: the logged transition that approved it,
+    else its submission time from the request ID (so it never outlives its validity), else now"""
+    request = logged_requests.get(request_id)
+    if request and request['updated_at'] and all(
+            request['statuses'].get(approver_type) == APPROVED_STATUS for approver_type in ('rm', 'data')):
+        try:
+            return datetime.datetime.fromisoformat(request['updated_at'])
+        except ValueError:
+            pass
+    return request_timestamp(request_id) or now
+
+def build_expiry_index(values, now=None):
+    """Build the index from the rows of the responses tab and the recorded approval times"""
+    index = ExpiryIndex(values[0])
+    grants = [grant for grant in map(index.approved_grant, values[1:]) if grant]
+    now = now or datetime.datetime.now()
+    logged_requests = get_event_state().refresh()
+    ledger = get_grant_ledger()
+    approved_at = ledger.approved_at({request_id: first_known_approval(request_id, logged_requests, now)
+                                      for request_id, _ in grants})
+    ledger.keep_only(approved_at)
+    for request_id, validity in grants:
+        index.track(request_id, validity, approved_at[request_id])
+    return index
+
+@st.cache_resource(ttl=EXPIRY_INDEX_REBUILD)
+def get_expiry_index():
+    """Shared expiry index, built from one read of the responses tab"""
+    values = get_storage().read_tabs(['responses'])['responses']
+    if not values:
+        return None
+    return build_expiry_index(values)
+
+def track_approved_row(header, row):
+    """Add a responses row to the expiry index once it is fully approved; called at approval,
+    so its validity window starts now"""
+    try:
+        index = get_expiry_index()
+        if index is None or header[index.request_id_col] != 'REQUEST_ID':
+            return
+        grant = index.approved_grant(row)
+        if grant:
+            request_id, validity = grant
+            approved_at = get_grant_ledger().approved_at({request_id: datetime.datetime.now()})
+            index.track(request_id, validity, approved_at[request_id])
+    except Exception:
+        logger.exception("Could not track the expiry of an approved grant")
+
+def sweep_expired_grants(now=None, dry_run=False):
+    """Mark every due grant Expired in one batched write and return the expired request IDs.
+
+    Only the request ID and status columns are read to confirm each due grant's row and
+    that it is still approved; grants whose rows moved away or changed are just dropped.
+    """
+    index = get_expiry_index()
+    if not index:
+        return []
+
+    due = index.due(now or datetime.datetime.now())
+    if not due:
+        return []
+    due_ids = {request_id for _, request_id in due}
+
+    storage = get_storage()
+    columns = storage.read_columns('responses', [index.request_id_col] + index.status_cols)
+
+    def cell(column, position):
+        return column[position] if position < len(column) else ''
+
+    updates = []
+    expired = []
+    for position in range(1, len(columns[0])):
+        request_id = cell(columns[0], position)
+        if request_id not in due_ids:
+            continue
+        if all(cell(column, position) == APPROVED_STATUS for column in columns[1:]):
+            expired.append(request_id)
+            updates.extend((position + 1, col, EXPIRED_STATUS) for col in index.status_cols)
+
+    if dry_run:
+        return expired
+
+    if updates:
+        storage.update_cells('responses', updates)
+        for request_id in expired:
+            for approver_type in ['rm', 'data']:
+                record_status_change(request_id, approver_type, EXPIRED_STATUS, actor='expiry sweep')
+    index.remove(due_ids)
+    get_grant_ledger().forget(due_ids)
+    return expired
+
+@st.cache_resource
+def start_expiry_scheduler(interval=EXPIRY_SWEEP_INTERVAL):
+    """Start one background sweep thread per server process; returns its stop event"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                sweep_expired_grants()
+            except Exception:
+                logger.exception("Expiry sweep failed")
+
+    threading.Thread(target=run, name="expiry-sweeper", daemon=True).start()
+    return stop
+
+def main():
+    """Run one expiry sweep from the command line (e.g. from cron)"""
+    parser = argparse.ArgumentParser(description="Mark approved grants past their validity as Expired")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would expire")
+    args = parser.parse_args()
+
+    expired = sweep_expired_grants(dry_run=args.dry_run)
+    action = "Would expire" if args.dry_run else "Expired"
+    print(f"{action} {len(expired)} grant(s)")
+    for request_id in expired:
+        print(f"  {request_id}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import os
+import sys
+import time
+import smtplib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Workers share the fake tabs through one SQLite file; keep the cross-process cache out of the measurement
+os.environ['STORAGE_SHARED_CACHE'] = ''
+
+from streamlit.testing.v1 import AppTest
+import storage
+from storage import StorageBackend, MemoryBackend, SQLiteBackend, copy_tabs
+from query_cache import get_query_cache
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main_app.py')
+LOAD_TEST_DOMAIN = 'loadtest.example'
+SOURCE = 'CSPL'
+PERCENTILES = [50, 95, 99]
+
+# AppTest installs a process-global runtime for each run, so the sessions of one
+# worker take turns rerunning, much like script threads sharing one interpreter
+RUN_LOCK = threading.Lock()
+
+RESPONSES_HEADER = [
+    'REQUEST_TYPE', 'REQUEST_ID', 'USER', 'EMAIL', 'ENTITY', 'ROLE', 'OBJECT_SOURCE', 'DATABASE',
+    'SCHEMA', 'TABLE_SELECTION', 'TABLE', 'COLUMN_NAMES', 'SHARED', 'GRANTEE', 'REQUESTING_FOR',
+    'VALIDITY', 'REASON', 'RM_APPROVER', 'DATA_APPROVER', 'RM_APPROVER_STATUS', 'DATA_APPROVER_STATUS',
+]
+USER_RESPONSES_HEADER = ['Request_id', 'User', 'Manager', 'BU', 'Entity', 'Approval_status']
+
+class FakeSheetsBackend(StorageBackend):
+    """Wraps a backend, counting calls and adding a fixed delay per call to stand in for Sheets round trips"""
+
+    def __init__(self, backend, latency=0.0):
+        self.backend = backend
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, name, method, *args):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return method(*args)
+
+    def list_tabs(self):
+        return self.call('list_tabs', self.backend.list_tabs)
+
+    def read_tabs(self, tabs):
+        return self.call('read_tabs', self.backend.read_tabs, tabs)
+
+    def read_row(self, tab, row_number, width):
+        return self.call('read_row', self.backend.read_row, tab, row_number, width)
+
+    def read_columns(self, tab, cols):
+        return self.call('read_columns', self.backend.read_columns, tab, cols)
+
+    def append_rows(self, tab, rows, value_input_option="RAW"):
+        return self.call('append_rows', self.backend.append_rows, tab, rows, value_input_option)
+
+    def update_cells(self, tab, updates):
+        return self.call('update_cells', self.backend.update_cells, tab, updates)
+
+    def add_tabs(self, tabs, header):
+        return self.call('add_tabs', self.backend.add_tabs, tabs, header)
+
+    def delete_rows(self, tab, row_numbers):
+        return self.call('delete_rows', self.backend.delete_rows, tab, row_numbers)
+
+class FakeSMTP:
+    """Accepts and counts approval emails so a load run never reaches a mail server"""
+
+    sent = Counter()
+    lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        with FakeSMTP.lock:
+            FakeSMTP.sent['emails'] += 1
+
+    def quit(self):
+        pass
+
+def user_email(i):
+    return f"user{i}@{LOAD_TEST_DOMAIN}"
+
+def rm_approver_email(i, approvers):
+    """Users 0..approvers-1 approve for everyone, including each other"""
+    return user_email(i % approvers)
+
+def seed_tabs(users, approvers, databases=5, schemas=4, tables=20):
+    """Reference tabs for the simulated users and a table catalog of databases x schemas x tables"""
+    catalog = [(f"DB_{d}", f"SCH_{s}", f"TBL_{t}")
+               for d in range(databases) for s in range(schemas) for t in range(tables)]
+    return {
+        'snf_user': [['EMAIL', 'ENTITY', 'DEFAULT_ROLE']] +
+                    [[user_email(i), SOURCE, 'ANALYST'] for i in range(users)],
+        'rm approvers': [['User_Email', 'Approver']] +
+                        [[user_email(i), rm_approver_email(i, approvers)] for i in range(users)],
+        'data approvers': [['Database', 'Approver']] +
+                          [[f"DB_{d}", user_email(d % approvers)] for d in range(databases)],
+        'table_list': [['OBJECT_SOURCE', 'DATABASE_NAME', 'SCHEMA_NAME', 'TABLE_NAME', 'FQN(DB.SCH)']] +
+                      [[SOURCE, database, schema, table, f"{database}.{schema}"]
+                       for database, schema, table in catalog],
+        'generic roles/users': [['entity', 'generic_users', 'generic_roles'], [SOURCE, 'SVC_LOAD', 'ROLE_LOAD']],
+        'user_bu': [['Entity', 'BU'], [SOURCE, 'C2B'], [SOURCE, 'B2B']],
+        'user_manager': [['User', 'Manager_email_id']] +
+                        [[user_email(i), rm_approver_email(i, approvers)] for i in range(users)],
+        'responses': [RESPONSES_HEADER],
+        'user_responses': [USER_RESPONSES_HEADER],
+    }
+
+class Session:
+    """One simulated user driving main_app through AppTest, timing every rerun"""
+
+    def __init__(self, email, timeout):
+        self.email = email
+        self.app = AppTest.from_file(APP_FILE, default_timeout=timeout)
+        self.timings = []   # (step, seconds)
+        self.errors = []
+
+    def run(self, step, element=None):
+        with RUN_LOCK:
+            started = time.perf_counter()
+            (element or self.app).run()
+            self.timings.append((step, time.perf_counter() - started))
+        if self.app.exception:
+            self.errors.append(f"{step}: {self.app.exception[0].message}")
+
+    def login(self):
+        self.run('open')
+        self.app.text_input[0].input(self.email)
+        self.run('login', self.app.button[0].click())
+
+    def submit_table_request(self, database, schema, table):
+        app = self.app
+        self.run('dropdown', app.selectbox(key='object_source_dropdown').select(SOURCE))
+        self.run('dropdown', app.selectbox(key='database_dropdown').select(database))
+        self.run('dropdown', app.selectbox(key='schema_dropdown').select(schema))
+        self.run('dropdown', app.multiselect(key='tables_multiselect').select(table))
+        app.text_area(key='reason_table').input('load test')
+        self.run('submit', app.button(key='submit_table').click())
+
+    def submit_user_creation(self):
+        app = self.app
+        self.run('dropdown', app.selectbox(key='entity_dropdown').select(SOURCE))
+        self.run('dropdown', app.selectbox(key='bu_dropdown').select('C2B'))
+        self.run('submit', app.button(key='submit_user_creation').click())
+
+    def approve_pending(self, limit):
+        """Approve up to limit requests listed on the approver dashboard; returns how many were clicked"""
+        approved = 0
+        while approved < limit:
+            buttons = [button for button in self.app.button
+                       if (button.key or '').startswith('approve_') and button.key != 'approve_all_btn']
+            if not buttons:
+                break
+            self.run('approve', buttons[0].click())
+            approved += 1
+        return approved
+
+def simulate_user(i, args):
+    """Log in, file a table request and a user-creation request, then approve if an approver"""
+    session = Session(user_email(i), args.timeout)
+    try:
+        session.login()
+        session.submit_table_request(f"DB_{i % args.databases}", 'SCH_0', f"TBL_{i % 20}")
+        session.submit_user_creation()
+        if i < args.approvers:
+            session.approve_pending(args.approvals)
+    except Exception as e:
+        session.errors.append(f"{type(e).__name__}: {e}")
+    return session
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[rank - 1]
+
+def latency_report(timings):
+    """Rows of (step, count, p50, p95, p99) in milliseconds, with an 'all' row"""
+    by_step = {}
+    for step, seconds in timings:
+        by_step.setdefault(step, []).append(seconds * 1000)
+    by_step['all'] = [ms for samples in by_step.values() for ms in samples]
+    if not by_step['all']:
+        return []
+    return [(step, len(samples), *[percentile(samples, pct) for pct in PERCENTILES])
+            for step, samples in by_step.items()]
+
+def run_worker(database, user_ids, args):
+    """One app worker: its sessions run in threads against the shared fake backend.
+    Returns the timings, errors, backend calls and emails of the worker"""
+    backend = FakeSheetsBackend(SQLiteBackend(database), latency=args.latency_ms / 1000)
+    storage.create_backend = lambda name=None: backend
+    smtplib.SMTP = FakeSMTP
+
+    with ThreadPoolExecutor(max_workers=max(len(user_ids), 1)) as pool:
+        sessions = list(pool.map(lambda i: simulate_user(i, args), user_ids))
+    return {
+        'timings': [timing for session in sessions for timing in session.timings],
+        'errors': [error for session in sessions for error in session.errors],
+        'calls': dict(backend.calls),
+        'emails': FakeSMTP.sent['emails'],
+        'query_cache': get_query_cache().stats(),
+    }
+
+def run_load_test(args):
+    """Spread args.users concurrent sessions over args.workers processes; returns (results, seconds)"""
+    database = os.path.abspath('load_test.db')
+    copy_tabs(MemoryBackend(seed_tabs(args.users, args.approvers, databases=args.databases)),
+              SQLiteBackend(database))
+
+    workers = max(1, min(args.workers, args.users))
+    user_ids = [list(range(args.users))[worker::workers] for worker in range(workers)]
+    started = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        results = pool.starmap(run_worker, [(database, ids, args) for ids in user_ids])
+    return results, time.perf_counter() - started
+
+def main():
+    """Load-test one app worker with simulated concurrent users from the command line"""
+    parser = argparse.ArgumentParser(description="Drive main_app with concurrent AppTest sessions against a fake Sheets backend")
+    parser.add_argument('--users', type=int, default=20, help="simulated users (default 20)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="app worker processes the users are spread over (default: CPU count)")
+    parser.add_argument('--approvers', type=int, default=3, help="users who also approve (default 3)")
+    parser.add_argument('--approvals', type=int, default=5, help="approvals per approver session (default 5)")
+    parser.add_argument('--databases', type=int, default=5, help="databases in the fake catalog (default 5)")
+    parser.add_argument('--latency-ms', type=float, default=0, help="delay added to every backend call (default 0)")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds allowed per rerun (default 60)")
+    args = parser.parse_args()
+
+    # Keep the event log and other local files of the run out of the working directory
+    os.chdir(tempfile.mkdtemp(prefix='load_test_'))
+    results, seconds = run_load_test(args)
+
+    print(f"{args.users} session(s) on {len(results)} worker(s) in {seconds:.1f}s")
+    print(f"{'step':<10}{'reruns':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    timings = [timing for result in results for timing in result['timings']]
+    for step, count, p50, p95, p99 in latency_report(timings):
+        print(f"{step:<10}{count:>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+    calls = Counter()
+    for result in results:
+        calls.update(result['calls'])
+    total_calls = sum(calls.values())
+    print(f"backend calls: {total_calls} ({total_calls / max(args.users, 1):.1f} per session)")
+    for name, count in sorted(calls.items()):
+        print(f"  {name}: {count}")
+    print(f"emails: {sum(result['emails'] for result in results)}")
+    cache_stats = Counter()
+    for result in results:
+        cache_stats.update({name: result['query_cache'][name] for name in ('hits', 'misses', 'evictions', 'bytes')})
+    print(f"query cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+          f"{cache_stats['evictions']} evictions, {cache_stats['bytes'] / 1024:.1f} KB held")
+
+    errors = [error for result in results for error in result['errors']]
+    for error in errors[:20]:
+        print(f"error: {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,42 @@
 import streamlit as st
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from storage import get_storage
+from refresh_cache import stale_while_revalidate
 from config import *
 
-def get_sheets_service():
-    """Initialize and return Google Sheets service with cached credentials"""
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
+@stale_while_revalidate(snapshot=True)  # Served while refreshed in the background
+def load_user_data():
+    """Fetch user data from snf_user sheet; raises if it cannot be read"""
+    values = get_storage().read_tabs(['snf_user'])['snf_user']
+    if not values or len(values) < 2:
+        return {}
+    
+    header = values[0]
+    user_data = {}
+    
+    try:
+        email_col = header.index('EMAIL')
+        entity_col = header.index('ENTITY')
+        role_col = header.index('DEFAULT_ROLE')
+    except ValueError:
+        raise ValueError("Required columns not found in snf_user sheet")
     
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
+    for row in values[1:]:
+        if len(row) > email_col and row[email_col].strip():
+            email = row[email_col].strip()
+            entity = row[entity_col] if entity_col < len(row) else ''
+            role = row[role_col] if role_col < len(row) else ''
+            
+            user_data[email] = {
+                'entity': entity,
+                'role': role
+            }
     
-    return build('sheets', 'v4', credentials=creds)
+    return user_data
 
-@st.cache_data(ttl=CACHE_TTL)
 def get_user_data():
     """Fetch user data from snf_user sheet"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='snf_user'
-        ).execute()
-        
-        values = result.get('values', [])
-        if not values or len(values) < 2:
-            return {}
-        
-        header = values[0]
-        user_data = {}
-        
-        try:
-            email_col = header.index('EMAIL')
-            entity_col = header.index('ENTITY')
-            role_col = header.index('DEFAULT_ROLE')
-            
-            for row in values[1:]:
-                if len(row) > email_col and row[email_col].strip():
-                    email = row[email_col].strip()
-                    entity = row[entity_col] if entity_col < len(row) else ''
-                    role = row[role_col] if role_col < len(row) else ''
-                    
-                    user_data[email] = {
-                        'entity': entity,
-                        'role': role
-                    }
-        except ValueError:
-            st.error("Required columns not found in snf_user sheet")
-            return {}
-        
-        return user_data
+        return load_user_data()
     except Exception as e:
         st.error(f"Error fetching user data: {e}")
         return {}
@@ -48,6 +48,26 @@ try:
 except Exception:
     form_modules['approver_dashboard'] = None
 
+try:
+    import expiry
+except Exception:
+    expiry = None
+
+try:
+    import digest
+except Exception:
+    digest = None
+
+try:
+    import session_store
+except Exception:
+    session_store = None
+
+try:
+    import refresh_cache
+except Exception:
+    refresh_cache = None
+
 def show_form_error(form_name):
     """Display a simple error message for form loading issues"""
     st.error(f"{form_name} form is not available. Please check your configuration.")
@@ -171,6 +191,27 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
+    # Background sweep that marks approved grants past their validity as Expired
+    if expiry:
+        try:
+            expiry.start_expiry_scheduler()
+        except Exception:
+            pass
+    
+    # Background refresh of reference data, so no page waits for a refetch when it expires
+    if refresh_cache:
+        try:
+            refresh_cache.start_reference_refresher()
+        except Exception:
+            pass
+    
+    # Background sender of approval digests, when notifications are batched
+    if digest and digest.digest_enabled():
+        try:
+            digest.start_digest_scheduler()
+        except Exception:
+            pass
+    
     # Check if any modules are available
     if not any(form_modules.values()):
         st.error("No forms are available. Please check your configuration.")
@@ -220,6 +261,10 @@ def main():
         
         with tab4:
             run_dashboard()
+    
+    # Measured after the forms ran, so it shows what this run left in the session
+    if session_store and session_store.SHOW_SESSION_STATE_SIZE:
+        session_store.render_session_state_size()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,181 @@
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from digest import digest_enabled, queue_request, approval_link
+from request_index import normalize_email
+from config import *
+
+APPROVER_TITLES = {'rm': "RM Approver", 'data': "Data Approver", 'manager': "Manager"}
+ACCENT_COLORS = {'rm': "#007bff", 'data': "#17a2b8", 'manager': "#007bff"}
+
+def plan_recipients(assignments, requester):
+    """Group (approver email, item) pairs into one message per distinct approver.
+
+    Returns (messages, confirm_requester) where messages are [to, cc, items] with
+    each approver's items in order. A requester who is also one of the approvers
+    needs nothing more; otherwise they are CC'd when a single message goes out,
+    and confirm_requester asks for one separate confirmation when several do.
+    """
+    by_approver = {}
+    for approver, item in assignments:
+        if approver:
+            by_approver.setdefault(normalize_email(approver), [approver, None, []])[2].append(item)
+    messages = list(by_approver.values())
+
+    if not requester or normalize_email(requester) in by_approver:
+        return messages, False
+    if len(messages) == 1:
+        messages[0][1] = requester
+        return messages, False
+    return messages, True
+
+def send_messages(messages, on_sent=None):
+    """Send (to, cc, subject, html) messages over one SMTP session; returns (sent, error).
+    on_sent(position) is called as each message goes out, for callers that track progress"""
+    if not messages:
+        return True, None
+    try:
+        with smtplib.SMTP("smtp.gmail.com", 587) as server:
+            server.starttls()
+            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+            for position, (to, cc, subject, html) in enumerate(messages):
+                message = MIMEMultipart("alternative")
+                message["Subject"] = subject
+                message["From"] = EMAIL_SENDER
+                message["To"] = to
+                if cc:
+                    message["Cc"] = cc
+                message.attach(MIMEText(html, "html"))
+                server.sendmail(EMAIL_SENDER, [to] + ([cc] if cc else []), message.as_string())
+                if on_sent:
+                    on_sent(position)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+def details_list(request_id, details):
+    items = "".join(f"<li><strong>{label}:</strong> {value}</li>" for label, value in [("Request ID", request_id)] + details)
+    return f'<ul style="list-style-type: none; padding-left: 0;">{items}</ul>'
+
+def approval_body(kind, user_name, request_id, details, actions):
+    """HTML for one approver; actions are (approver type, approve link, reject link), one per role they hold"""
+    approver_types = [approver_type for approver_type, _, _ in actions]
+    titles = " and ".join(APPROVER_TITLES[approver_type] for approver_type in approver_types)
+    accent = ACCENT_COLORS[approver_types[0]]
+    buttons = "".join(f"""
+        <div style="text-align: center; margin: 30px 0;">
+            <a href='{approve_link}'
+               style="background-color: #28a745; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
+               ✅ APPROVE{f' AS {APPROVER_TITLES[approver_type].upper()}' if len(actions) > 1 else ' REQUEST'}
+            </a>
+            <a href='{reject_link}'
+               style="background-color: #dc3545; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
+               ❌ REJECT{f' AS {APPROVER_TITLES[approver_type].upper()}' if len(actions) > 1 else ' REQUEST'}
+            </a>
+        </div>""" for approver_type, approve_link, reject_link in actions)
+
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #2c3e50;">{kind} - {titles} Approval Required</h2>
+        <p>Dear {titles},</p>
+        <p>The user <strong>{user_name}</strong> has submitted a {kind.lower()} that requires your approval:</p>
+
+        <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid {accent}; margin: 20px 0;">
+            <h3 style="margin-top: 0; color: {accent};">Request Details:</h3>
+            {details_list(request_id, details)}
+        </div>
+        {buttons}
+        <p style="font-size: 12px; color: #666; margin-top: 30px;">
+            <em>Note: Clicking on either button will take you to the approval page where the action will be processed automatically.</em>
+        </p>
+    </body>
+    </html>
+    """
+
+def action_links(actions, labelled):
+    """Compact approve and reject links for a request table; labelled names the role of each pair"""
+    return "<br>".join(f"""
+                <a href='{approve_link}' style="color: #28a745; font-weight: bold;">✅ Approve{f' as {APPROVER_TITLES[approver_type]}' if labelled else ''}</a>
+                &nbsp;
+                <a href='{reject_link}' style="color: #dc3545; font-weight: bold;">❌ Reject{f' as {APPROVER_TITLES[approver_type]}' if labelled else ''}</a>""" for approver_type, approve_link, reject_link in actions)
+
+def grouped_approval_body(kind, user_name, requests):
+    """HTML for one approver listing several requests; requests are (request ID, details, actions)
+    with actions as in approval_body"""
+    approver_types = list(dict.fromkeys(approver_type for _, _, actions in requests for approver_type, _, _ in actions))
+    titles = " and ".join(APPROVER_TITLES[approver_type] for approver_type in approver_types)
+    request_rows = "".join(f"""
+        <tr>
+            <td style="padding: 6px; border-bottom: 1px solid #dee2e6;">{request_id}</td>
+            <td style="padding: 6px; border-bottom: 1px solid #dee2e6;">{'<br>'.join(f'<strong>{label}:</strong> {value}' for label, value in details)}</td>
+            <td style="padding: 6px; border-bottom: 1px solid #dee2e6;">{action_links(actions, len(approver_types) > 1)}
+            </td>
+        </tr>""" for request_id, details, actions in requests)
+
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #2c3e50;">{kind} - {titles} Approval Required</h2>
+        <p>Dear {titles},</p>
+        <p>The user <strong>{user_name}</strong> has submitted {len(requests)} {kind.lower()} that require your approval:</p>
+        <table style="border-collapse: collapse; width: 100%;">
+            <tr style="background-color: #f8f9fa;">
+                <th style="padding: 6px; text-align: left;">Request ID</th>
+                <th style="padding: 6px; text-align: left;">Details</th>
+                <th style="padding: 6px; text-align: left;">Action</th>
+            </tr>
+            {request_rows}
+        </table>
+    </body>
+    </html>
+    """
+
+def confirmation_body(kind, requests, approvers):
+    """HTML telling the requester what was submitted; requests are (request ID, details) pairs"""
+    request_blocks = "".join(f"""
+        <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid #28a745; margin: 20px 0;">
+            {details_list(request_id, details)}
+        </div>""" for request_id, details in requests)
+
+    return f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <h2 style="color: #2c3e50;">{kind} Submitted</h2>
+        <p>Your request has been submitted and sent for approval to {', '.join(approvers)}.</p>
+        {request_blocks}
+    </body>
+    </html>
+    """
+
+def notify_request(kind, user_name, request_id, details, approvers, requester, base_url, link_type=None, **link_params):
+    """Notify the approvers of one request and the requester, each with as few messages as possible.
+
+    approvers are (approver type, email) pairs; an approver holding several roles
+    gets one message with a pair of buttons per role. In digest mode the approvers'
+    notifications are queued and only the requester's confirmation is sent now.
+    Returns (sent, error).
+    """
+    approver_emails = list(dict.fromkeys(approver for _, approver in approvers if approver))
+    if digest_enabled():
+        queue_request(request_id, [("Type", kind), ("User", user_name)] + details, approvers, base_url,
+                      link_type=link_type, **link_params)
+        if normalize_email(requester) in {normalize_email(approver) for approver in approver_emails}:
+            return True, None
+        return send_messages([(requester, None, f"Submitted: {kind}",
+                               confirmation_body(kind, [(request_id, details)], approver_emails))])
+
+    messages, confirm_requester = plan_recipients(
+        [(approver, approver_type) for approver_type, approver in approvers], requester
+    )
+    outgoing = []
+    for to, cc, approver_types in messages:
+        actions = [(approver_type,
+                    approval_link(base_url, request_id, link_type or approver_type, 'approve', to, **link_params),
+                    approval_link(base_url, request_id, link_type or approver_type, 'reject', to, **link_params))
+                   for approver_type in approver_types]
+        outgoing.append((to, cc, f"Approval Needed: {kind}", approval_body(kind, user_name, request_id, details, actions)))
+    if confirm_requester:
+        outgoing.append((requester, None, f"Submitted: {kind}",
+                         confirmation_body(kind, [(request_id, details)], approver_emails)))
+    return send_messages(outgoing)
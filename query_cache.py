@@ -0,0 +1,109 @@
+import streamlit as st
+import os
+import sys
+import pickle
+import threading
+import functools
+from collections import OrderedDict
+import pandas as pd
+
+# Memory the per-user query results of one server process may hold
+QUERY_CACHE_BUDGET = int(float(os.environ.get('QUERY_CACHE_MB', '64')) * 1024 * 1024)
+
+def estimate_size(value):
+    """Approximate bytes held by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    try:
+        return len(pickle.dumps(value))
+    except Exception:
+        return sys.getsizeof(value)
+
+class BoundedCache:
+    """LRU of computed values kept within a memory budget.
+
+    Each entry is charged its estimated size; inserting evicts the least recently
+    used entries until the total fits the budget again. A value larger than the
+    whole budget is returned to the caller but not kept.
+    """
+
+    def __init__(self, budget=QUERY_CACHE_BUDGET):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """(True, value) for a cached key, marked as recently used, or (False, None)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, key, value, size=None):
+        size = estimate_size(value) if size is None else size
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.budget:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.budget:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'budget': self.budget,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+def freeze(value):
+    """Hashable form of an argument (dicts and lists become tuples)"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+@st.cache_resource
+def get_query_cache():
+    """The process-wide cache shared by every session"""
+    return BoundedCache()
+
+def budget_cached(version):
+    """Cache a function's results in the shared bounded cache.
+
+    Entries are keyed by the function, its arguments and version(), so anything
+    that changes the underlying data (e.g. a write patching the request index)
+    makes older entries unreachable; they age out through LRU eviction. DataFrames
+    are handed out as copies so callers cannot change the cached one. Empty frames
+    are not kept: they cost nothing to recompute and are what the error paths return.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (f"{function.__module__}.{function.__qualname__}", freeze(args), freeze(kwargs), version())
+            cache = get_query_cache()
+            found, value = cache.get(key)
+            if not found:
+                value = function(*args, **kwargs)
+                if not (isinstance(value, pd.DataFrame) and value.empty):
+                    cache.put(key, value)
+            return value.copy() if isinstance(value, pd.DataFrame) else value
+        wrapper.uncached = function
+        return wrapper
+    return decorator
@@ -0,0 +1,171 @@
+import streamlit as st
+import os
+import time
+import logging
+import threading
+import functools
+from snapshot import snapshot_enabled, save_snapshot, load_snapshot
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# Oldest reference data ever served; past this a reader waits for a fresh fetch
+REFERENCE_MAX_STALE = int(os.environ.get('REFERENCE_MAX_STALE_SECONDS', str(CACHE_TTL * 6)))
+REFRESH_CHECK_INTERVAL = 30   # seconds between checks for entries due a scheduled refresh
+FAILED_LOAD_RETRY = 30        # seconds a failed load with nothing to fall back on is reported before retrying
+
+REFRESHING_CACHES = []
+
+class RefreshingCache:
+    """Last good result of a loader per argument tuple, refreshed in the background.
+
+    A value younger than ttl is served as is. An older one is still served right
+    away while one background thread fetches its replacement; a failed refresh keeps
+    the last good value. Only a value older than max_stale (or a first load) makes
+    the reader wait; a load that failed is re-raised for FAILED_LOAD_RETRY seconds
+    rather than retried on every rerun. Dependents (e.g. a search index built from
+    this data) are refreshed on the same thread right after this cache.
+
+    With snapshot set, every fetched value is also saved to disk, and a process
+    starting cold serves the saved copy as of when it was saved: like any entry it is
+    refetched in the background once older than ttl, and never used past max_stale.
+    """
+
+    def __init__(self, loader, ttl, max_stale, snapshot=False):
+        self.loader = loader
+        self.name = loader.__qualname__
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.snapshot = snapshot and snapshot_enabled()
+        self.restored = set()   # args whose snapshot has been looked for
+        self.lock = threading.Lock()
+        self.entries = {}    # args -> (value, fetched at)
+        self.loading = {}    # args -> lock held while that entry is fetched
+        self.failures = {}   # args -> (exception, failed at) of the last load that failed
+        self.dependents = []
+
+    def loading_lock(self, args):
+        with self.lock:
+            return self.loading.setdefault(args, threading.Lock())
+
+    def fetch(self, args):
+        value = self.loader(*args)
+        with self.lock:
+            self.entries[args] = (value, time.time())
+        if self.snapshot:
+            try:
+                save_snapshot(f"{self.loader.__module__}.{self.name}", args, value)
+            except Exception:
+                logger.exception("Saving the %s snapshot failed", self.name)
+        for dependent in self.dependents:
+            for dependent_args in list(dependent.entries):
+                try:
+                    dependent.fetch(dependent_args)
+                except Exception:
+                    logger.exception("Refreshing %s failed", dependent.name)
+        return value
+
+    def age(self, args):
+        entry = self.entries.get(args)
+        return time.time() - entry[1] if entry else None
+
+    def restore(self, args):
+        """Seed an entry from its on-disk snapshot, once per process, keeping the time it was
+        fetched; snapshots older than max_stale are ignored"""
+        with self.lock:
+            if args in self.restored:
+                return None
+            self.restored.add(args)
+        snapshot = load_snapshot(f"{self.loader.__module__}.{self.name}", args, self.max_stale)
+        if snapshot is None:
+            return None
+        with self.lock:
+            return self.entries.setdefault(args, snapshot)
+
+    def get(self, args):
+        entry = self.entries.get(args)
+        if entry is None and self.snapshot:
+            entry = self.restore(args)
+        if entry is None or time.time() - entry[1] >= self.max_stale:
+            return self.load(args)
+        if time.time() - entry[1] >= self.ttl:
+            self.refresh_in_background(args)
+        return entry[0]
+
+    def load(self, args):
+        """Fetch and wait; a fetch another thread just finished is used instead"""
+        with self.loading_lock(args):
+            age = self.age(args)
+            if age is not None and age < self.ttl:
+                return self.entries[args][0]
+            failure = self.failures.get(args)
+            if failure and time.time() - failure[1] < FAILED_LOAD_RETRY:
+                raise failure[0]
+            try:
+                value = self.fetch(args)
+            except Exception as e:
+                self.failures[args] = (e, time.time())
+                raise
+            self.failures.pop(args, None)
+            return value
+
+    def refresh_in_background(self, args):
+        """Start a refresh unless one is already running for these arguments"""
+        loading = self.loading_lock(args)
+        if not loading.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.fetch(args)
+            except Exception:
+                logger.exception("Refreshing %s failed", self.name)
+            finally:
+                loading.release()
+
+        threading.Thread(target=run, name=f"refresh-{self.name}", daemon=True).start()
+
+    def refresh_due(self, lead):
+        """Refresh, in the background, every entry that will pass ttl within lead seconds"""
+        for args in list(self.entries):
+            age = self.age(args)
+            if age is not None and age >= self.ttl - lead:
+                self.refresh_in_background(args)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.failures.clear()
+
+def stale_while_revalidate(ttl=CACHE_TTL, max_stale=REFERENCE_MAX_STALE, depends_on=None, snapshot=False):
+    """Cache a loader's last good result per arguments, serving it while it is refreshed.
+    The loader must raise on failure rather than return a placeholder, so a failed
+    refresh never replaces good data. depends_on is another cached loader whose
+    refreshes should also rebuild this one; snapshot keeps a copy on disk for cold starts."""
+    def decorator(loader):
+        cache = RefreshingCache(loader, ttl, max_stale, snapshot)
+        REFRESHING_CACHES.append(cache)
+        if depends_on is not None:
+            depends_on.cache.dependents.append(cache)
+
+        @functools.wraps(loader)
+        def wrapper(*args):
+            return cache.get(args)
+        wrapper.cache = cache
+        wrapper.clear = cache.clear
+        return wrapper
+    return decorator
+
+@st.cache_resource
+def start_reference_refresher(interval=REFRESH_CHECK_INTERVAL):
+    """Start one background thread per process that refreshes reference data before it
+    goes stale, so readers normally never see an expired entry; returns its stop event"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            for cache in REFRESHING_CACHES:
+                cache.refresh_due(interval)
+
+    threading.Thread(target=run, name="reference-refresher", daemon=True).start()
+    return stop
@@ -0,0 +1,89 @@
+import re
+import datetime
+import secrets
+import threading
+import time
+from config import *
+
+# REQ_<date>_<time>_<millis>_<random>: issued in UTC
+REQUEST_ID_TIMESTAMP = re.compile(r'_(\d{8})_(\d{6})_(\d{3})_[0-9A-Z]{10}$')
+# Older REQ_<date>_<time>_<number> IDs were issued in server local time
+LEGACY_REQUEST_ID_TIMESTAMP = re.compile(r'_(\d{8})_(\d{6})_\d+$')
+
+# ULID-style suffix: milliseconds, then a random part in Crockford base32 that is
+# incremented (not redrawn) for IDs issued within the same millisecond
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+RANDOM_CHARS = 10
+RANDOM_BITS = RANDOM_CHARS * 5
+
+def encode_base32(number, width):
+    """Fixed-width Crockford base32, so encoded values sort like the numbers"""
+    chars = []
+    for _ in range(width):
+        number, remainder = divmod(number, 32)
+        chars.append(CROCKFORD_BASE32[remainder])
+    return ''.join(reversed(chars))
+
+class RequestIdGenerator:
+    """Monotonic, lexicographically sortable request IDs.
+
+    IDs look like REQ_20250114_093015_123_7ZK3M9QX2A: UTC submission date and
+    time, milliseconds, and a random part; UTC keeps them sorted when clocks
+    change for DST. Within one process every ID sorts after the previous one
+    even if the clock steps back; across processes the 50 random bits make
+    collisions practically impossible.
+    """
+
+    def __init__(self, prefix=REQUEST_PREFIX):
+        self.prefix = prefix
+        self.last_millis = 0
+        self.last_random = 0
+        self.lock = threading.Lock()
+
+    def new_id(self):
+        with self.lock:
+            millis = time.time_ns() // 1_000_000
+            if millis <= self.last_millis:
+                millis = self.last_millis
+                self.last_random += 1
+                if self.last_random >= 1 << RANDOM_BITS:
+                    millis += 1
+                    self.last_random = secrets.randbits(RANDOM_BITS - 1)
+            else:
+                # Leave headroom so increments within a millisecond never overflow
+                self.last_random = secrets.randbits(RANDOM_BITS - 1)
+            self.last_millis = millis
+            random_part = self.last_random
+
+        issued_at = datetime.datetime.fromtimestamp(millis / 1000, tz=datetime.timezone.utc)
+        return (f"{self.prefix}_{issued_at.strftime('%Y%m%d_%H%M%S')}_{millis % 1000:03d}_"
+                f"{encode_base32(random_part, RANDOM_CHARS)}")
+
+_generator = RequestIdGenerator()
+
+def new_request_id():
+    """Next request ID from the process-wide generator"""
+    return _generator.new_id()
+
+def request_timestamp(request_id):
+    """Submission time encoded in a request ID, as naive local time, or None if it cannot be parsed"""
+    request_id = request_id or ''
+    match = REQUEST_ID_TIMESTAMP.search(request_id)
+    legacy = match is None
+    if legacy:
+        match = LEGACY_REQUEST_ID_TIMESTAMP.search(request_id)
+        if not match:
+            return None
+    try:
+        issued_at = datetime.datetime.strptime(match.group(1) + match.group(2), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    if legacy:
+        return issued_at
+    issued_at += datetime.timedelta(milliseconds=int(match.group(3)))
+    return issued_at.replace(tzinfo=datetime.timezone.utc).astimezone().replace(tzinfo=None)
+
+def request_sort_key(request_id):
+    """Key that orders request IDs by submission time, legacy and current formats alike"""
+    issued_at = request_timestamp(request_id)
+    return (issued_at.strftime('%Y%m%d%H%M%S%f') if issued_at else '') + (request_id or '')
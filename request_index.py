@@ -0,0 +1,328 @@
+import streamlit as st
+import pandas as pd
+import datetime
+import threading
+import itertools
+from storage import get_storage
+from request_ids import request_timestamp
+from event_log import append_event, SUBMITTED_EVENT, STATUS_EVENT
+from config import *
+
+REQUEST_SHEETS = ['responses', 'user_responses']
+# A request missing from the index can only be one submitted since the index (and the shared tab cache) was read
+RECENT_REQUEST_WINDOW = datetime.timedelta(seconds=2 * CACHE_TTL)
+_index_builds = itertools.count()
+
+# Header names (with alternatives) of the columns the index keys on
+REQUEST_ID_COLUMNS = ['REQUEST_ID', 'Request_id']
+REQUESTER_COLUMNS = {
+    'responses': ['EMAIL'],
+    'user_responses': ['User'],
+}
+APPROVER_COLUMNS = {
+    'responses': {'rm': ['RM_APPROVER', 'RM_Approver'], 'data': ['DATA_APPROVER', 'Data_Approver']},
+    'user_responses': {'manager': ['Manager_Email', 'Manager_email', 'Manager', 'Manager_email_id']},
+}
+# Sheet and status column updated by each approver type
+STATUS_COLUMNS = {
+    'rm': ('responses', 'RM_APPROVER_STATUS'),
+    'data': ('responses', 'DATA_APPROVER_STATUS'),
+    'manager': ('user_responses', 'Approval_status'),
+}
+
+def find_column(header, names):
+    """Index of the first header name present, or None"""
+    return next((header.index(name) for name in names if name in header), None)
+
+def normalize_email(email):
+    """Emails are matched case-insensitively, ignoring surrounding spaces"""
+    return (email or '').strip().lower()
+
+class SheetIndex:
+    """In-memory copy of one request tab, indexed by request ID, requester and approver"""
+
+    def __init__(self, sheet_name, values):
+        self.sheet_name = sheet_name
+        self.header = list(values[0]) if values else []
+        self.request_id_col = find_column(self.header, REQUEST_ID_COLUMNS)
+        self.requester_col = find_column(self.header, REQUESTER_COLUMNS[sheet_name])
+        self.approver_cols = {
+            approver_type: find_column(self.header, names)
+            for approver_type, names in APPROVER_COLUMNS[sheet_name].items()
+        }
+        self.rows = []
+        self.positions = {}      # request_id -> position in rows
+        self.by_requester = {}   # requester email -> positions
+        self.by_approver = {}    # (approver type, approver email) -> positions
+        for row in values[1:]:
+            self.add_row(row)
+
+    def cell(self, row, col):
+        return row[col] if col is not None and col < len(row) else ''
+
+    def add_row(self, row):
+        """Index a row appended at the bottom of the tab; rows already indexed are ignored"""
+        # Sheets hands every cell back as a string; keep patched rows the same
+        row = ['' if value is None else str(value) for value in row]
+        request_id = self.cell(row, self.request_id_col)
+        if request_id and request_id in self.positions:
+            return
+        position = len(self.rows)
+        self.rows.append(row)
+        if request_id:
+            self.positions[request_id] = position
+        requester = normalize_email(self.cell(row, self.requester_col))
+        if requester:
+            self.by_requester.setdefault(requester, []).append(position)
+        for approver_type, col in self.approver_cols.items():
+            approver = normalize_email(self.cell(row, col))
+            if approver:
+                self.by_approver.setdefault((approver_type, approver), []).append(position)
+
+    def row_statuses(self, row):
+        """Approval statuses of a row by approver type"""
+        return {
+            approver_type: self.cell(row, find_column(self.header, [column]))
+            for approver_type, (sheet_name, column) in STATUS_COLUMNS.items()
+            if sheet_name == self.sheet_name
+        }
+
+    def set_cell(self, request_id, column_name, value):
+        """Patch one cell of an indexed request; returns False if either is unknown"""
+        position = self.positions.get(request_id)
+        if position is None or column_name not in self.header:
+            return False
+        col = self.header.index(column_name)
+        row = self.rows[position]
+        if len(row) <= col:
+            row.extend([''] * (col + 1 - len(row)))
+        row[col] = value
+        return True
+
+    def row_number(self, request_id):
+        """1-based sheet row of a request as last seen, or None"""
+        position = self.positions.get(request_id)
+        return position + 2 if position is not None else None
+
+    def values_at(self, positions):
+        """Header plus the rows at the given positions, in sheet order"""
+        return [self.header] + [list(self.rows[position]) for position in sorted(set(positions))]
+
+class RequestIndex:
+    """Process-wide index of the request tabs that every write patches in place"""
+
+    def __init__(self, values_by_sheet):
+        self.lock = threading.RLock()
+        # Serializes status writes from this process; held across the Sheets round trips
+        self.write_lock = threading.Lock()
+        self.sheets = {name: SheetIndex(name, values) for name, values in values_by_sheet.items()}
+        # Changes with every rebuild and every write-through, so results derived from the index can be keyed on it
+        self.build = next(_index_builds)
+        self.version = 0
+
+    def stamp(self):
+        """(build, version) of the index contents"""
+        with self.lock:
+            return self.build, self.version
+
+    def header(self, sheet_name):
+        return list(self.sheets[sheet_name].header)
+
+    def user_values(self, sheet_name, user_email):
+        """Header plus every row the user submitted"""
+        with self.lock:
+            sheet = self.sheets[sheet_name]
+            return sheet.values_at(sheet.by_requester.get(normalize_email(user_email), []))
+
+    def approver_values(self, sheet_name, approver_email, approver_types):
+        """Header plus every row assigned to the approver under any of the given approver types"""
+        with self.lock:
+            sheet = self.sheets[sheet_name]
+            approver_email = normalize_email(approver_email)
+            positions = []
+            for approver_type in approver_types:
+                positions.extend(sheet.by_approver.get((approver_type, approver_email), []))
+            return sheet.values_at(positions)
+
+    def latest_status(self, sheet_name, user_email, status_column):
+        """Status of the user's most recent request on a tab, or None if they have none"""
+        with self.lock:
+            sheet = self.sheets[sheet_name]
+            positions = sheet.by_requester.get(normalize_email(user_email))
+            if not positions:
+                return None
+            status_col = sheet.header.index(status_column) if status_column in sheet.header else None
+            return sheet.cell(sheet.rows[positions[-1]], status_col)
+
+    def request_values(self, sheet_name, request_id):
+        """Header plus the row of one request (just the header if unknown)"""
+        with self.lock:
+            sheet = self.sheets[sheet_name]
+            position = sheet.positions.get(request_id)
+            return sheet.values_at([] if position is None else [position])
+
+    def request_row(self, sheet_name, request_id):
+        """Copy of the row of one request, or None if unknown"""
+        with self.lock:
+            sheet = self.sheets[sheet_name]
+            position = sheet.positions.get(request_id)
+            return list(sheet.rows[position]) if position is not None else None
+
+    def row_number(self, sheet_name, request_id):
+        """1-based sheet row of a request as last seen, or None"""
+        with self.lock:
+            return self.sheets[sheet_name].row_number(request_id)
+
+    def add_rows(self, sheet_name, rows):
+        """Write-through for rows just appended to a request tab"""
+        with self.lock:
+            for row in rows:
+                self.sheets[sheet_name].add_row(row)
+            self.version += 1
+
+    def set_status(self, request_id, approver_type, status):
+        """Write-through for an approval status change; the version only moves if a cell changed"""
+        sheet_name, column_name = STATUS_COLUMNS[approver_type]
+        with self.lock:
+            updated = self.sheets[sheet_name].set_cell(request_id, column_name, status)
+            if updated:
+                self.version += 1
+            return updated
+
+def sheet_values_to_frame(values):
+    """Turn raw sheet rows into a frame padded to the header width (missing cells are None)"""
+    header = values[0]
+    frame = pd.DataFrame(values[1:])
+    return frame.reindex(columns=range(max(len(header), frame.shape[1])))
+
+def row_last_values(frame):
+    """Last populated cell of each row, matching row[-1] on the raw sheet rows"""
+    return frame.ffill(axis=1).iloc[:, -1].fillna('')
+
+def load_request_values():
+    """Read both request tabs in one batch call"""
+    return get_storage().read_tabs(REQUEST_SHEETS)
+
+@st.cache_resource(ttl=CACHE_TTL)
+def get_request_index():
+    """Shared request index, rebuilt from Sheets every CACHE_TTL to pick up other writers"""
+    return RequestIndex(load_request_values())
+
+def request_index_stamp():
+    """Version of the shared request index, for caching results derived from it"""
+    return get_request_index().stamp()
+
+def locate_row(storage, sheet_name, request_id_col, request_id):
+    """1-based row holding a request, found by reading just the request ID column, or None"""
+    request_ids = storage.read_columns(sheet_name, [request_id_col])[0]
+    for row_number, cell in enumerate(request_ids, start=1):
+        if row_number > 1 and cell == request_id:
+            return row_number
+    return None
+
+def submitted_recently(request_id, now=None):
+    """Whether a request ID was issued recently enough to be missing from the index"""
+    submitted_at = request_timestamp(request_id)
+    now = now or datetime.datetime.now()
+    return submitted_at is not None and now - RECENT_REQUEST_WINDOW <= submitted_at <= now + RECENT_REQUEST_WINDOW
+
+def request_parties(request_id, approver_type):
+    """(assigned approver, requester) of a request for an approver type, or None if unknown.
+
+    A request missing from the index is looked up with a read of the request ID
+    column and its row, and only when its ID says it was submitted recently, so
+    made-up IDs cost no reads and never force the shared index to be rebuilt.
+    """
+    sheet_name, _ = STATUS_COLUMNS[approver_type]
+    index = get_request_index()
+    sheet = index.sheets[sheet_name]
+    row = index.request_row(sheet_name, request_id)
+    if row is None:
+        if sheet.request_id_col is None or not submitted_recently(request_id):
+            return None
+        storage = get_storage()
+        row_number = locate_row(storage, sheet_name, sheet.request_id_col, request_id)
+        if not row_number:
+            return None
+        row = storage.read_row(sheet_name, row_number, len(sheet.header))
+    return sheet.cell(row, sheet.approver_cols[approver_type]), sheet.cell(row, sheet.requester_col)
+
+def log_event(event, request_id, **fields):
+    """Record a transition in the local event log; logging never fails a write"""
+    try:
+        append_event(event, request_id, **fields)
+    except Exception:
+        pass
+
+def record_appended_rows(sheet_name, rows):
+    """Patch the index after rows were appended to a request tab, and log the submissions"""
+    try:
+        index = get_request_index()
+        index.add_rows(sheet_name, rows)
+    except Exception:
+        return
+    sheet = index.sheets[sheet_name]
+    for row in rows:
+        log_event(SUBMITTED_EVENT, sheet.cell(row, sheet.request_id_col), sheet=sheet_name,
+                  requester=sheet.cell(row, sheet.requester_col), statuses=sheet.row_statuses(row))
+
+def record_status_change(request_id, approver_type, status, actor='', **fields):
+    """Patch the index after an approval status was written, and log the transition"""
+    try:
+        get_request_index().set_status(request_id, approver_type, status)
+    except Exception:
+        pass
+    log_event(STATUS_EVENT, request_id, sheet=STATUS_COLUMNS[approver_type][0],
+              approver_type=approver_type, status=status, actor=actor, **fields)
+
+def transition_status(request_id, approver_type, new_status, from_statuses=(PENDING_STATUS,), actor='', reason=''):
+    """Compare-and-set one approval status cell.
+
+    The row comes from the request index and is confirmed with a read of just that
+    row, so the request ID and current status are checked right before the write.
+    Only when the row has moved is the request ID column read to find it again.
+    Setting the status a request already has succeeds without writing. A reason
+    (e.g. for a rejection) is recorded with the transition in the event log. Returns
+    (success, message, row), where row is the request's row after the update.
+    """
+    sheet_name, status_column = STATUS_COLUMNS[approver_type]
+    index = get_request_index()
+    sheet_index = index.sheets[sheet_name]
+    header = sheet_index.header
+    request_id_col = sheet_index.request_id_col
+    if request_id_col is None or status_column not in header:
+        return False, f"The {sheet_name} tab has no request ID or {status_column} column", None
+    status_col = header.index(status_column)
+    storage = get_storage()
+
+    def read_row(row_number):
+        return storage.read_row(sheet_name, row_number, len(header))
+
+    with index.write_lock:
+        row_number = index.row_number(sheet_name, request_id)
+        row = read_row(row_number) if row_number else []
+        moved = sheet_index.cell(row, request_id_col) != request_id
+        if moved:
+            # Rows were added or removed by someone else since the index was built
+            row_number = locate_row(storage, sheet_name, request_id_col, request_id)
+            if not row_number:
+                return False, "Request ID not found", None
+            row = read_row(row_number)
+
+        current_status = sheet_index.cell(row, status_col) or PENDING_STATUS
+        if current_status != new_status:
+            if current_status not in from_statuses:
+                if not moved:
+                    index.set_status(request_id, approver_type, current_status)
+                return False, f"Request is already {current_status}", row
+            storage.update_cells(sheet_name, [(row_number, status_col, new_status)])
+            log_event(STATUS_EVENT, request_id, sheet=sheet_name, approver_type=approver_type,
+                      status=new_status, actor=actor, **({'reason': reason} if reason else {}))
+
+        row = row + [''] * (status_col + 1 - len(row))
+        row[status_col] = new_status
+        if moved:
+            get_request_index.clear()
+        else:
+            index.set_status(request_id, approver_type, new_status)
+        return True, f"Request {new_status.lower()}", row
@@ -0,0 +1,163 @@
+import heapq
+import math
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+NGRAM_SIZE = 3
+DEFAULT_LIMIT = 20
+MIN_SIMILARITY = 0.4
+
+def normalize(text):
+    """Normalize text for matching"""
+    return str(text).strip().lower()
+
+def ngrams(text, size=NGRAM_SIZE):
+    """Distinct n-grams of an already normalized string"""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class NgramIndex:
+    """Prefix and n-gram index over a fixed set of records.
+
+    Each record exposes one or more search keys through key_func; those are
+    indexed by n-gram and by prefix. prefix_func can add keys that are only
+    needed for prefix lookups (such as a name already contained in a longer
+    key). Identical key texts are stored once, so catalogs that repeat the
+    same column name across many tables stay cheap to search. Records are
+    kept in the order given, so callers should pass them best-first (for
+    example shortest name first) to get sensible ordering among equal matches.
+    """
+
+    def __init__(self, records, key_func, prefix_func=None):
+        self.records = tuple(records)
+        self.key_texts = []     # distinct normalized key text per key id
+        self.key_records = []   # record ids per key id, ascending
+        self.key_sizes = []     # n-gram count per key id
+        key_ids = {}
+        postings = defaultdict(list)
+        prefix_records = defaultdict(list)
+
+        for record_id, record in enumerate(self.records):
+            for key in key_func(record):
+                text = normalize(key)
+                if not text:
+                    continue
+                key_id = key_ids.get(text)
+                if key_id is None:
+                    key_id = key_ids[text] = len(self.key_texts)
+                    grams = ngrams(text)
+                    self.key_texts.append(text)
+                    self.key_records.append([])
+                    self.key_sizes.append(len(grams))
+                    for gram in grams:
+                        postings[gram].append(key_id)
+                self.key_records[key_id].append(record_id)
+                prefix_records[text].append(record_id)
+            if prefix_func:
+                for key in prefix_func(record):
+                    prefix_records[normalize(key)].append(record_id)
+
+        # n-gram -> key ids in order of first appearance
+        self.postings = dict(postings)
+        # Sorted texts for prefix lookups by bisection
+        self.prefix_records = dict(prefix_records)
+        self.prefix_keys = sorted(self.prefix_records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _collect(self, record_lists, limit, seen):
+        """Flatten record id lists in order, skipping seen ids, up to limit"""
+        matches = []
+        for record_ids in record_lists:
+            for record_id in record_ids:
+                if record_id not in seen:
+                    seen.add(record_id)
+                    matches.append(record_id)
+                    if len(matches) >= limit:
+                        return matches
+        return matches
+
+    def prefix_matches(self, query, limit=DEFAULT_LIMIT, seen=None):
+        """Record ids with a key starting with query, alphabetically by key"""
+        seen = set() if seen is None else seen
+        prefix_keys = self.prefix_keys
+
+        def matching_keys():
+            for position in range(bisect_left(prefix_keys, query), len(prefix_keys)):
+                text = prefix_keys[position]
+                if not text.startswith(query):
+                    return
+                yield self.prefix_records[text]
+
+        return self._collect(matching_keys(), limit, seen)
+
+    def substring_matches(self, query, limit=DEFAULT_LIMIT, seen=None):
+        """Record ids with a key containing query, in key order"""
+        seen = set() if seen is None else seen
+        grams = ngrams(query)
+        if not grams:
+            return []
+
+        # Scan only the rarest n-gram's postings; the substring test does the rest
+        postings = [self.postings.get(gram) for gram in grams]
+        if not all(postings):
+            return []
+        rarest = min(postings, key=len)
+
+        return self._collect(
+            (self.key_records[key_id] for key_id in rarest if query in self.key_texts[key_id]),
+            limit, seen
+        )
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Type-ahead lookup: prefix matches first, then substring matches"""
+        query = normalize(query)
+        if not query:
+            return []
+
+        seen = set()
+        record_ids = self.prefix_matches(query, limit, seen)
+        if len(record_ids) < limit and len(query) >= NGRAM_SIZE:
+            record_ids += self.substring_matches(query, limit - len(record_ids), seen)
+        return [self.records[record_id] for record_id in record_ids]
+
+    def fuzzy_search(self, query, limit=DEFAULT_LIMIT, min_similarity=MIN_SIMILARITY):
+        """Ranked lookup: exact, prefix and substring hits first, then by n-gram similarity"""
+        query = normalize(query)
+        if not query:
+            return []
+
+        grams = ngrams(query)
+        if not grams:
+            return [self.records[record_id] for record_id in self.prefix_matches(query, limit)]
+
+        # Count shared n-grams per key straight from the postings
+        shared = Counter()
+        for gram in grams:
+            key_ids = self.postings.get(gram)
+            if key_ids:
+                shared.update(key_ids)
+
+        # A key needs at least this many shared n-grams to reach min_similarity
+        min_shared = max(1, math.ceil(min_similarity * len(grams) / 2))
+        scored = []
+        for key_id, count in shared.items():
+            if count < min_shared:
+                continue
+            text = self.key_texts[key_id]
+            similarity = 2 * count / (len(grams) + self.key_sizes[key_id])
+            if text == query:
+                rank = 3
+            elif text.startswith(query):
+                rank = 2
+            elif query in text:
+                rank = 1
+            elif similarity >= min_similarity:
+                rank = 0
+            else:
+                continue
+            scored.append((rank, similarity, -key_id))
+
+        top = heapq.nlargest(limit, scored)
+        record_ids = self._collect((self.key_records[-key_id] for _, _, key_id in top), limit, set())
+        return [self.records[record_id] for record_id in record_ids]
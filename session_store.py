@@ -0,0 +1,64 @@
+import streamlit as st
+import os
+import sys
+import pickle
+from collections import OrderedDict
+
+# Transient keys a session keeps per namespace; the least recently used are dropped beyond this
+SESSION_TRANSIENT_LIMIT = int(os.environ.get('SESSION_TRANSIENT_LIMIT', '32'))
+# Show each session's state size in the sidebar (for spotting sessions that grow)
+SHOW_SESSION_STATE_SIZE = os.environ.get('SHOW_SESSION_STATE_SIZE', '') == '1'
+
+TRANSIENT_PREFIX = '_transient.'
+
+def ensure_defaults(defaults):
+    """Set session keys that are not set yet"""
+    for key, value in defaults.items():
+        if key not in st.session_state:
+            st.session_state[key] = value
+
+def transient_keys(namespace):
+    """The namespace's LRU of transient keys, held under one session key"""
+    state_key = TRANSIENT_PREFIX + namespace
+    if state_key not in st.session_state:
+        st.session_state[state_key] = OrderedDict()
+    return st.session_state[state_key]
+
+def remember(namespace, key, value, limit=SESSION_TRANSIENT_LIMIT):
+    """Store a transient value (e.g. a per-form-combination flag), evicting the least recently used"""
+    entries = transient_keys(namespace)
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > limit:
+        entries.popitem(last=False)
+
+def recall(namespace, key, default=None):
+    """A transient value, marked as recently used; default if it was never set or was evicted"""
+    entries = transient_keys(namespace)
+    if key not in entries:
+        return default
+    entries.move_to_end(key)
+    return entries[key]
+
+def forget(namespace, key):
+    transient_keys(namespace).pop(key, None)
+
+def value_size(value):
+    """Bytes a session value takes when serialized, or its in-memory size if it cannot be pickled"""
+    try:
+        return len(pickle.dumps(value))
+    except Exception:
+        return sys.getsizeof(value)
+
+def session_state_size():
+    """(total bytes, [(key, bytes)] largest first) of the current session's state"""
+    sizes = sorted(((str(key), value_size(value)) for key, value in st.session_state.items()),
+                   key=lambda item: item[1], reverse=True)
+    return sum(size for _, size in sizes), sizes
+
+def render_session_state_size(top=10):
+    """Sidebar summary of this session's state, with its largest keys"""
+    total, sizes = session_state_size()
+    with st.sidebar.expander(f"Session state: {len(sizes)} keys, {total / 1024:.1f} KB"):
+        for key, size in sizes[:top]:
+            st.caption(f"{key}: {size / 1024:.1f} KB")
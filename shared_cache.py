@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+# How long a lock holder may take to refresh before another process takes over
+REFRESH_LEASE = 60
+# How long a process waits for another one's refresh before fetching itself
+REFRESH_WAIT = 15
+REFRESH_POLL = 0.2
+
+class SharedTabCache:
+    """Tab values shared by every server process on the host through one SQLite file.
+
+    Rows are stored as the JSON the storage backend returned, stamped with the
+    time they were fetched. A lease row per tab set serializes refreshes, so when
+    the cache goes stale one thread fetches from the backend and the others read
+    its result. Every invalidation bumps the tab's generation; a refresh that was
+    overtaken by a write is not stored, so pre-write rows never outlive the write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tab_cache ('
+                'tab TEXT PRIMARY KEY, fetched_at REAL NOT NULL, rows TEXT NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS refresh_lease ('
+                'name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tab_generation ('
+                'tab TEXT PRIMARY KEY, generation INTEGER NOT NULL)'
+            )
+
+    @property
+    def owner(self):
+        """Lease owner: the calling thread of this process"""
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, tabs, max_age):
+        """Cached rows of the tabs fetched within max_age seconds"""
+        cutoff = time.time() - max_age
+        placeholders = ','.join('?' * len(tabs))
+        with closing(self.connect()) as connection:
+            found = connection.execute(
+                f'SELECT tab, rows FROM tab_cache WHERE fetched_at >= ? AND tab IN ({placeholders})',
+                (cutoff, *tabs)
+            ).fetchall()
+        return {tab: json.loads(rows) for tab, rows in found}
+
+    def generations(self, tabs):
+        """Current invalidation generation of each tab"""
+        placeholders = ','.join('?' * len(tabs))
+        with closing(self.connect()) as connection:
+            found = dict(connection.execute(
+                f'SELECT tab, generation FROM tab_generation WHERE tab IN ({placeholders})', tuple(tabs)
+            ).fetchall())
+        return {tab: found.get(tab, 0) for tab in tabs}
+
+    def put(self, values_by_tab, generations=None):
+        """Store fetched rows, skipping tabs invalidated since generations was read"""
+        now = time.time()
+        with closing(self.connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if generations is not None:
+                current = dict(connection.execute(
+                    f"SELECT tab, generation FROM tab_generation WHERE tab IN ({','.join('?' * len(values_by_tab))})",
+                    tuple(values_by_tab)
+                ).fetchall())
+                values_by_tab = {
+                    tab: rows for tab, rows in values_by_tab.items()
+                    if current.get(tab, 0) == generations.get(tab, 0)
+                }
+            connection.executemany(
+                'INSERT OR REPLACE INTO tab_cache (tab, fetched_at, rows) VALUES (?, ?, ?)',
+                [(tab, now, json.dumps(rows)) for tab, rows in values_by_tab.items()]
+            )
+
+    def invalidate(self, tabs):
+        with closing(self.connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('DELETE FROM tab_cache WHERE tab = ?', [(tab,) for tab in tabs])
+            connection.executemany(
+                'INSERT INTO tab_generation (tab, generation) VALUES (?, 1) '
+                'ON CONFLICT(tab) DO UPDATE SET generation = generation + 1',
+                [(tab,) for tab in tabs]
+            )
+
+    def acquire(self, name, lease=REFRESH_LEASE):
+        """Take the named refresh lease unless another live thread holds it"""
+        now = time.time()
+        with closing(self.connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            held = connection.execute(
+                'SELECT owner, expires_at FROM refresh_lease WHERE name = ?', (name,)
+            ).fetchone()
+            if held and held[0] != self.owner and held[1] > now:
+                return False
+            connection.execute(
+                'INSERT OR REPLACE INTO refresh_lease (name, owner, expires_at) VALUES (?, ?, ?)',
+                (name, self.owner, now + lease)
+            )
+            return True
+
+    def release(self, name):
+        with closing(self.connect()) as connection, connection:
+            connection.execute('DELETE FROM refresh_lease WHERE name = ? AND owner = ?', (name, self.owner))
+
+    def read_through(self, tabs, max_age, fetch):
+        """Fresh cached rows of the tabs, with missing ones fetched by exactly one thread at a time"""
+        values_by_tab = self.get(tabs, max_age)
+        deadline = time.time() + REFRESH_WAIT
+        while len(values_by_tab) < len(tabs):
+            missing = [tab for tab in tabs if tab not in values_by_tab]
+            lease = 'refresh:' + ','.join(sorted(missing))
+            if self.acquire(lease):
+                try:
+                    generations = self.generations(missing)
+                    fetched = fetch(missing)
+                    self.put(fetched, generations)
+                finally:
+                    self.release(lease)
+                values_by_tab.update(fetched)
+            elif time.time() >= deadline:
+                # The refreshing process is slow or stuck; don't hold this page up any longer
+                values_by_tab.update(fetch(missing))
+            else:
+                time.sleep(REFRESH_POLL)
+                values_by_tab.update(self.get(missing, max_age))
+        return {tab: values_by_tab[tab] for tab in tabs}
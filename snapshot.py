@@ -0,0 +1,59 @@
+import os
+import time
+import mmap
+import pickle
+import hashlib
+import copyreg
+from types import MappingProxyType
+
+# Directory of on-disk snapshots of parsed reference data; empty turns snapshots off
+SNAPSHOT_DIR = os.environ.get('REFERENCE_SNAPSHOT_DIR', 'reference_snapshots')
+# Bump whenever the shape of the parsed data changes, so older snapshots are never loaded
+SNAPSHOT_VERSION = 1
+
+def read_only_mapping(items):
+    return MappingProxyType(items)
+
+# Parsed records are shared as read-only mappings; snapshots store them as the dicts they
+# wrap. Only the snapshot pickler uses this table, the process-wide one is left alone.
+SNAPSHOT_DISPATCH_TABLE = dict(copyreg.dispatch_table)
+SNAPSHOT_DISPATCH_TABLE[MappingProxyType] = lambda mapping: (read_only_mapping, (dict(mapping),))
+
+def snapshot_enabled():
+    return bool(SNAPSHOT_DIR)
+
+def snapshot_path(name, args=()):
+    """File of one cached result; arguments, if any, are folded into a short hash"""
+    suffix = f"-{hashlib.sha256(repr(args).encode('utf-8')).hexdigest()[:12]}" if args else ''
+    return os.path.join(SNAPSHOT_DIR, f"{name}{suffix}.v{SNAPSHOT_VERSION}.pickle")
+
+def save_snapshot(name, args, value):
+    """Write a snapshot atomically, so a reader never sees half a file"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(name, args)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as snapshot_file:
+            pickler = pickle.Pickler(snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.dispatch_table = SNAPSHOT_DISPATCH_TABLE
+            pickler.dump({'version': SNAPSHOT_VERSION, 'name': name, 'saved_at': time.time(), 'value': value})
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def load_snapshot(name, args, max_age):
+    """(value, saved at) of a snapshot of this version no older than max_age seconds, or None"""
+    path = snapshot_path(name, args)
+    try:
+        with open(path, 'rb') as snapshot_file, \
+                mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            snapshot = pickle.loads(mapped)
+    except Exception:
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('name') != name:
+        return None
+    if time.time() - snapshot['saved_at'] > max_age:
+        return None
+    return snapshot['value'], snapshot['saved_at']
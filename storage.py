@@ -0,0 +1,436 @@
+import streamlit as st
+import os
+import json
+import pickle
+import sqlite3
+import argparse
+import threading
+from contextlib import closing
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+from shared_cache import SharedTabCache
+from config import *
+
+# Which backend holds the reference tabs and requests: sheets, sqlite or memory
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sheets')
+SQLITE_DATABASE = os.environ.get('STORAGE_SQLITE_DATABASE', 'access_management.db')
+# SQLite file shared by every server process on the host; empty turns the shared cache off
+SHARED_CACHE_FILE = os.environ.get('STORAGE_SHARED_CACHE', 'shared_cache.db')
+
+@st.cache_resource(ttl=CACHE_TTL)
+def get_sheets_service():
+    """Initialize and return Google Sheets service with cached credentials"""
+    creds = None
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, 'rb') as token:
+            creds = pickle.load(token)
+
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+            except Exception:
+                creds = None
+
+        if not creds:
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+            creds = flow.run_local_server(port=0)
+            with open(TOKEN_FILE, 'wb') as token:
+                pickle.dump(creds, token)
+
+    return build('sheets', 'v4', credentials=creds)
+
+def column_letter(col_idx):
+    """Convert a 0-based column index to a sheet column letter (A, B, ..., Z, AA, ...)"""
+    result = ""
+    while col_idx >= 0:
+        col_idx, remainder = divmod(col_idx, 26)
+        result = chr(65 + remainder) + result
+        col_idx -= 1
+    return result
+
+def cell_text(value):
+    """Cells are stored and returned as strings, the way Sheets hands them back"""
+    return '' if value is None else str(value)
+
+class StorageBackend:
+    """Tab-and-row storage used by the forms, dashboards and maintenance jobs.
+
+    Every tab is a list of rows whose first row is the header; row numbers are
+    1-based like sheet rows, so the header is row 1.
+    """
+
+    def list_tabs(self):
+        """Names of all tabs"""
+        raise NotImplementedError
+
+    def read_tabs(self, tabs):
+        """All rows of each tab, as {tab: rows}"""
+        raise NotImplementedError
+
+    def read_row(self, tab, row_number, width):
+        """The first width cells of one row ([] past the end)"""
+        raise NotImplementedError
+
+    def read_columns(self, tab, cols):
+        """Whole columns by 0-based index, each a list of cells from row 1"""
+        raise NotImplementedError
+
+    def append_rows(self, tab, rows, value_input_option="RAW"):
+        """Append rows below the last row of a tab"""
+        raise NotImplementedError
+
+    def update_cells(self, tab, updates):
+        """Write (row_number, col, value) cells in one batch"""
+        raise NotImplementedError
+
+    def add_tabs(self, tabs, header):
+        """Create tabs that start with the given header row"""
+        raise NotImplementedError
+
+    def delete_rows(self, tab, row_numbers):
+        """Delete rows; rows below them move up"""
+        raise NotImplementedError
+
+class SheetsBackend(StorageBackend):
+    """Google Sheets spreadsheet SPREADSHEET_ID"""
+
+    def __init__(self, service_factory=get_sheets_service):
+        self.service_factory = service_factory
+
+    def spreadsheet(self):
+        return self.service_factory().spreadsheets()
+
+    def sheet_ids(self):
+        result = self.spreadsheet().get(spreadsheetId=SPREADSHEET_ID, fields='sheets.properties').execute()
+        return {tab['properties']['title']: tab['properties']['sheetId'] for tab in result.get('sheets', [])}
+
+    def list_tabs(self):
+        return list(self.sheet_ids())
+
+    def read_tabs(self, tabs):
+        result = self.spreadsheet().values().batchGet(spreadsheetId=SPREADSHEET_ID, ranges=list(tabs)).execute()
+        value_ranges = result.get('valueRanges', [])
+        return {tab: value_ranges[i].get('values', []) if i < len(value_ranges) else []
+                for i, tab in enumerate(tabs)}
+
+    def read_row(self, tab, row_number, width):
+        result = self.spreadsheet().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f"'{tab}'!A{row_number}:{column_letter(width - 1)}{row_number}"
+        ).execute()
+        values = result.get('values', [])
+        return values[0] if values else []
+
+    def read_columns(self, tab, cols):
+        letters = [column_letter(col) for col in cols]
+        result = self.spreadsheet().values().batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[f"'{tab}'!{letter}:{letter}" for letter in letters]
+        ).execute()
+        value_ranges = result.get('valueRanges', [])
+        return [[cells[0] if cells else '' for cells in value_ranges[i].get('values', [])]
+                if i < len(value_ranges) else [] for i in range(len(cols))]
+
+    def append_rows(self, tab, rows, value_input_option="RAW"):
+        self.spreadsheet().values().append(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f"'{tab}'",
+            valueInputOption=value_input_option,
+            body={"values": rows}
+        ).execute()
+
+    def update_cells(self, tab, updates):
+        if not updates:
+            return
+        self.spreadsheet().values().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={'valueInputOption': 'RAW',
+                  'data': [{'range': f"'{tab}'!{column_letter(col)}{row_number}", 'values': [[value]]}
+                           for row_number, col, value in updates]}
+        ).execute()
+
+    def add_tabs(self, tabs, header):
+        if not tabs:
+            return
+        sheet = self.spreadsheet()
+        sheet.batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={'requests': [{'addSheet': {'properties': {'title': tab}}} for tab in tabs]}
+        ).execute()
+        sheet.values().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={'valueInputOption': 'RAW',
+                  'data': [{'range': f"'{tab}'!A1", 'values': [header]} for tab in tabs]}
+        ).execute()
+
+    def delete_rows(self, tab, row_numbers):
+        """One batchUpdate; consecutive rows are merged into runs and deleted bottom-up"""
+        if not row_numbers:
+            return
+        runs = []
+        for index in sorted(row_number - 1 for row_number in row_numbers):
+            if runs and runs[-1][1] == index:
+                runs[-1][1] = index + 1
+            else:
+                runs.append([index, index + 1])
+
+        sheet_id = self.sheet_ids()[tab]
+        self.spreadsheet().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={'requests': [
+                {'deleteDimension': {'range': {'sheetId': sheet_id, 'dimension': 'ROWS',
+                                               'startIndex': start, 'endIndex': end}}}
+                for start, end in reversed(runs)
+            ]}
+        ).execute()
+
+class SQLiteBackend(StorageBackend):
+    """Local SQLite file with one table of (tab, row_number, cells as JSON)"""
+
+    def __init__(self, path=SQLITE_DATABASE):
+        self.path = path
+        with closing(self.connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS sheet_rows ('
+                'tab TEXT NOT NULL, row_number INTEGER NOT NULL, cells TEXT NOT NULL, '
+                'PRIMARY KEY (tab, row_number))'
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def list_tabs(self):
+        with closing(self.connect()) as connection:
+            return [tab for (tab,) in connection.execute('SELECT DISTINCT tab FROM sheet_rows ORDER BY tab')]
+
+    def read_tabs(self, tabs):
+        with closing(self.connect()) as connection:
+            return {
+                tab: [json.loads(cells) for (cells,) in connection.execute(
+                    'SELECT cells FROM sheet_rows WHERE tab = ? ORDER BY row_number', (tab,))]
+                for tab in tabs
+            }
+
+    def read_row(self, tab, row_number, width):
+        with closing(self.connect()) as connection:
+            found = connection.execute(
+                'SELECT cells FROM sheet_rows WHERE tab = ? AND row_number = ?', (tab, row_number)
+            ).fetchone()
+        return json.loads(found[0])[:width] if found else []
+
+    def read_columns(self, tab, cols):
+        rows = self.read_tabs([tab])[tab]
+        return [[row[col] if col < len(row) else '' for row in rows] for col in cols]
+
+    def append_rows(self, tab, rows, value_input_option="RAW"):
+        with closing(self.connect()) as connection, connection:
+            # BEGIN IMMEDIATE so concurrent appends cannot pick the same row numbers
+            connection.execute('BEGIN IMMEDIATE')
+            (last_row,) = connection.execute(
+                'SELECT COALESCE(MAX(row_number), 0) FROM sheet_rows WHERE tab = ?', (tab,)
+            ).fetchone()
+            connection.executemany(
+                'INSERT INTO sheet_rows (tab, row_number, cells) VALUES (?, ?, ?)',
+                [(tab, last_row + i, json.dumps([cell_text(value) for value in row]))
+                 for i, row in enumerate(rows, start=1)]
+            )
+
+    def update_cells(self, tab, updates):
+        with closing(self.connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for row_number, col, value in updates:
+                found = connection.execute(
+                    'SELECT cells FROM sheet_rows WHERE tab = ? AND row_number = ?', (tab, row_number)
+                ).fetchone()
+                row = json.loads(found[0]) if found else []
+                row += [''] * (col + 1 - len(row))
+                row[col] = cell_text(value)
+                connection.execute(
+                    'INSERT OR REPLACE INTO sheet_rows (tab, row_number, cells) VALUES (?, ?, ?)',
+                    (tab, row_number, json.dumps(row))
+                )
+
+    def add_tabs(self, tabs, header):
+        for tab in tabs:
+            self.append_rows(tab, [header])
+
+    def delete_rows(self, tab, row_numbers):
+        doomed = set(row_numbers)
+        with closing(self.connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            remaining = [cells for row_number, cells in connection.execute(
+                'SELECT row_number, cells FROM sheet_rows WHERE tab = ? ORDER BY row_number', (tab,))
+                if row_number not in doomed]
+            connection.execute('DELETE FROM sheet_rows WHERE tab = ?', (tab,))
+            connection.executemany(
+                'INSERT INTO sheet_rows (tab, row_number, cells) VALUES (?, ?, ?)',
+                [(tab, row_number, cells) for row_number, cells in enumerate(remaining, start=1)]
+            )
+
+class MemoryBackend(StorageBackend):
+    """Process-local tabs, for trying the app out and for fast performance runs"""
+
+    def __init__(self, tabs=None):
+        self.tabs = {tab: [[cell_text(value) for value in row] for row in rows]
+                     for tab, rows in (tabs or {}).items()}
+        self.lock = threading.Lock()
+
+    def list_tabs(self):
+        with self.lock:
+            return list(self.tabs)
+
+    def read_tabs(self, tabs):
+        with self.lock:
+            return {tab: [list(row) for row in self.tabs.get(tab, [])] for tab in tabs}
+
+    def read_row(self, tab, row_number, width):
+        with self.lock:
+            rows = self.tabs.get(tab, [])
+            return list(rows[row_number - 1][:width]) if 0 < row_number <= len(rows) else []
+
+    def read_columns(self, tab, cols):
+        with self.lock:
+            rows = self.tabs.get(tab, [])
+            return [[row[col] if col < len(row) else '' for row in rows] for col in cols]
+
+    def append_rows(self, tab, rows, value_input_option="RAW"):
+        with self.lock:
+            self.tabs.setdefault(tab, []).extend([cell_text(value) for value in row] for row in rows)
+
+    def update_cells(self, tab, updates):
+        with self.lock:
+            rows = self.tabs.setdefault(tab, [])
+            for row_number, col, value in updates:
+                rows.extend([] for _ in range(row_number - len(rows)))
+                row = rows[row_number - 1]
+                row.extend([''] * (col + 1 - len(row)))
+                row[col] = cell_text(value)
+
+    def add_tabs(self, tabs, header):
+        with self.lock:
+            for tab in tabs:
+                self.tabs[tab] = [list(header)]
+
+    def delete_rows(self, tab, row_numbers):
+        doomed = set(row_numbers)
+        with self.lock:
+            self.tabs[tab] = [row for row_number, row in enumerate(self.tabs.get(tab, []), start=1)
+                              if row_number not in doomed]
+
+class SharedCacheBackend(StorageBackend):
+    """Serves whole-tab reads from a cache shared by all server processes on the host.
+
+    Only read_tabs is cached: it is what the reference-data caches and the request
+    index are built from. Single-row and column reads back the status compare-and-set
+    and always go to the backend. Every write drops the tabs it touched from the
+    shared cache, so the next reader in any process sees it.
+    """
+
+    def __init__(self, backend, path=SHARED_CACHE_FILE, max_age=CACHE_TTL):
+        self.backend = backend
+        self.cache = SharedTabCache(path)
+        self.max_age = max_age
+
+    def list_tabs(self):
+        return self.backend.list_tabs()
+
+    def read_tabs(self, tabs):
+        return self.cache.read_through(list(tabs), self.max_age, self.backend.read_tabs)
+
+    def read_row(self, tab, row_number, width):
+        return self.backend.read_row(tab, row_number, width)
+
+    def read_columns(self, tab, cols):
+        return self.backend.read_columns(tab, cols)
+
+    def append_rows(self, tab, rows, value_input_option="RAW"):
+        try:
+            self.backend.append_rows(tab, rows, value_input_option)
+        finally:
+            self.cache.invalidate([tab])
+
+    def update_cells(self, tab, updates):
+        try:
+            self.backend.update_cells(tab, updates)
+        finally:
+            self.cache.invalidate([tab])
+
+    def add_tabs(self, tabs, header):
+        try:
+            self.backend.add_tabs(tabs, header)
+        finally:
+            self.cache.invalidate(tabs)
+
+    def delete_rows(self, tab, row_numbers):
+        try:
+            self.backend.delete_rows(tab, row_numbers)
+        finally:
+            self.cache.invalidate([tab])
+
+def create_backend(name=STORAGE_BACKEND):
+    """Backend for a STORAGE_BACKEND name"""
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'memory':
+        return MemoryBackend()
+    return SheetsBackend()
+
+@st.cache_resource
+def get_storage():
+    """The configured storage backend, shared by every session and, through the
+    shared cache, by every server process on the host"""
+    backend = create_backend()
+    # The memory backend is process-local, so a cache shared across processes would be wrong
+    if SHARED_CACHE_FILE and STORAGE_BACKEND != 'memory':
+        return SharedCacheBackend(backend)
+    return backend
+
+def read_fresh_tabs(tabs):
+    """read_tabs straight from the backend, past the shared cache, for reads that decide what to write"""
+    storage = get_storage()
+    if isinstance(storage, SharedCacheBackend):
+        storage = storage.backend
+    return storage.read_tabs(tabs)
+
+def read_available_tabs(tabs):
+    """read_tabs on the shared backend; if the batch fails (e.g. a tab is missing), the
+    tabs are read one by one and the ones that cannot be read are left out"""
+    storage = get_storage()
+    try:
+        return storage.read_tabs(tabs)
+    except Exception:
+        pass
+
+    values_by_tab = {}
+    for tab in tabs:
+        try:
+            values_by_tab[tab] = storage.read_tabs([tab])[tab]
+        except Exception:
+            pass
+    return values_by_tab
+
+def copy_tabs(source, target, tabs=None):
+    """Copy tabs (all by default) from one backend into another; returns {tab: rows copied}"""
+    tabs = tabs or source.list_tabs()
+    copied = {}
+    for tab, rows in source.read_tabs(tabs).items():
+        if rows:
+            target.append_rows(tab, rows)
+        copied[tab] = len(rows)
+    return copied
+
+def main():
+    """Copy the Google Sheet into a local SQLite database from the command line"""
+    parser = argparse.ArgumentParser(description="Copy every tab of the spreadsheet into SQLite")
+    parser.add_argument('--database', default=SQLITE_DATABASE,
+                        help=f"SQLite file to fill (default {SQLITE_DATABASE})")
+    args = parser.parse_args()
+
+    for tab, count in copy_tabs(SheetsBackend(), SQLiteBackend(args.database)).items():
+        print(f"{tab}: copied {count} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import streamlit as st
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from request_index import get_request_index, normalize_email
+from storage import get_storage
+
+# Repeats of a submission within this many minutes return the original request instead of saving another
+SUBMISSION_WINDOW = int(os.environ.get('SUBMISSION_DEDUP_MINUTES', '10')) * 60
+# Token ledger shared by every server process (and the API) on the host
+SUBMISSION_LEDGER_FILE = os.environ.get('SUBMISSION_LEDGER', 'submissions.db')
+SUBMIT_TIMEOUT = 120   # seconds before an unfinished submission is presumed abandoned
+SUBMIT_WAIT = 15       # seconds a repeat waits for the first attempt to finish
+SUBMIT_POLL = 0.2
+APPEND_ATTEMPTS = 3
+APPEND_BACKOFF = 0.5   # seconds before the first retry of an append, doubled after each one
+
+PENDING = 'pending'          # rows being saved
+SAVED = 'saved'              # rows saved, notifications being sent
+UNNOTIFIED = 'unnotified'    # rows saved, notifications failed; a repeat sends them again
+DONE = 'done'                # rows saved and notifications sent
+ABANDONED = 'abandoned'
+
+def submission_token(kind, user_email, payload):
+    """Idempotency token of a submission: the same user sending the same payload (or the
+    same client-supplied key) gets the same token"""
+    data = json.dumps([kind, normalize_email(user_email), payload], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+class SubmissionLedger:
+    """Tokens of recent submissions and the request IDs they saved.
+
+    Finished submissions are remembered in memory for repeats within this process;
+    the SQLite file is the record every process agrees on. A token is claimed as
+    pending before its rows are appended and marked saved afterwards, so a repeat
+    arriving in between waits for the first attempt instead of appending again.
+    Once notifications went out it is done; if they failed, the next repeat takes
+    the token over to send them again without saving anything.
+    """
+
+    def __init__(self, path=SUBMISSION_LEDGER_FILE, window=SUBMISSION_WINDOW):
+        self.path = path
+        self.window = window
+        self.lock = threading.Lock()
+        self.done = OrderedDict()   # token -> (request IDs, finished at), oldest first
+        with closing(self.connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS submissions ('
+                'token TEXT PRIMARY KEY, state TEXT NOT NULL, request_ids TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def remembered(self, token):
+        """Request IDs of a submission this process finished within the window, or None"""
+        with self.lock:
+            found = self.done.get(token)
+        return found[0] if found and found[1] >= time.time() - self.window else None
+
+    def remember(self, token, request_ids):
+        """Keep a finished submission in memory, dropping the ones past the window"""
+        now = time.time()
+        with self.lock:
+            self.done[token] = (request_ids, now)
+            self.done.move_to_end(token)
+            while self.done and next(iter(self.done.values()))[1] < now - self.window:
+                self.done.popitem(last=False)
+
+    def seen(self, token):
+        """Whether a submission under this token was made within the window, finished or not"""
+        if self.remembered(token):
+            return True
+        with closing(self.connect()) as connection:
+            return connection.execute(
+                'SELECT 1 FROM submissions WHERE token = ? AND updated_at >= ?', (token, time.time() - self.window)
+            ).fetchone() is not None
+
+    def claim(self, token, request_ids):
+        """Claim a token for a new submission of request_ids. Returns (state, request IDs):
+        (None, request_ids) when claimed; (PENDING, SAVED or DONE as the state, their IDs)
+        when another submission holds it; (ABANDONED, their IDs) when this call took over one that never
+        finished saving, whose rows may or may not have been saved; (UNNOTIFIED, their IDs)
+        when this call took over sending the notifications of saved rows"""
+        now = time.time()
+        with closing(self.connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM submissions WHERE updated_at < ?', (now - self.window,))
+            held = connection.execute(
+                'SELECT state, request_ids, updated_at FROM submissions WHERE token = ?', (token,)
+            ).fetchone()
+            if held and held[0] in (SAVED, UNNOTIFIED):
+                if held[0] == SAVED and held[2] >= now - SUBMIT_TIMEOUT:
+                    return SAVED, json.loads(held[1])
+                connection.execute('UPDATE submissions SET state = ?, updated_at = ? WHERE token = ?',
+                                   (SAVED, now, token))
+                return UNNOTIFIED, json.loads(held[1])
+            if held and (held[0] == DONE or held[2] >= now - SUBMIT_TIMEOUT):
+                return held[0], json.loads(held[1])
+            connection.execute(
+                'INSERT OR REPLACE INTO submissions (token, state, request_ids, updated_at) VALUES (?, ?, ?, ?)',
+                (token, PENDING, json.dumps(request_ids), now)
+            )
+            return (ABANDONED, json.loads(held[1])) if held else (None, request_ids)
+
+    def set_state(self, token, state, request_ids):
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO submissions (token, state, request_ids, updated_at) VALUES (?, ?, ?, ?)',
+                (token, state, json.dumps(request_ids), time.time())
+            )
+
+    def complete(self, token, request_ids):
+        """Record that a submission's rows were saved; its notifications are still to be sent"""
+        self.set_state(token, SAVED, request_ids)
+
+    def notified(self, token, request_ids, sent):
+        """Record whether a saved submission's notifications went out"""
+        self.set_state(token, DONE if sent else UNNOTIFIED, request_ids)
+        if sent:
+            self.remember(token, request_ids)
+
+    def release(self, token):
+        """Forget a claim whose save failed, so a retry starts afresh"""
+        with closing(self.connect()) as connection, connection:
+            connection.execute('DELETE FROM submissions WHERE token = ? AND state = ?', (token, PENDING))
+
+@st.cache_resource
+def get_submission_ledger():
+    return SubmissionLedger()
+
+def rows_landed(sheet_name, request_ids):
+    """Whether every request ID is already in the tab, read straight from storage"""
+    request_id_col = get_request_index().sheets[sheet_name].request_id_col
+    stored = set(get_storage().read_columns(sheet_name, [request_id_col])[0])
+    return all(request_id in stored for request_id in request_ids)
+
+def append_with_retry(sheet_name, rows, request_ids, value_input_option="RAW"):
+    """Append request rows, retrying with backoff. A failed call may still have written
+    the rows (e.g. a timeout after Sheets applied it), so after every failure, the last
+    one included, the tab is checked for the request IDs: nothing is appended twice,
+    and rows that did land are not reported as a failure."""
+    storage = get_storage()
+    for attempt in range(APPEND_ATTEMPTS):
+        try:
+            storage.append_rows(sheet_name, rows, value_input_option=value_input_option)
+            return
+        except Exception:
+            time.sleep(APPEND_BACKOFF * 2 ** attempt)
+            try:
+                if rows_landed(sheet_name, request_ids):
+                    return
+            except Exception:
+                pass
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+
+def submission_seen(token):
+    """Whether a submission was already made under this token, so checks that would
+    reject it as a duplicate (e.g. one pending request per user) should be skipped"""
+    try:
+        return get_submission_ledger().seen(token)
+    except Exception:
+        return False
+
+def submit_once(token, request_ids, sheet_name, save):
+    """Run save() for a submission unless its token already saved one.
+
+    Returns (request IDs, notify): the IDs saved under the token (None if nothing
+    was saved; repeats get the original IDs back) and whether this call should send
+    the notifications. That is the call that saved the rows, or a repeat of a
+    submission whose notifications failed; either reports the outcome through
+    record_notification.
+    """
+    ledger = get_submission_ledger()
+    original = ledger.remembered(token)
+    if original:
+        return original, False
+
+    deadline = time.time() + SUBMIT_WAIT
+    state, held_ids = ledger.claim(token, request_ids)
+    while state == PENDING:
+        if time.time() >= deadline:
+            # The first attempt is still running; refusing beats risking a second copy
+            return None, False
+        time.sleep(SUBMIT_POLL)
+        state, held_ids = ledger.claim(token, request_ids)
+    if state in (SAVED, DONE):
+        return held_ids, False
+    if state == UNNOTIFIED:
+        return held_ids, True
+    if state == ABANDONED:
+        try:
+            if rows_landed(sheet_name, held_ids):
+                # Saved, but the attempt died before its notifications were recorded
+                ledger.complete(token, held_ids)
+                return held_ids, True
+        except Exception:
+            pass
+
+    try:
+        saved = save()
+    except Exception:
+        saved = False
+    if not saved:
+        ledger.release(token)
+        return None, False
+    ledger.complete(token, request_ids)
+    return request_ids, True
+
+def record_notification(token, request_ids, sent):
+    """Record whether the notifications of a saved submission were sent; failed ones are
+    sent again by the next repeat of the submission"""
+    try:
+        get_submission_ledger().notified(token, request_ids, sent)
+    except Exception:
+        pass
@@ -1,15 +1,24 @@
 import streamlit as st
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import datetime
-import random
+import csv
+import io
+from types import MappingProxyType
+from search_index import NgramIndex
+from expiry import track_approved_row
+from digest import digest_enabled, queue_request, approval_link
+from notifications import notify_request, plan_recipients, send_messages, confirmation_body, grouped_approval_body
+from request_index import get_request_index, record_appended_rows, transition_status
+from request_ids import new_request_id
+from storage import get_storage
+from submissions import submission_token, submit_once, record_notification, append_with_retry
+from session_store import ensure_defaults, remember, recall, forget
+from refresh_cache import stale_while_revalidate
 from config import *
 
+OBJECT_SOURCES = ["CSPL", "CAPL", "CFSPL"]
+BULK_CSV_COLUMNS = ['object_source', 'database', 'schema', 'tables', 'grantee', 'validity', 'reason']
+GRANTEE_TYPES = ['SELF', 'GENERIC_USER', 'GENERIC_ROLE']
+REASON_MAX_CHARS = 20
+
 def get_current_url():
     """Get the current URL dynamically"""
     try:
@@ -24,326 +33,435 @@ def get_current_url():
     # Fallback to default
     return DEFAULT_URL
 
-@st.cache_resource(ttl=CACHE_TTL)  # Cache for 5 minutes
-def get_sheets_service():
-    """Initialize and return Google Sheets service with cached credentials"""
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server()
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('sheets', 'v4', credentials=creds)
+def freeze_records(records):
+    """Wrap parsed rows as read-only records so one copy can be shared by every session"""
+    return tuple(MappingProxyType(record) for record in records)
+
+@stale_while_revalidate(snapshot=True)  # One shared copy, refreshed in the background
+def load_all_sheet_data():
+    """Fetch all required data from Google Sheets in one optimized call; raises if it cannot be read"""
+    # Fetch all sheets in one batch request
+    ranges = ['snf_user', 'rm approvers', 'data approvers', 'table_list']
+    values_by_range = get_storage().read_tabs(ranges)
+    value_ranges = [{'values': values_by_range[name]} for name in ranges]
+    
+    # Process user data
+    users = []
+    if len(value_ranges) > 0 and value_ranges[0].get('values'):
+        values = value_ranges[0]['values']
+        if len(values) > 1:
+            header = values[0]
+            try:
+                entity_col = header.index('ENTITY')
+                email_col = header.index('EMAIL')
+                role_col = header.index('DEFAULT_ROLE')
+                for row in values[1:]:
+                    if len(row) > max(entity_col, email_col, role_col):
+                        entity = row[entity_col] if entity_col < len(row) else ''
+                        email = row[email_col] if email_col < len(row) else ''
+                        role = row[role_col] if role_col < len(row) else ''
+                        # Only add if email is not blank
+                        if email and email.strip():
+                            users.append({
+                                'entity': entity,
+                                'email': email,
+                                'role': role
+                            })
+            except ValueError:
+                pass
+    
+    # Process RM approvers data
+    rm_approvers = []
+    if len(value_ranges) > 1 and value_ranges[1].get('values'):
+        values = value_ranges[1]['values']
+        if len(values) > 1:
+            header = values[0]
+            try:
+                user_email_col = header.index('User_Email')
+                approver_col = header.index('Approver')
+                for row in values[1:]:
+                    if len(row) > max(user_email_col, approver_col):
+                        user_email = row[user_email_col] if user_email_col < len(row) else ''
+                        approver = row[approver_col] if approver_col < len(row) else ''
+                        # Only add if both user_email and approver are not blank
+                        if user_email and user_email.strip() and approver and approver.strip():
+                            rm_approvers.append({
+                                'user_email': user_email,
+                                'approver': approver
+                            })
+            except ValueError:
+                pass
+    
+    # Process data approvers data
+    data_approvers = []
+    if len(value_ranges) > 2 and value_ranges[2].get('values'):
+        values = value_ranges[2]['values']
+        if len(values) > 1:
+            header = values[0]
+            try:
+                database_col = header.index('Database')
+                approver_col = header.index('Approver')
+                for row in values[1:]:
+                    if len(row) > max(database_col, approver_col):
+                        database = row[database_col] if database_col < len(row) else ''
+                        approver = row[approver_col] if approver_col < len(row) else ''
+                        # Only add if both database and approver are not blank
+                        if database and database.strip() and approver and approver.strip():
+                            data_approvers.append({
+                                'database': database,
+                                'approver': approver
+                            })
+            except ValueError:
+                pass
+    
+    # Process table data
+    table_data = []
+    if len(value_ranges) > 3 and value_ranges[3].get('values'):
+        values = value_ranges[3]['values']
+        if len(values) > 1:
+            header = values[0]
+            try:
+                object_source_col = header.index('OBJECT_SOURCE')
+                database_col = header.index('DATABASE_NAME')
+                schema_col = header.index('SCHEMA_NAME')
+                table_col = header.index('TABLE_NAME')
+                for row in values[1:]:
+                    if len(row) > max(object_source_col, database_col, schema_col, table_col):
+                        object_source = row[object_source_col] if object_source_col < len(row) else ''
+                        database = row[database_col] if database_col < len(row) else ''
+                        schema = row[schema_col] if schema_col < len(row) else ''
+                        table = row[table_col] if table_col < len(row) else ''
+                        # Only add if all fields are not blank
+                        if (object_source and object_source.strip() and 
+                            database and database.strip() and 
+                            schema and schema.strip() and 
+                            table and table.strip()):
+                            table_data.append({
+                                'object_source': object_source,
+                                'database': database,
+                                'schema': schema,
+                                'table': table
+                            })
+            except ValueError:
+                pass
+    
+    return (freeze_records(users), freeze_records(rm_approvers),
+            freeze_records(data_approvers), freeze_records(table_data))
 
-@st.cache_data(ttl=CACHE_TTL)  # Cache for 5 minutes
 def fetch_all_sheet_data():
-    """Fetch all required data from Google Sheets in one optimized call"""
+    """Reference data for the table form: the last good copy, never blocking on a scheduled refresh"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
-        # Fetch all sheets in one batch request
-        ranges = ['snf_user', 'rm approvers', 'data approvers', 'table_list']
-        result = sheet.values().batchGet(
-            spreadsheetId=SPREADSHEET_ID,
-            ranges=ranges
-        ).execute()
-        
-        value_ranges = result.get('valueRanges', [])
-        
-        # Process user data
-        users = []
-        if len(value_ranges) > 0 and value_ranges[0].get('values'):
-            values = value_ranges[0]['values']
-            if len(values) > 1:
-                header = values[0]
-                try:
-                    entity_col = header.index('ENTITY')
-                    email_col = header.index('EMAIL')
-                    role_col = header.index('DEFAULT_ROLE')
-                    for row in values[1:]:
-                        if len(row) > max(entity_col, email_col, role_col):
-                            entity = row[entity_col] if entity_col < len(row) else ''
-                            email = row[email_col] if email_col < len(row) else ''
-                            role = row[role_col] if role_col < len(row) else ''
-                            # Only add if email is not blank
-                            if email and email.strip():
-                                users.append({
-                                    'entity': entity,
-                                    'email': email,
-                                    'role': role
-                                })
-                except ValueError:
-                    pass
-        
-        # Process RM approvers data
-        rm_approvers = []
-        if len(value_ranges) > 1 and value_ranges[1].get('values'):
-            values = value_ranges[1]['values']
-            if len(values) > 1:
-                header = values[0]
-                try:
-                    user_email_col = header.index('User_Email')
-                    approver_col = header.index('Approver')
-                    for row in values[1:]:
-                        if len(row) > max(user_email_col, approver_col):
-                            user_email = row[user_email_col] if user_email_col < len(row) else ''
-                            approver = row[approver_col] if approver_col < len(row) else ''
-                            # Only add if both user_email and approver are not blank
-                            if user_email and user_email.strip() and approver and approver.strip():
-                                rm_approvers.append({
-                                    'user_email': user_email,
-                                    'approver': approver
-                                })
-                except ValueError:
-                    pass
-        
-        # Process data approvers data
-        data_approvers = []
-        if len(value_ranges) > 2 and value_ranges[2].get('values'):
-            values = value_ranges[2]['values']
-            if len(values) > 1:
-                header = values[0]
-                try:
-                    database_col = header.index('Database')
-                    approver_col = header.index('Approver')
-                    for row in values[1:]:
-                        if len(row) > max(database_col, approver_col):
-                            database = row[database_col] if database_col < len(row) else ''
-                            approver = row[approver_col] if approver_col < len(row) else ''
-                            # Only add if both database and approver are not blank
-                            if database and database.strip() and approver and approver.strip():
-                                data_approvers.append({
-                                    'database': database,
-                                    'approver': approver
-                                })
-                except ValueError:
-                    pass
-        
-        # Process table data
-        table_data = []
-        if len(value_ranges) > 3 and value_ranges[3].get('values'):
-            values = value_ranges[3]['values']
-            if len(values) > 1:
-                header = values[0]
-                try:
-                    object_source_col = header.index('OBJECT_SOURCE')
-                    database_col = header.index('DATABASE_NAME')
-                    schema_col = header.index('SCHEMA_NAME')
-                    table_col = header.index('TABLE_NAME')
-                    for row in values[1:]:
-                        if len(row) > max(object_source_col, database_col, schema_col, table_col):
-                            object_source = row[object_source_col] if object_source_col < len(row) else ''
-                            database = row[database_col] if database_col < len(row) else ''
-                            schema = row[schema_col] if schema_col < len(row) else ''
-                            table = row[table_col] if table_col < len(row) else ''
-                            # Only add if all fields are not blank
-                            if (object_source and object_source.strip() and 
-                                database and database.strip() and 
-                                schema and schema.strip() and 
-                                table and table.strip()):
-                                table_data.append({
-                                    'object_source': object_source,
-                                    'database': database,
-                                    'schema': schema,
-                                    'table': table
-                                })
-                except ValueError:
-                    pass
-        
-        return users, rm_approvers, data_approvers, table_data
-        
+        return load_all_sheet_data()
     except Exception as e:
         st.error(f"Error fetching data: {e}")
-        return [], [], [], []
+        return (), (), (), ()
+
+@stale_while_revalidate(depends_on=load_all_sheet_data, snapshot=True)
+def get_table_search_index():
+    """Build the type-ahead index over DATABASE.SCHEMA.TABLE for the whole catalog"""
+    _, _, _, table_data = load_all_sheet_data()
+    records = sorted(
+        (table for table in table_data if table['object_source'] in OBJECT_SOURCES),
+        key=lambda table: (len(table_fqn(table)), table_fqn(table))
+    )
+    return NgramIndex(records, lambda table: (table_fqn(table),), lambda table: (table['table'],))
+
+def table_fqn(table):
+    """Fully qualified DATABASE.SCHEMA.TABLE name of a catalog entry"""
+    return f"{table['database']}.{table['schema']}.{table['table']}"
+
+def apply_table_search_pick(matches_by_label):
+    """Fill the cascading dropdowns from the table picked in the search results"""
+    match = matches_by_label.get(st.session_state.table_search_pick)
+    if not match:
+        return
+    
+    st.session_state.object_source_dropdown = match['object_source']
+    st.session_state.database_dropdown = match['database']
+    st.session_state.schema_dropdown = match['schema']
+    st.session_state.table_selection_radio = "Select Tables"
+    st.session_state.tables_multiselect = [match['table']]
 
 def generate_request_id():
     """Generate a unique request ID"""
-    now = datetime.datetime.now()
-    date_str = now.strftime("%Y%m%d")
-    time_str = now.strftime("%H%M%S")
-    random_num = random.randint(REQUEST_RANDOM_MIN, REQUEST_RANDOM_MAX)
-    return f"{REQUEST_PREFIX}_{date_str}_{time_str}_{random_num}"
+    return new_request_id()
 
 def append_to_sheet(data):
     """Append data to the responses sheet"""
+    return append_rows_to_sheet([data])
+
+def append_rows_to_sheet(rows):
+    """Append one or more request rows to the responses sheet in a single call"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
         # Add approval status columns
-        data_with_status = data + [PENDING_STATUS, PENDING_STATUS]
+        rows_with_status = [data + [PENDING_STATUS, PENDING_STATUS] for data in rows]
         
         # Force text format for request ID to prevent truncation
-        sheet.values().append(
-            spreadsheetId=SPREADSHEET_ID,
-            range='responses',
-            valueInputOption="USER_ENTERED",  # Changed from RAW to USER_ENTERED
-            body={"values": [data_with_status]}
-        ).execute()
+        append_with_retry('responses', rows_with_status, [data[1] for data in rows], value_input_option="USER_ENTERED")
+        record_appended_rows('responses', rows_with_status)
         return True
     except Exception as e:
         st.error(f"Error appending to sheet: {e}")
         return False
 
 def send_approval_email(request_id, user_name, entity, database, schema, table, selected_names, rm_approver, data_approver, user_email):
-    """Send approval emails"""
-    subject = "Approval Needed: Table Access Request"
-    
-    # RM Approver email content
-    rm_email_body = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <h2 style="color: #2c3e50;">Table Access Request - RM Approval Required</h2>
-        <p>Dear RM Approver,</p>
-        <p>The user <strong>{user_name}</strong> has submitted a table access request that requires your approval:</p>
-        
-        <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid #007bff; margin: 20px 0;">
-            <h3 style="margin-top: 0; color: #007bff;">Request Details:</h3>
-            <ul style="list-style-type: none; padding-left: 0;">
-                <li><strong>Request ID:</strong> {request_id}</li>
-                <li><strong>Entity:</strong> {entity}</li>
-                <li><strong>Database:</strong> {database}</li>
-                <li><strong>Schema:</strong> {schema}</li>
-                <li><strong>Table Option:</strong> {table}</li>
-                <li><strong>Tables:</strong> {selected_names}</li>
-            </ul>
-        </div>
-        
-        <div style="text-align: center; margin: 30px 0;">
-            <a href='{get_current_url()}?approve_id={request_id}&type=rm&action=approve&approver={rm_approver}' 
-               style="background-color: #28a745; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
-               ✅ APPROVE REQUEST
-            </a>
-            <a href='{get_current_url()}?approve_id={request_id}&type=rm&action=reject&approver={rm_approver}' 
-               style="background-color: #dc3545; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
-               ❌ REJECT REQUEST
-            </a>
-        </div>
-        
-        <p style="font-size: 12px; color: #666; margin-top: 30px;">
-            <em>Note: Clicking on either button will take you to the approval page where the action will be processed automatically.</em>
-        </p>
-    </body>
-    </html>
+    """Send approval emails; an RM approver who is also the data approver gets one email"""
+    details = [("Entity", entity), ("Database", database), ("Schema", schema),
+               ("Table Option", table), ("Tables", selected_names)]
+    return notify_request("Table Access Request", user_name, request_id, details,
+                          [('rm', rm_approver), ('data', data_approver)], user_email, get_current_url())
+
+def normalize_csv_header(name):
+    """Map a CSV header like 'Object Source' to object_source"""
+    return name.strip().lower().replace(' ', '_')
+
+def validate_bulk_requests(csv_text, user_email, entity, rm_approver, data_approvers, table_data):
+    """Validate every CSV row in one pass against the in-memory catalog.
+    
+    Returns (requests, errors) where each request is a dict ready for submission and
+    each error is a (line number, message) pair.
     """
+    reader = csv.DictReader(io.StringIO(csv_text))
+    if not reader.fieldnames:
+        return [], [(1, "The file is empty")]
     
-    # Data Approver email content
-    data_email_body = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <h2 style="color: #2c3e50;">Table Access Request - Data Approval Required</h2>
-        <p>Dear Data Approver,</p>
-        <p>The user <strong>{user_name}</strong> has submitted a table access request that requires your approval:</p>
-        
-        <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid #17a2b8; margin: 20px 0;">
-            <h3 style="margin-top: 0; color: #17a2b8;">Request Details:</h3>
-            <ul style="list-style-type: none; padding-left: 0;">
-                <li><strong>Request ID:</strong> {request_id}</li>
-                <li><strong>Entity:</strong> {entity}</li>
-                <li><strong>Database:</strong> {database}</li>
-                <li><strong>Schema:</strong> {schema}</li>
-                <li><strong>Table Option:</strong> {table}</li>
-                <li><strong>Tables:</strong> {selected_names}</li>
-            </ul>
-        </div>
-        
-        <div style="text-align: center; margin: 30px 0;">
-            <a href='{get_current_url()}?approve_id={request_id}&type=data&action=approve&approver={data_approver}' 
-               style="background-color: #28a745; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
-               ✅ APPROVE REQUEST
-            </a>
-            <a href='{get_current_url()}?approve_id={request_id}&type=data&action=reject&approver={data_approver}' 
-               style="background-color: #dc3545; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
-               ❌ REJECT REQUEST
-            </a>
-        </div>
-        
-        <p style="font-size: 12px; color: #666; margin-top: 30px;">
-            <em>Note: Clicking on either button will take you to the approval page where the action will be processed automatically.</em>
-        </p>
-    </body>
-    </html>
+    reader.fieldnames = [normalize_csv_header(name) for name in reader.fieldnames]
+    missing_columns = [column for column in BULK_CSV_COLUMNS if column not in reader.fieldnames]
+    if missing_columns:
+        return [], [(1, f"Missing columns: {', '.join(missing_columns)}")]
+    
+    return validate_table_requests(enumerate(reader, start=2), user_email, entity, rm_approver, data_approvers, table_data)
+
+def validate_table_requests(numbered_rows, user_email, entity, rm_approver, data_approvers, table_data, header_number=1):
+    """Validate (number, row) pairs whose rows have the BULK_CSV_COLUMNS keys.
+    
+    Shared by the CSV upload and the JSON API. Returns (requests, errors) like
+    validate_bulk_requests; problems with the whole submission are numbered header_number.
     """
+    # Build catalog lookups once for the whole submission
+    catalog_tables = {}
+    for table in table_data:
+        catalog_tables.setdefault((table['object_source'], table['database'], table['schema']), set()).add(table['table'])
+    shared_schemas = {(source, database, schema) for source, database, schema in catalog_tables if source == entity}
+    data_approver_by_database = {}
+    for approver in data_approvers:
+        data_approver_by_database.setdefault(approver['database'], approver['approver'])
+    
+    requests = []
+    errors = []
+    
+    if not rm_approver:
+        errors.append((header_number, "RM approver not found for your account"))
+    
+    for line_number, row in numbered_rows:
+        row = {key: (value or '').strip() for key, value in row.items() if key}
+        object_source = row['object_source'].upper()
+        database = row['database']
+        schema = row['schema']
+        
+        if object_source not in OBJECT_SOURCES:
+            errors.append((line_number, f"Unknown object source '{row['object_source']}'"))
+            continue
+        
+        schema_tables = catalog_tables.get((object_source, database, schema))
+        if schema_tables is None:
+            errors.append((line_number, f"{database}.{schema} not found for {object_source}"))
+            continue
+        
+        # Tables are either ALL or a list separated by ';' or ','
+        if row['tables'].upper() == "ALL":
+            table_option = "All Tables"
+            selected_names = "ALL"
+        else:
+            tables = [name.strip() for name in row['tables'].replace(';', ',').split(',') if name.strip()]
+            unknown_tables = [name for name in tables if name not in schema_tables]
+            if not tables:
+                errors.append((line_number, "No tables given"))
+                continue
+            if unknown_tables:
+                errors.append((line_number, f"Tables not found in {database}.{schema}: {', '.join(unknown_tables)}"))
+                continue
+            table_option = "Select Tables"
+            selected_names = ", ".join(tables)
+        
+        grantee = row['grantee'].upper().replace(' ', '_')
+        if grantee not in GRANTEE_TYPES:
+            errors.append((line_number, f"Grantee must be one of {', '.join(GRANTEE_TYPES)}"))
+            continue
+        requesting_for = user_email if grantee == "SELF" else row.get('requesting_for', '')
+        if not requesting_for:
+            errors.append((line_number, "requesting_for is required for generic users and roles"))
+            continue
+        
+        try:
+            validity = int(row['validity'])
+        except ValueError:
+            validity = 0
+        if not 1 <= validity <= 30:
+            errors.append((line_number, "Validity must be a whole number of days between 1 and 30"))
+            continue
+        
+        if len(row['reason']) > REASON_MAX_CHARS:
+            errors.append((line_number, f"Reason must be at most {REASON_MAX_CHARS} characters"))
+            continue
+        
+        data_approver = data_approver_by_database.get(database, "")
+        if not data_approver:
+            errors.append((line_number, f"No data approver configured for {database}"))
+            continue
+        
+        requests.append({
+            'object_source': object_source,
+            'database': database,
+            'schema': schema,
+            'table': table_option,
+            'selected_names': selected_names,
+            'shared_status': "SHARED" if object_source == entity or (entity, database, schema) in shared_schemas else "NOT_SHARED",
+            'grantee': grantee,
+            'requesting_for': requesting_for,
+            'validity': validity,
+            'reason': row['reason'],
+            'rm_approver': rm_approver,
+            'data_approver': data_approver
+        })
+    
+    return requests, errors
+
+def send_grouped_approval_emails(requests, user_name, entity, user_email):
+    """Send one approval email per approver listing all of their requests from a bulk upload,
+    and the user one confirmation unless a single email (or their own approval) covers it"""
+    base_url = get_current_url()
+    summaries = [(request['request_id'], [("Database.Schema", f"{request['database']}.{request['schema']}"),
+                                          ("Tables", request['selected_names'])]) for request in requests]
+    assignments = [(request[f'{approver_type}_approver'], (approver_type, request))
+                   for request in requests for approver_type in ('rm', 'data')]
+    messages, confirm_requester = plan_recipients(assignments, user_email)
+    approver_emails = [to for to, _, _ in messages]
+    
+    if digest_enabled():
+        for request, (request_id, details) in zip(requests, summaries):
+            queue_request(request_id, [("Type", "Table request"), ("User", user_name), ("Entity", entity)] + details,
+                          [('rm', request['rm_approver']), ('data', request['data_approver'])], base_url)
+        # Approvers hear from the digest; the user still gets their confirmation now
+        if not confirm_requester and not any(cc for _, cc, _ in messages):
+            return True, None
+        return send_messages([(user_email, None, "Submitted: Table Access Requests",
+                               confirmation_body("Table Access Requests", summaries, approver_emails))])
+    
+    details_by_id = dict(summaries)
+    outgoing = []
+    for approver, cc, items in messages:
+        actions_by_request = {}
+        for approver_type, request in items:
+            actions_by_request.setdefault(request['request_id'], []).append((
+                approver_type,
+                approval_link(base_url, request['request_id'], approver_type, 'approve', approver),
+                approval_link(base_url, request['request_id'], approver_type, 'reject', approver)
+            ))
+        body = grouped_approval_body("Table Access Requests", f"{user_name} ({entity})", [
+            (request_id, details_by_id[request_id], actions) for request_id, actions in actions_by_request.items()
+        ])
+        outgoing.append((approver, cc, "Approval Needed: Table Access Requests", body))
+    
+    if confirm_requester:
+        outgoing.append((user_email, None, "Submitted: Table Access Requests",
+                         confirmation_body("Table Access Requests", summaries, approver_emails)))
+    return send_messages(outgoing)
+
+def submit_table_requests(requests, user_name, email, entity, default_role, token=None):
+    """Give validated requests their IDs, save them in one append and email their approvers.
     
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            
-            # Send to RM approver with RM-specific links
-            rm_message = MIMEMultipart("alternative")
-            rm_message["Subject"] = subject
-            rm_message["From"] = EMAIL_SENDER
-            rm_message["To"] = rm_approver
-            rm_message["Cc"] = user_email  # Add user to CC
-            rm_message.attach(MIMEText(rm_email_body, "html"))
-            server.sendmail(EMAIL_SENDER, [rm_approver, user_email], rm_message.as_string())
-            
-            # Send to Data approver with Data-specific links
-            data_message = MIMEMultipart("alternative")
-            data_message["Subject"] = subject
-            data_message["From"] = EMAIL_SENDER
-            data_message["To"] = data_approver
-            data_message["Cc"] = user_email  # Add user to CC
-            data_message.attach(MIMEText(data_email_body, "html"))
-            server.sendmail(EMAIL_SENDER, [data_approver, user_email], data_message.as_string())
-        
-        return True, None
-    except Exception as e:
-        return False, str(e)
+    token is the submission's idempotency token (by default derived from the requests),
+    so a repeat within the dedup window gets the original request IDs back instead of
+    saving again. Returns (saved, mail_sent, mail_error); mail_sent is None for such a
+    repeat, unless the first attempt's emails failed and this one sent them again.
+    """
+    for request in requests:
+        request['request_id'] = generate_request_id()
+    
+    rows = [[
+        "Table request", request['request_id'], user_name, email, entity, default_role,
+        request['object_source'], request['database'], request['schema'],
+        request['table'], request['selected_names'], "", request['shared_status'], request['grantee'],
+        request['requesting_for'], request['validity'], request['reason'],
+        request['rm_approver'], request['data_approver']
+    ] for request in requests]
+    
+    token = token or submission_token('table', email, [row[:1] + row[2:] for row in rows])
+    request_ids, notify = submit_once(
+        token, [request['request_id'] for request in requests], 'responses', lambda: append_rows_to_sheet(rows)
+    )
+    if not request_ids:
+        return False, False, None
+    for request, request_id in zip(requests, request_ids):
+        request['request_id'] = request_id
+    if not notify:
+        return True, None, None
+    mail_sent, mail_error = send_grouped_approval_emails(requests, user_name, entity, email)
+    record_notification(token, request_ids, mail_sent)
+    return True, mail_sent, mail_error
 
-def update_request_status(request_id, approver_type, new_status):
-    """Update request status in Google Sheets"""
-    try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
+def render_bulk_upload(user_name, email, entity, default_role, rm_approver, data_approvers, table_data):
+    """Bulk CSV submission of table access requests"""
+    with st.expander("📤 Bulk Upload (CSV)"):
+        st.caption(f"Columns: {', '.join(BULK_CSV_COLUMNS)} (optional: requesting_for). "
+                   "Use ALL or a ';' separated list for tables.")
+        st.download_button(
+            "Download Template",
+            data=",".join(BULK_CSV_COLUMNS + ['requesting_for']) + "\n",
+            file_name="table_requests_template.csv",
+            mime="text/csv",
+            key="bulk_template_table"
+        )
+        
+        uploaded_file = st.file_uploader("Upload CSV", type=["csv"], key="bulk_csv_table")
+        if not uploaded_file:
+            return
         
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='responses'
-        ).execute()
+        requests, errors = validate_bulk_requests(
+            uploaded_file.getvalue().decode('utf-8-sig'), email, entity, rm_approver, data_approvers, table_data
+        )
         
-        values = result.get('values', [])
-        if not values:
-            return False
+        if errors:
+            st.error(f"Found {len(errors)} problem(s). Fix the file and upload it again.")
+            for line_number, message in errors:
+                st.markdown(f"- Line {line_number}: {message}")
+            return
         
-        header = values[0]
-        try:
-            reqid_col = header.index('REQUEST_ID')
-            rm_col = header.index('RM_APPROVER_STATUS') 
-            data_col = header.index('DATA_APPROVER_STATUS')
-        except ValueError:
-            return False
-        
-        # Find row to update
-        row_to_update = -1
-        for idx, row in enumerate(values[1:], start=2):
-            if len(row) > reqid_col and row[reqid_col] == request_id:
-                row_to_update = idx
-                break
-        
-        if row_to_update == -1:
-            return False
-        
-        # Update status
-        update_col_index = rm_col if approver_type == 'rm' else data_col
-        update_col_letter = chr(ord('A') + update_col_index)
-        range_to_update = f"responses!{update_col_letter}{row_to_update}"
-        
-        sheet.values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range=range_to_update,
-            valueInputOption="RAW",
-            body={"values": [[new_status]]}
-        ).execute()
+        if not requests:
+            st.warning("The file has no requests.")
+            return
         
-        return True
+        st.success(f"{len(requests)} request(s) are valid.")
+        
+        if st.button(f"Submit {len(requests)} Request(s)", key="submit_bulk_table"):
+            saved, mail_sent, mail_error = submit_table_requests(requests, user_name, email, entity, default_role)
+            if saved:
+                if mail_sent is None:
+                    st.info("These requests were already submitted; their request IDs are below.")
+                elif mail_sent:
+                    st.success(f"{len(requests)} table requests submitted successfully! Approval emails sent.")
+                else:
+                    st.error(f"Requests saved but failed to send emails: {mail_error}")
+                st.dataframe(
+                    [{'Request ID': request['request_id'], 'Database': request['database'],
+                      'Schema': request['schema'], 'Tables': request['selected_names']} for request in requests],
+                    use_container_width=True,
+                    hide_index=True
+                )
+            else:
+                st.error("Failed to save requests. Please try again.")
+
+def update_request_status(request_id, approver_type, new_status, approver_email=''):
+    """Update request status in Google Sheets"""
+    try:
+        success, _, updated_row = transition_status(request_id, approver_type, new_status, actor=approver_email)
+        
+        # Fully approved grants start their validity countdown
+        if success and new_status == 'Approved':
+            track_approved_row(get_request_index().header('responses'), updated_row)
+        
+        return success
         
     except Exception:
         return False
@@ -378,7 +496,7 @@ def handle_approval_from_url():
             action_icon = '✅' if action == 'approve' else '❌'
             action_color = 'green' if action == 'approve' else 'red'
             
-            success = update_request_status(request_id, approver_type, new_status)
+            success = update_request_status(request_id, approver_type, new_status, approver_email)
             
             if success:
                 st.success(f"{action_icon} Request {action_text} successfully!")
@@ -413,26 +531,13 @@ def main():
     user_email = st.session_state.user_email
     
     # Initialize session state
-    if 'user_name' not in st.session_state:
-        st.session_state.user_name = ""
-    if 'email' not in st.session_state:
-        st.session_state.email = ""
-    if 'entity' not in st.session_state:
-        st.session_state.entity = ""
-    if 'default_role' not in st.session_state:
-        st.session_state.default_role = ""
-    if 'rm_approver' not in st.session_state:
-        st.session_state.rm_approver = ""
-    if 'data_approver' not in st.session_state:
-        st.session_state.data_approver = ""
-    if 'requesting_for_option' not in st.session_state:
-        st.session_state.requesting_for_option = "Self"
-    if 'selected_object_source' not in st.session_state:
-        st.session_state.selected_object_source = "Select Object Source"
-    if 'selected_database' not in st.session_state:
-        st.session_state.selected_database = "Select Database"
-    if 'selected_schema' not in st.session_state:
-        st.session_state.selected_schema = "Select Schema"
+    ensure_defaults({
+        'user_name': "", 'email': "", 'entity': "", 'default_role': "",
+        'rm_approver': "", 'data_approver': "", 'requesting_for_option': "Self",
+        'selected_object_source': "Select Object Source",
+        'selected_database': "Select Database",
+        'selected_schema': "Select Schema"
+    })
 
     
     # Fetch all data in one optimized call
@@ -469,10 +574,29 @@ def main():
     email = st.session_state.email
     default_role = st.session_state.default_role
     
+    # Bulk submission from a CSV file
+    render_bulk_upload(user_name, email, entity, default_role, st.session_state.rm_approver, data_approvers, table_data)
+    
+    # Global table search - picking a result fills Object Source, Database, Schema and Table
+    search_query = st.text_input("Search Tables", placeholder="Type a table name or DATABASE.SCHEMA.TABLE", key="table_search")
+    if search_query:
+        matches = get_table_search_index().search(search_query)
+        if matches:
+            matches_by_label = {f"{table_fqn(match)} ({match['object_source']})": match for match in matches}
+            st.selectbox(
+                "Matching Tables",
+                options=["Select a matching table"] + list(matches_by_label),
+                key="table_search_pick",
+                on_change=apply_table_search_pick,
+                args=(matches_by_label,)
+            )
+        else:
+            st.info("No tables match your search.")
+    
     # Database selection
     
     # Object Source
-    object_source_options = ["Select Object Source", "CSPL", "CAPL", "CFSPL"]
+    object_source_options = ["Select Object Source"] + OBJECT_SOURCES
     selected_object_source = st.selectbox("Object Source", options=object_source_options, key="object_source_dropdown")
     
     if selected_object_source != st.session_state.selected_object_source:
@@ -555,10 +679,7 @@ def main():
             # Fetch generic users for the user's entity
             generic_users = []
             try:
-                service = get_sheets_service()
-                sheet = service.spreadsheets()
-                result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='generic roles/users').execute()
-                values = result.get('values', [])
+                values = get_storage().read_tabs(['generic roles/users'])['generic roles/users']
                 if len(values) > 1:
                     header = values[0]
                     try:
@@ -587,10 +708,7 @@ def main():
             # Fetch generic roles for the user's entity
             generic_roles = []
             try:
-                service = get_sheets_service()
-                sheet = service.spreadsheets()
-                result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='generic roles/users').execute()
-                values = result.get('values', [])
+                values = get_storage().read_tabs(['generic roles/users'])['generic roles/users']
                 if len(values) > 1:
                     header = values[0]
                     try:
@@ -656,10 +774,7 @@ def main():
         if st.session_state.entity != selected_object_source:
             # Case 2: Entity and object source are different
             try:
-                service = get_sheets_service()
-                sheet = service.spreadsheets()
-                result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='table_list').execute()
-                values = result.get('values', [])
+                values = get_storage().read_tabs(['table_list'])['table_list']
                 
                 if len(values) > 1:
                     header = values[0]
@@ -689,15 +804,14 @@ def main():
         
         # Create a unique key for this form combination
         form_key = f"{selected_database}_{selected_schema}_{table}_{selected_names}"
-        confirmation_key = f"confirmed_{form_key}"
         
         # Check if database.schema is not shared and show warning message once
-        if shared_status == "NOT_SHARED" and not st.session_state.get(confirmation_key, False):
+        if shared_status == "NOT_SHARED" and not recall('table_confirmed', form_key, False):
             target_fqn = f"{selected_database}.{selected_schema}"
             
             st.warning(f"This database.schema ({target_fqn}) is not shared. You can still proceed with your request.")
-            # Mark this form combination as warned
-            st.session_state[confirmation_key] = True
+            # Mark this form combination as warned; only the most recent combinations are kept
+            remember('table_confirmed', form_key, True)
             return
         
         # If we reach here, either it's SHARED or user has already seen the warning
@@ -711,20 +825,26 @@ def main():
         # Debug: Show what we're actually sending
         print("FORM DATA BEING SENT:", form_data)
         
-        # Save to Google Sheets
-        if append_to_sheet(form_data):
+        # Save to Google Sheets; a double-click or retry of the same request gets the original back
+        token = submission_token('table', email, form_data[:1] + form_data[2:])
+        request_ids, notify = submit_once(token, [request_id], 'responses', lambda: append_to_sheet(form_data))
+        if request_ids and not notify:
+            st.info(f"This request was already submitted. Your request ID is: {request_ids[0]}")
+            return
+        if request_ids:
+            # A repeat whose first emails failed sends them for the original request
+            request_id = request_ids[0]
             mail_sent, mail_error = send_approval_email(
                 request_id, user_name, entity, selected_database, selected_schema,
                 table, selected_names, rm_approver, data_approver, email
             )
+            record_notification(token, request_ids, mail_sent)
             
             if mail_sent:
                 st.success("Table request submitted successfully! Approval emails sent.")
                 st.success(f"Your request ID is: {request_id}")
-                # Reset the specific confirmation key for this form combination
-                form_key = f"{selected_database}_{selected_schema}_{table}_{selected_names}"
-                confirmation_key = f"confirmed_{form_key}"
-                st.session_state[confirmation_key] = False
+                # Reset the confirmation for this form combination
+                forget('table_confirmed', form_key)
                 # Don't call st.rerun() to keep the message visible
                 return
             else:
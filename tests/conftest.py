@@ -0,0 +1,98 @@
+import os
+import email
+import sys
+import types
+import importlib.util
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# config.py holds deployment secrets and is not checked in; the tests only need the shared settings
+if importlib.util.find_spec('config') is None:
+    config = types.ModuleType('config')
+    config.SPREADSHEET_ID = 'test-spreadsheet'
+    config.TOKEN_FILE = 'token.pickle'
+    config.CREDENTIALS_FILE = 'credentials.json'
+    config.SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    config.CACHE_TTL = 300
+    config.DEFAULT_URL = 'http://localhost:8501'
+    config.REQUEST_PREFIX = 'REQ'
+    config.PENDING_STATUS = 'Pending'
+    config.APPROVED_STATUS = 'Approved'
+    config.REJECTED_STATUS = 'Rejected'
+    config.EMAIL_SENDER = 'noreply@example.com'
+    config.EMAIL_PASSWORD = ''
+    sys.modules['config'] = config
+
+RESPONSES_HEADER = ['REQUEST_TYPE', 'REQUEST_ID', 'USER', 'EMAIL', 'RM_APPROVER', 'DATA_APPROVER',
+                    'RM_APPROVER_STATUS', 'DATA_APPROVER_STATUS']
+USER_RESPONSES_HEADER = ['Request_id', 'User', 'Manager_Email', 'BU', 'Entity', 'Approval_status']
+
+def clear_shared_caches():
+    import storage
+    import request_index
+    import submissions
+    import event_log
+    for cached in (storage.get_storage, request_index.get_request_index,
+                   submissions.get_submission_ledger, event_log.get_event_state):
+        cached.clear()
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Every test writes its ledgers and logs into its own directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def backend(monkeypatch):
+    """A memory backend with empty request tabs behind get_storage"""
+    import storage
+    memory = storage.MemoryBackend({'responses': [RESPONSES_HEADER], 'user_responses': [USER_RESPONSES_HEADER]})
+    monkeypatch.setattr(storage, 'create_backend', lambda name=None: memory)
+    monkeypatch.setattr(storage, 'SHARED_CACHE_FILE', '')
+    clear_shared_caches()
+    yield memory
+    clear_shared_caches()
+
+class FakeSMTP:
+    """Records the messages sent; fail_after makes the n-th sendmail and later ones fail"""
+    sent = []
+    fail_after = None
+
+    def __init__(self, host, port):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        if FakeSMTP.fail_after is not None and len(FakeSMTP.sent) >= FakeSMTP.fail_after:
+            raise OSError("connection dropped")
+        FakeSMTP.sent.append((recipients, message))
+
+@pytest.fixture
+def mailbox(monkeypatch):
+    """Messages go to FakeSMTP.sent instead of the mail server; digests are off"""
+    import notifications
+    import digest
+    FakeSMTP.sent = []
+    FakeSMTP.fail_after = None
+    monkeypatch.setattr(notifications.smtplib, 'SMTP', FakeSMTP)
+    monkeypatch.setattr(digest, 'DIGEST_WINDOW', 0)
+    return FakeSMTP
+
+def html(message):
+    """The HTML part of a sent message"""
+    part = next(part for part in email.message_from_string(message).walk() if part.get_content_type() == 'text/html')
+    return part.get_payload(decode=True).decode('utf-8')
@@ -0,0 +1,89 @@
+import api
+from event_log import request_history
+from request_ids import new_request_id
+from conftest import RESPONSES_HEADER
+
+STATUS_COL = RESPONSES_HEADER.index('RM_APPROVER_STATUS')
+
+def add_request(backend, request_id, requester='u@x.com', rm_approver='rm@x.com'):
+    backend.append_rows('responses', [['Table request', request_id, 'u', requester, rm_approver, 'd@x.com',
+                                       'Pending', 'Pending']])
+
+def rm_status(backend, request_id):
+    return next(row for row in backend.tabs['responses'] if row[1] == request_id)[STATUS_COL]
+
+def decide(request_id, action, caller, **body):
+    return api.route('POST', f'/api/requests/{request_id}/{action}', {'approver_type': 'rm', **body},
+                     approver=caller)
+
+def test_approver_tokens_identify_their_approver():
+    token = api.issue_approver_token('RM@x.com')
+    assert api.approver_for_token(token) == 'rm@x.com'
+    assert api.approver_for_token('not-a-token') is None
+    assert token not in open(api.APPROVER_TOKENS_FILE).read()
+
+def test_assigned_approver_approves(backend):
+    add_request(backend, 'REQ_1')
+    status, payload = decide('REQ_1', 'approve', 'rm@x.com')
+    assert status == 200 and payload['request_id'] == 'REQ_1'
+    assert rm_status(backend, 'REQ_1') == 'Approved'
+
+def test_reject_keeps_the_reason(backend):
+    add_request(backend, 'REQ_1')
+    status, _ = decide('REQ_1', 'reject', 'rm@x.com', reason='No business need')
+    assert status == 200
+    assert rm_status(backend, 'REQ_1') == 'Rejected'
+    assert request_history('REQ_1')[-1]['reason'] == 'No business need'
+
+def test_decided_request_conflicts(backend):
+    add_request(backend, 'REQ_1')
+    decide('REQ_1', 'approve', 'rm@x.com')
+    status, payload = decide('REQ_1', 'reject', 'rm@x.com')
+    assert status == 409 and payload['error'] == "Request is already Approved"
+
+def test_only_the_assigned_approver_decides(backend):
+    add_request(backend, 'REQ_1')
+    # Naming the assigned approver in the body does not help
+    status, _ = decide('REQ_1', 'approve', 'other@x.com', approver='rm@x.com')
+    assert status == 403
+    assert rm_status(backend, 'REQ_1') == 'Pending'
+
+def test_approvers_cannot_decide_their_own_requests(backend):
+    add_request(backend, 'REQ_1', requester='rm@x.com')
+    status, payload = decide('REQ_1', 'approve', 'rm@x.com')
+    assert status == 403 and payload['error'] == "Approvers cannot decide their own requests"
+
+def test_shared_token_cannot_decide(backend):
+    add_request(backend, 'REQ_1')
+    status, _ = decide('REQ_1', 'approve', None)
+    assert status == 403
+
+def test_approver_tokens_cannot_submit(backend):
+    status, _ = api.route('POST', '/api/table-requests', {}, approver='rm@x.com')
+    assert status == 403
+
+def test_unknown_requests_are_not_found_without_a_rebuild(backend):
+    add_request(backend, 'REQ_1')
+    decide('REQ_1', 'approve', 'rm@x.com')
+    reads = []
+    read_tabs = backend.read_tabs
+    backend.read_tabs = lambda tabs: (reads.append(tabs), read_tabs(tabs))[1]
+
+    assert decide('REQ_NOPE', 'approve', 'rm@x.com')[0] == 404
+    assert decide(new_request_id(), 'approve', 'rm@x.com')[0] == 404
+    assert reads == []
+
+def test_recent_request_from_another_process_is_found(backend):
+    add_request(backend, 'REQ_1')
+    decide('REQ_1', 'approve', 'rm@x.com')
+    request_id = new_request_id()
+    add_request(backend, request_id)
+
+    status, _ = decide(request_id, 'approve', 'rm@x.com')
+    assert status == 200
+    assert rm_status(backend, request_id) == 'Approved'
+
+def test_unknown_approver_type_is_rejected(backend):
+    add_request(backend, 'REQ_1')
+    status, _ = api.route('POST', '/api/requests/REQ_1/approve', {'approver_type': 'boss'}, approver='rm@x.com')
+    assert status == 400
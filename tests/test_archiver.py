@@ -0,0 +1,82 @@
+import datetime
+import archiver
+from archiver import archive_finalized_requests
+from request_ids import new_request_id
+from request_index import get_request_index, transition_status
+from conftest import RESPONSES_HEADER
+
+def request_row(request_id, rm_status, data_status):
+    return ['Table request', request_id, 'u', 'u@x.com', 'rm@x.com', 'd@x.com', rm_status, data_status]
+
+def old_id(days, number=1234):
+    """A legacy-format ID issued days ago, in local time"""
+    issued_at = datetime.datetime.now() - datetime.timedelta(days=days)
+    return f"REQ_{issued_at.strftime('%Y%m%d_%H%M%S')}_{number}"
+
+def request_ids(backend, tab='responses'):
+    return [row[1] for row in backend.tabs[tab][1:]]
+
+def test_only_old_finalized_requests_are_archived(backend):
+    approved, rejected, pending = old_id(120, 1), old_id(120, 2), old_id(120, 3)
+    recent = old_id(30, 4)
+    backend.append_rows('responses', [
+        request_row(approved, 'Approved', 'Approved'),
+        request_row(rejected, 'Rejected', 'Pending'),
+        request_row(pending, 'Approved', 'Pending'),
+        request_row(recent, 'Approved', 'Approved'),
+    ])
+
+    tab = archiver.archive_tab_name('responses', datetime.datetime.now() - datetime.timedelta(days=120))
+    assert archive_finalized_requests('responses') == {tab: 2}
+    assert request_ids(backend) == [pending, recent]
+    assert backend.tabs[tab][0] == RESPONSES_HEADER
+    assert request_ids(backend, tab) == [approved, rejected]
+
+def test_cutoff_follows_max_age(backend):
+    request_id = old_id(10)
+    backend.append_rows('responses', [request_row(request_id, 'Approved', 'Approved')])
+    assert archive_finalized_requests('responses', max_age_days=30) == {}
+    assert len(archive_finalized_requests('responses', max_age_days=5)) == 1
+    assert request_ids(backend) == []
+
+def test_current_format_ids_are_dated_by_their_timestamp(backend):
+    request_id = new_request_id()
+    backend.append_rows('responses', [request_row(request_id, 'Approved', 'Approved')])
+    assert archive_finalized_requests('responses', max_age_days=1) == {}
+    assert archive_finalized_requests('responses', max_age_days=-1) != {}
+
+def test_dry_run_changes_nothing(backend):
+    backend.append_rows('responses', [request_row(old_id(120), 'Approved', 'Approved')])
+    before = {tab: [list(row) for row in rows] for tab, rows in backend.tabs.items()}
+    assert len(archive_finalized_requests('responses', dry_run=True)) == 1
+    assert backend.tabs == before
+
+def test_rows_moved_during_the_run_are_deleted_by_request_id(backend):
+    archived = old_id(120, 1)
+    kept = old_id(30, 2)
+    inserted = old_id(1, 3)
+    backend.append_rows('responses', [request_row(kept, 'Approved', 'Pending'),
+                                      request_row(archived, 'Approved', 'Approved')])
+    append_rows = backend.append_rows
+
+    def append_and_shift(tab, rows, value_input_option="RAW"):
+        append_rows(tab, rows, value_input_option)
+        if tab != 'responses':
+            # Someone inserts a row above the archived one while the archive is written
+            backend.tabs['responses'].insert(1, request_row(inserted, 'Pending', 'Pending'))
+
+    backend.append_rows = append_and_shift
+    archive_finalized_requests('responses')
+    assert request_ids(backend) == [inserted, kept]
+
+def test_servers_find_requests_moved_by_the_archiver(backend):
+    archived = old_id(120, 1)
+    pending = old_id(1, 2)
+    backend.append_rows('responses', [request_row(archived, 'Approved', 'Approved'),
+                                      request_row(pending, 'Pending', 'Pending')])
+    get_request_index()
+
+    archive_finalized_requests('responses')
+    success, _, _ = transition_status(pending, 'rm', 'Approved')
+    assert success
+    assert backend.tabs['responses'][1] == request_row(pending, 'Approved', 'Pending')
@@ -0,0 +1,72 @@
+from batch_approver import read_decisions, commit_decisions
+from request_index import get_request_index, transition_status
+from conftest import RESPONSES_HEADER
+
+RM_STATUS = RESPONSES_HEADER.index('RM_APPROVER_STATUS')
+
+def add_requests(backend, *request_ids):
+    backend.append_rows('responses', [['Table request', request_id, 'u', 'u@x.com', 'rm@x.com', 'd@x.com',
+                                       'Pending', 'Pending'] for request_id in request_ids])
+
+def planned(request_id, status, reason=''):
+    return {'line': 1, 'request_id': request_id, 'status': status, 'reason': reason, 'approver_type': 'rm'}
+
+def rm_statuses(backend):
+    return {row[1]: row[RM_STATUS] for row in backend.tabs['responses'][1:]}
+
+def test_read_decisions_reports_every_problem(tmp_path):
+    path = tmp_path / 'decisions.csv'
+    path.write_text("request_id,decision,reason\n"
+                    "REQ_1,approve,\n"
+                    "# skipped\n"
+                    "REQ_2,Reject,not needed\n"
+                    "REQ_3,maybe,\n"
+                    "REQ_4,reject,\n"
+                    "REQ_1,approve,\n")
+    decisions, errors = read_decisions(str(path))
+    assert [(decision['request_id'], decision['status']) for decision in decisions] == [
+        ('REQ_1', 'Approved'), ('REQ_2', 'Rejected')]
+    assert [line for line, _ in errors] == [5, 6, 7]
+
+def test_decisions_are_written_in_one_batch(backend):
+    add_requests(backend, 'REQ_1', 'REQ_2')
+    writes = []
+    update_cells = backend.update_cells
+    backend.update_cells = lambda tab, updates: (writes.append(updates), update_cells(tab, updates))
+
+    committed, conflicts = commit_decisions(
+        [planned('REQ_1', 'Approved'), planned('REQ_2', 'Rejected', 'not needed')], 'rm@x.com')
+    assert len(committed) == 2 and conflicts == []
+    assert len(writes) == 1
+    assert rm_statuses(backend) == {'REQ_1': 'Approved', 'REQ_2': 'Rejected'}
+    assert get_request_index().request_row('responses', 'REQ_2')[RM_STATUS] == 'Rejected'
+
+def test_requests_decided_after_planning_are_conflicts(backend):
+    add_requests(backend, 'REQ_1', 'REQ_2')
+    get_request_index()
+    # Decided on the dashboard after the batch was planned
+    backend.update_cells('responses', [(2, RM_STATUS, 'Rejected')])
+
+    committed, conflicts = commit_decisions([planned('REQ_1', 'Approved'), planned('REQ_2', 'Approved')],
+                                            'rm@x.com')
+    assert [decision['request_id'] for decision in committed] == ['REQ_2']
+    assert [(decision['request_id'], decision['message']) for decision in conflicts] == [
+        ('REQ_1', "Request is already Rejected")]
+    assert rm_statuses(backend) == {'REQ_1': 'Rejected', 'REQ_2': 'Approved'}
+
+def test_rows_moved_since_planning_are_found_by_request_id(backend):
+    add_requests(backend, 'REQ_1', 'REQ_2')
+    get_request_index()
+    backend.delete_rows('responses', [2])
+
+    committed, conflicts = commit_decisions([planned('REQ_1', 'Approved'), planned('REQ_2', 'Approved')],
+                                            'rm@x.com')
+    assert [decision['request_id'] for decision in committed] == ['REQ_2']
+    assert conflicts[0]['message'] == "Request ID not found"
+    assert rm_statuses(backend) == {'REQ_2': 'Approved'}
+
+def test_dashboard_sees_batch_decisions_as_conflicts(backend):
+    add_requests(backend, 'REQ_1')
+    commit_decisions([planned('REQ_1', 'Approved')], 'rm@x.com')
+    success, message, _ = transition_status('REQ_1', 'rm', 'Rejected')
+    assert not success and message == "Request is already Approved"
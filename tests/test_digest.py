@@ -0,0 +1,75 @@
+from contextlib import closing
+import pytest
+import digest
+from digest import queue_request, flush_digests, claim_due, DIGEST_CLAIM_LEASE
+from request_index import transition_status
+from conftest import html
+
+NOW = 1_000_000.0
+
+@pytest.fixture
+def smtp(mailbox, monkeypatch, backend):
+    monkeypatch.setattr(digest, 'DIGEST_WINDOW', 30 * 60)
+    monkeypatch.setattr(digest.time, 'time', lambda: NOW)
+    return mailbox
+
+def add_request(backend, request_id, rm_approver):
+    backend.append_rows('responses', [['Table request', request_id, 'u', 'u@x.com', rm_approver, 'd@x.com',
+                                       'Pending', 'Pending']])
+
+def queue(backend, request_id, rm_approver):
+    add_request(backend, request_id, rm_approver)
+    queue_request(request_id, [("Database", "DB")], [('rm', rm_approver)], 'http://app')
+
+def recipients(smtp):
+    return [to for to, _ in smtp.sent]
+
+def queued_count():
+    with closing(digest.connect()) as connection:
+        return connection.execute('SELECT COUNT(*) FROM queued_notifications').fetchone()[0]
+
+def test_digests_wait_for_the_window(smtp, backend):
+    queue(backend, 'REQ_1', 'rm@x.com')
+    assert flush_digests(now=NOW + 60) == {}
+    assert flush_digests(now=NOW + digest.DIGEST_WINDOW) == {'rm@x.com': 1}
+    assert recipients(smtp) == [['rm@x.com']]
+    assert queued_count() == 0
+
+def test_one_digest_per_approver_whatever_the_case(smtp, backend):
+    queue(backend, 'REQ_1', 'RM@x.com')
+    queue(backend, 'REQ_2', ' rm@X.com')
+    queue(backend, 'REQ_3', 'other@x.com')
+    assert flush_digests(force=True) == {'rm@x.com': 2, 'other@x.com': 1}
+    assert sorted(recipients(smtp)) == [['other@x.com'], ['rm@x.com']]
+    digest_html = html(next(message for to, message in smtp.sent if to == ['rm@x.com']))
+    assert 'REQ_1' in digest_html and 'REQ_2' in digest_html
+
+def test_decided_requests_are_dropped(smtp, backend):
+    queue(backend, 'REQ_1', 'rm@x.com')
+    queue(backend, 'REQ_2', 'rm@x.com')
+    transition_status('REQ_1', 'rm', 'Approved')
+    assert flush_digests(force=True) == {'rm@x.com': 1}
+    assert 'REQ_1' not in html(smtp.sent[0][1]) and 'REQ_2' in html(smtp.sent[0][1])
+    assert queued_count() == 0
+
+def test_failed_send_keeps_unsent_digests(smtp, backend):
+    queue(backend, 'REQ_1', 'first@x.com')
+    queue(backend, 'REQ_2', 'second@x.com')
+    smtp.fail_after = 1
+    with pytest.raises(RuntimeError):
+        flush_digests(force=True)
+    assert recipients(smtp) == [['first@x.com']]
+    assert queued_count() == 1
+
+    smtp.fail_after = None
+    assert flush_digests(force=True) == {'second@x.com': 1}
+    assert recipients(smtp) == [['first@x.com'], ['second@x.com']]
+
+def test_claims_of_a_dead_flush_are_reclaimed_after_the_lease(smtp, backend):
+    queue(backend, 'REQ_1', 'rm@x.com')
+    assert len(claim_due(NOW, force=True)) == 1
+    # The flush that claimed it never finished
+    assert claim_due(NOW + 60, force=True) == []
+    assert flush_digests(now=NOW + 60, force=True) == {}
+    assert flush_digests(now=NOW + DIGEST_CLAIM_LEASE + 1, force=True) == {'rm@x.com': 1}
+    assert queued_count() == 0
@@ -0,0 +1,75 @@
+import glob
+import multiprocessing
+import event_log
+from event_log import append_event, compact, replay, request_history, get_event_state, SUBMITTED_EVENT, STATUS_EVENT
+
+def submit(request_id):
+    append_event(SUBMITTED_EVENT, request_id, sheet='responses', requester='a@x.com',
+                 statuses={'rm': 'Pending', 'data': 'Pending'})
+
+def decide(request_id, approver_type, status):
+    append_event(STATUS_EVENT, request_id, sheet='responses', approver_type=approver_type, status=status)
+
+def test_replay_folds_events_in_order():
+    submit('REQ_1')
+    decide('REQ_1', 'rm', 'Approved')
+    state = replay()
+    assert state['REQ_1']['statuses'] == {'rm': 'Approved', 'data': 'Pending'}
+    assert state['REQ_1']['requester'] == 'a@x.com'
+
+def test_replay_after_compaction_matches_full_replay():
+    submit('REQ_1')
+    submit('REQ_2')
+    decide('REQ_1', 'rm', 'Approved')
+    before = replay()
+
+    assert compact() == 3
+    assert replay() == before
+
+    decide('REQ_1', 'data', 'Approved')
+    decide('REQ_2', 'rm', 'Rejected')
+    state = replay()
+    assert state['REQ_1']['statuses'] == {'rm': 'Approved', 'data': 'Approved'}
+    assert state['REQ_2']['statuses'] == {'rm': 'Rejected', 'data': 'Pending'}
+
+def test_compaction_keeps_history_in_segments():
+    submit('REQ_1')
+    compact()
+    decide('REQ_1', 'rm', 'Approved')
+    assert len(glob.glob(event_log.EVENT_SEGMENT_PATTERN)) == 1
+    assert [record['event'] for record in request_history('REQ_1')] == [SUBMITTED_EVENT, STATUS_EVENT]
+
+def test_incremental_state_restarts_from_snapshot_after_compaction():
+    state = get_event_state()
+    submit('REQ_1')
+    assert state.refresh()['REQ_1']['statuses']['rm'] == 'Pending'
+
+    compact()
+    decide('REQ_1', 'rm', 'Approved')
+    assert state.refresh()['REQ_1']['statuses']['rm'] == 'Approved'
+    assert state.refresh() == replay()
+    get_event_state.clear()
+
+def test_torn_last_line_is_left_for_later():
+    submit('REQ_1')
+    with open(event_log.EVENT_LOG_FILE, 'a', encoding='utf-8') as log:
+        log.write('{"event": "status"')
+    assert list(replay()) == ['REQ_1']
+
+def append_many(prefix, count):
+    for number in range(count):
+        submit(f'{prefix}_{number}')
+
+def test_no_event_is_lost_to_a_concurrent_compaction():
+    writers = [multiprocessing.get_context('fork').Process(target=append_many, args=(f'REQ_{writer}', 200))
+               for writer in range(4)]
+    for writer in writers:
+        writer.start()
+    while any(writer.is_alive() for writer in writers):
+        compact()
+    for writer in writers:
+        writer.join()
+
+    assert len(replay()) == 800
+    compact()
+    assert sum(len(event_log.read_events(path)[0]) for path in glob.glob(event_log.EVENT_SEGMENT_PATTERN)) == 800
@@ -0,0 +1,114 @@
+import json
+import logging
+import datetime
+import pytest
+import expiry
+from expiry import (GrantLedger, grant_expiry, build_expiry_index, get_expiry_index, get_grant_ledger,
+                    track_approved_row, sweep_expired_grants, EXPIRED_STATUS)
+import event_log
+from event_log import get_event_state, STATUS_EVENT
+from conftest import RESPONSES_HEADER
+
+HEADER = RESPONSES_HEADER + ['VALIDITY']
+NOW = datetime.datetime(2025, 3, 1, 12, 0)
+
+@pytest.fixture
+def responses(backend):
+    backend.tabs['responses'] = [list(HEADER)]
+    get_expiry_index.clear()
+    get_grant_ledger.clear()
+    get_event_state.clear()
+    yield backend
+    get_expiry_index.clear()
+    get_grant_ledger.clear()
+    get_event_state.clear()
+
+def grant_row(request_id, validity, rm_status='Approved', data_status='Approved'):
+    return ['Table request', request_id, 'u', 'u@x.com', 'rm@x.com', 'd@x.com', rm_status, data_status, validity]
+
+def legacy_id(issued_at, number=1234):
+    return f"REQ_{issued_at.strftime('%Y%m%d_%H%M%S')}_{number}"
+
+def test_grant_expiry():
+    assert grant_expiry(NOW, '7') == NOW + datetime.timedelta(days=7)
+    assert grant_expiry(NOW, 3.0) == NOW + datetime.timedelta(days=3)
+    assert grant_expiry(NOW, '') is None
+    assert grant_expiry(NOW, '0') is None
+    assert grant_expiry(None, '7') is None
+
+def test_ledger_keeps_the_first_recorded_time(tmp_path):
+    ledger = GrantLedger(str(tmp_path / 'grants.db'))
+    assert ledger.approved_at({'REQ_1': NOW})['REQ_1'] == NOW
+    later = NOW + datetime.timedelta(days=2)
+    assert ledger.approved_at({'REQ_1': later, 'REQ_2': later}) == {'REQ_1': NOW, 'REQ_2': later}
+    ledger.keep_only(['REQ_2'])
+    assert ledger.approved_at({'REQ_1': later})['REQ_1'] == later
+
+def test_unrecorded_grants_use_the_logged_approval(responses):
+    request_id = legacy_id(NOW - datetime.timedelta(days=20))
+    with open(event_log.EVENT_LOG_FILE, 'a', encoding='utf-8') as log:
+        for approver_type, days_ago in (('rm', 10), ('data', 6)):
+            log.write(json.dumps({'at': (NOW - datetime.timedelta(days=days_ago)).isoformat(), 'event': STATUS_EVENT,
+                                  'request_id': request_id, 'sheet': 'responses',
+                                  'approver_type': approver_type, 'status': 'Approved'}) + '\n')
+
+    index = build_expiry_index([HEADER, grant_row(request_id, '7')], now=NOW)
+    assert index.expiries[request_id] == NOW + datetime.timedelta(days=1)
+
+def test_unrecorded_grants_fall_back_to_their_submission_time(responses):
+    request_id = legacy_id(NOW - datetime.timedelta(days=20))
+    index = build_expiry_index([HEADER, grant_row(request_id, '7'), grant_row('REQ_CUSTOM', '7')], now=NOW)
+    # A lost ledger must not hand old grants a fresh window
+    assert index.expiries[request_id] == NOW - datetime.timedelta(days=13)
+    assert index.expiries['REQ_CUSTOM'] == NOW + datetime.timedelta(days=7)
+
+def test_recorded_approval_wins_over_the_fallback(responses):
+    request_id = legacy_id(NOW - datetime.timedelta(days=20))
+    get_grant_ledger().approved_at({request_id: NOW - datetime.timedelta(days=2)})
+    index = build_expiry_index([HEADER, grant_row(request_id, '7')], now=NOW)
+    assert index.expiries[request_id] == NOW + datetime.timedelta(days=5)
+
+def test_pending_grants_are_not_tracked(responses):
+    index = build_expiry_index([HEADER, grant_row('REQ_1', '7', data_status='Pending')], now=NOW)
+    assert len(index) == 0
+
+def test_validity_counts_from_approval(responses):
+    request_id = legacy_id(datetime.datetime.now() - datetime.timedelta(days=30))
+    responses.tabs['responses'].append(grant_row(request_id, '7', data_status='Pending'))
+    assert len(get_expiry_index()) == 0
+
+    before = datetime.datetime.now()
+    track_approved_row(HEADER, grant_row(request_id, '7'))
+    expires_at = get_expiry_index().expiries[request_id]
+    assert before + datetime.timedelta(days=7) <= expires_at <= datetime.datetime.now() + datetime.timedelta(days=7)
+
+def test_tracking_failures_are_logged(responses, monkeypatch, caplog):
+    def broken():
+        raise RuntimeError("no ledger")
+    monkeypatch.setattr(expiry, 'get_grant_ledger', broken)
+    responses.tabs['responses'].append(grant_row('REQ_1', '7', data_status='Pending'))
+    with caplog.at_level(logging.ERROR, logger='expiry'):
+        track_approved_row(HEADER, grant_row('REQ_1', '7'))
+    assert "Could not track" in caplog.text
+
+def test_sweep_expires_due_grants_in_one_write(responses):
+    due = legacy_id(NOW - datetime.timedelta(days=20), 1)
+    later = legacy_id(NOW - datetime.timedelta(days=20), 2)
+    revoked = legacy_id(NOW - datetime.timedelta(days=20), 3)
+    responses.tabs['responses'] += [grant_row(due, '7'), grant_row(later, '30'), grant_row(revoked, '7')]
+    get_expiry_index()
+    # Rejected by hand after the index was built
+    responses.tabs['responses'][3][HEADER.index('DATA_APPROVER_STATUS')] = 'Rejected'
+    writes = []
+    update_cells = responses.update_cells
+    responses.update_cells = lambda tab, updates: (writes.append(updates), update_cells(tab, updates))
+
+    assert sweep_expired_grants(now=NOW, dry_run=True) == [due]
+    assert writes == []
+
+    assert sweep_expired_grants(now=NOW) == [due]
+    assert len(writes) == 1
+    assert responses.tabs['responses'][1][6:8] == [EXPIRED_STATUS, EXPIRED_STATUS]
+    assert responses.tabs['responses'][2][6:8] == ['Approved', 'Approved']
+    assert list(get_expiry_index().expiries) == [later]
+    assert sweep_expired_grants(now=NOW) == []
@@ -0,0 +1,27 @@
+from notifications import plan_recipients, notify_request
+from conftest import html
+
+def test_one_message_per_distinct_approver():
+    messages, confirm = plan_recipients([('rm@x.com', 'rm'), ('RM@x.com ', 'data')], 'u@x.com')
+    assert messages == [['rm@x.com', 'u@x.com', ['rm', 'data']]] and not confirm
+
+def test_requester_confirmed_once_when_several_messages_go_out():
+    messages, confirm = plan_recipients([('rm@x.com', 'rm'), ('data@x.com', 'data')], 'u@x.com')
+    assert [cc for _, cc, _ in messages] == [None, None] and confirm
+
+def test_requester_who_approves_needs_nothing_more():
+    messages, confirm = plan_recipients([('u@x.com', 'rm'), ('data@x.com', 'data')], 'U@x.com')
+    assert [cc for _, cc, _ in messages] == [None, None] and not confirm
+
+def test_notify_request_sends_the_minimum(mailbox):
+    assert notify_request("Table Access Request", "User", 'REQ_1', [("Database", "SALES")],
+                          [('rm', 'rm@x.com'), ('data', 'data@x.com')], 'u@x.com', 'http://app') == (True, None)
+    assert [to for to, _ in mailbox.sent] == [['rm@x.com'], ['data@x.com'], ['u@x.com']]
+    assert 'Submitted' in html(mailbox.sent[2][1]) and 'REQ_1' in html(mailbox.sent[2][1])
+
+def test_approver_holding_both_roles_gets_one_message(mailbox):
+    notify_request("Table Access Request", "User", 'REQ_1', [], [('rm', 'a@x.com'), ('data', 'a@x.com')],
+                   'u@x.com', 'http://app')
+    assert [to for to, _ in mailbox.sent] == [['a@x.com', 'u@x.com']]
+    body = html(mailbox.sent[0][1])
+    assert 'APPROVE AS RM APPROVER' in body and 'APPROVE AS DATA APPROVER' in body
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+import query_cache
+from query_cache import BoundedCache, budget_cached
+
+def test_least_recently_used_entries_are_evicted_to_fit_the_budget():
+    cache = BoundedCache(budget=100)
+    cache.put('a', 'A', size=40)
+    cache.put('b', 'B', size=40)
+    assert cache.get('a') == (True, 'A')
+    cache.put('c', 'C', size=40)
+    assert cache.get('b') == (False, None)
+    assert cache.stats() == {'entries': 2, 'bytes': 80, 'budget': 100, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+def test_values_larger_than_the_budget_are_not_kept():
+    cache = BoundedCache(budget=100)
+    cache.put('a', 'A', size=40)
+    cache.put('a', 'huge', size=200)
+    assert cache.get('a') == (False, None) and cache.stats()['bytes'] == 0
+
+@pytest.fixture
+def shared_cache(monkeypatch):
+    cache = BoundedCache(budget=1024 * 1024)
+    monkeypatch.setattr(query_cache, 'get_query_cache', lambda: cache)
+    return cache
+
+def test_results_are_keyed_by_arguments_and_version(shared_cache):
+    calls = []
+    version = [1]
+
+    @budget_cached(lambda: version[0])
+    def user_requests(email):
+        calls.append(email)
+        return pd.DataFrame({'email': [email]})
+
+    user_requests('a@x.com')
+    frame = user_requests('a@x.com')
+    user_requests('b@x.com')
+    assert calls == ['a@x.com', 'b@x.com']
+    # Callers get copies, so changing one leaves the cached frame alone
+    frame.loc[0, 'email'] = 'changed'
+    assert user_requests('a@x.com').loc[0, 'email'] == 'a@x.com'
+    version[0] = 2
+    user_requests('a@x.com')
+    assert calls == ['a@x.com', 'b@x.com', 'a@x.com']
+
+def test_empty_frames_are_recomputed(shared_cache):
+    calls = []
+
+    @budget_cached(lambda: 1)
+    def no_requests():
+        calls.append(1)
+        return pd.DataFrame()
+
+    no_requests()
+    no_requests()
+    assert len(calls) == 2
@@ -0,0 +1,95 @@
+import logging
+import threading
+import pytest
+import refresh_cache
+from refresh_cache import RefreshingCache
+
+class Clock:
+    now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(refresh_cache.time, 'time', clock)
+    return clock
+
+class Loader:
+    """Returns 1, 2, ...; a refresh started while gate is clear waits for it to be set"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.gate = threading.Event()
+        self.gate.set()
+        self.done = threading.Event()
+
+    def load(self):
+        self.gate.wait(5)
+        self.calls += 1
+        self.done.set()
+        if self.fail:
+            raise OSError("Sheets unavailable")
+        return self.calls
+
+def wait_for_refresh(cache, loader):
+    assert loader.done.wait(5)
+    # The refresh thread releases its lock after storing the value
+    with cache.loading_lock(()):
+        pass
+
+def test_stale_values_are_served_while_refreshing(clock):
+    loader = Loader()
+    cache = RefreshingCache(loader.load, ttl=60, max_stale=600)
+    assert cache.get(()) == 1
+    clock.now += 61
+    loader.gate.clear()
+    loader.done.clear()
+    # The reader gets the last good value without waiting for the refresh
+    assert cache.get(()) == 1
+    loader.gate.set()
+    wait_for_refresh(cache, loader)
+    assert cache.get(()) == 2 and loader.calls == 2
+
+def test_a_failed_refresh_keeps_the_last_good_value(clock, caplog):
+    loader = Loader()
+    cache = RefreshingCache(loader.load, ttl=60, max_stale=600)
+    cache.get(())
+    clock.now += 61
+    loader.fail = True
+    loader.done.clear()
+    with caplog.at_level(logging.ERROR, logger='refresh_cache'):
+        assert cache.get(()) == 1
+        wait_for_refresh(cache, loader)
+    assert cache.get(()) == 1
+    assert any('Refreshing' in record.getMessage() for record in caplog.records)
+
+def test_values_past_max_stale_are_fetched_before_serving(clock):
+    loader = Loader()
+    cache = RefreshingCache(loader.load, ttl=60, max_stale=600)
+    cache.get(())
+    clock.now += 601
+    assert cache.get(()) == 2
+
+def test_a_failed_first_load_is_not_retried_on_every_read(clock):
+    loader = Loader()
+    loader.fail = True
+    cache = RefreshingCache(loader.load, ttl=60, max_stale=600)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            cache.get(())
+    assert loader.calls == 1
+    loader.fail = False
+    clock.now += refresh_cache.FAILED_LOAD_RETRY
+    assert cache.get(()) == 2
+
+def test_dependents_are_rebuilt_after_a_refresh(clock):
+    loader = Loader()
+    cache = RefreshingCache(loader.load, ttl=60, max_stale=600)
+    dependent = RefreshingCache(lambda: cache.get(()) * 10, ttl=60, max_stale=600)
+    cache.dependents.append(dependent)
+    assert dependent.get(()) == 10
+    cache.fetch(())
+    assert dependent.get(()) == 20
@@ -0,0 +1,49 @@
+import time
+import datetime
+import pytest
+from request_ids import RequestIdGenerator, request_timestamp, request_sort_key
+
+@pytest.fixture
+def local_timezone(monkeypatch):
+    """Run in UTC+05:30 so local and UTC times differ"""
+    monkeypatch.setenv('TZ', 'Asia/Kolkata')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_ids_sort_in_issue_order():
+    generator = RequestIdGenerator()
+    request_ids = [generator.new_id() for _ in range(500)]
+    assert sorted(request_ids) == request_ids
+    assert len(set(request_ids)) == len(request_ids)
+
+def test_ids_keep_sorting_when_the_clock_steps_back(monkeypatch):
+    generator = RequestIdGenerator()
+    monkeypatch.setattr(time, 'time_ns', lambda: 1_700_000_000_500 * 1_000_000)
+    first = generator.new_id()
+    monkeypatch.setattr(time, 'time_ns', lambda: 1_700_000_000_000 * 1_000_000)
+    second = generator.new_id()
+    assert first < second
+
+def test_current_ids_are_issued_in_utc(local_timezone, monkeypatch):
+    monkeypatch.setattr(time, 'time_ns', lambda: 1_736_847_015_123 * 1_000_000)
+    request_id = RequestIdGenerator().new_id()
+    assert request_id.startswith('REQ_20250114_093015_123_')
+    assert request_timestamp(request_id) == datetime.datetime(2025, 1, 14, 15, 0, 15, 123000)
+
+def test_legacy_ids_are_read_as_local_time(local_timezone):
+    assert request_timestamp('REQ_20250114_093015_4821') == datetime.datetime(2025, 1, 14, 9, 30, 15)
+
+def test_unparseable_ids_have_no_timestamp():
+    assert request_timestamp('') is None
+    assert request_timestamp(None) is None
+    assert request_timestamp('REQ_20251399_093015_4821') is None
+    assert request_timestamp('something else') is None
+
+def test_sort_key_orders_legacy_and_current_ids_by_submission(local_timezone):
+    # Legacy 14:00 local is 08:30 UTC, so it was submitted before the 09:00 UTC ID
+    legacy = 'REQ_20250114_140000_4821'
+    current = 'REQ_20250114_090000_000_0000000000'
+    assert current < legacy
+    assert sorted([legacy, current], key=request_sort_key) == [legacy, current]
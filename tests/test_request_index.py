@@ -0,0 +1,76 @@
+from request_index import get_request_index, transition_status, sheet_values_to_frame, row_last_values
+from conftest import RESPONSES_HEADER
+
+def add_request(backend, request_id, rm_status='Pending'):
+    backend.append_rows('responses', [['Table request', request_id, 'u', 'u@x.com', 'rm@x.com', 'd@x.com',
+                                       rm_status, 'Pending']])
+
+def rm_status(backend, request_id):
+    row = next(row for row in backend.tabs['responses'] if row[1] == request_id)
+    return row[RESPONSES_HEADER.index('RM_APPROVER_STATUS')]
+
+def test_pending_request_is_approved(backend):
+    add_request(backend, 'REQ_1')
+    success, message, row = transition_status('REQ_1', 'rm', 'Approved', actor='rm@x.com')
+    assert success and message == "Request approved"
+    assert row[RESPONSES_HEADER.index('RM_APPROVER_STATUS')] == 'Approved'
+    assert rm_status(backend, 'REQ_1') == 'Approved'
+
+def test_decided_request_conflicts(backend):
+    add_request(backend, 'REQ_1')
+    transition_status('REQ_1', 'rm', 'Approved')
+    success, message, _ = transition_status('REQ_1', 'rm', 'Rejected')
+    assert not success and message == "Request is already Approved"
+    assert rm_status(backend, 'REQ_1') == 'Approved'
+
+def test_status_changed_elsewhere_conflicts_and_patches_the_index(backend):
+    add_request(backend, 'REQ_1')
+    index = get_request_index()
+    backend.update_cells('responses', [(2, RESPONSES_HEADER.index('RM_APPROVER_STATUS'), 'Rejected')])
+
+    success, message, _ = transition_status('REQ_1', 'rm', 'Approved')
+    assert not success and message == "Request is already Rejected"
+    values = index.request_values('responses', 'REQ_1')
+    assert values[1][RESPONSES_HEADER.index('RM_APPROVER_STATUS')] == 'Rejected'
+
+def test_setting_the_current_status_again_succeeds_without_writing(backend):
+    add_request(backend, 'REQ_1', rm_status='Approved')
+    writes = []
+    update_cells = backend.update_cells
+    backend.update_cells = lambda tab, updates: (writes.append(updates), update_cells(tab, updates))
+    success, _, _ = transition_status('REQ_1', 'rm', 'Approved')
+    assert success and writes == []
+
+def test_moved_row_is_found_by_request_id(backend):
+    add_request(backend, 'REQ_1')
+    add_request(backend, 'REQ_2')
+    get_request_index()
+    backend.delete_rows('responses', [2])
+
+    success, _, _ = transition_status('REQ_2', 'rm', 'Approved')
+    assert success
+    assert backend.tabs['responses'][1][1] == 'REQ_2'
+    assert rm_status(backend, 'REQ_2') == 'Approved'
+
+def test_unknown_request_is_not_found(backend):
+    add_request(backend, 'REQ_1')
+    assert transition_status('REQ_9', 'rm', 'Approved') == (False, "Request ID not found", None)
+
+def test_missing_status_column_is_reported(backend):
+    backend.tabs['responses'] = [RESPONSES_HEADER[:-2], ['Table request', 'REQ_1']]
+    success, message, row = transition_status('REQ_1', 'rm', 'Approved')
+    assert not success and 'RM_APPROVER_STATUS' in message and row is None
+
+def test_index_version_moves_only_when_a_status_is_patched(backend):
+    add_request(backend, 'REQ_1')
+    index = get_request_index()
+    version = index.version
+    assert not index.set_status('REQ_9', 'rm', 'Approved')
+    assert index.version == version
+    assert index.set_status('REQ_1', 'rm', 'Approved')
+    assert index.version == version + 1
+
+def test_sheet_values_become_a_padded_frame():
+    frame = sheet_values_to_frame([['A', 'B', 'C'], ['1', '2'], ['3', '4', '5', 'extra']])
+    assert frame.shape == (2, 4)
+    assert list(row_last_values(frame)) == ['2', 'extra']
@@ -0,0 +1,42 @@
+from search_index import NgramIndex
+
+COLUMNS = ['PAN', 'PAN_NUMBER', 'COMPANY_PAN', 'PANCARD', 'ADDRESS', 'EMAIL']
+
+def column_index(columns=COLUMNS):
+    return NgramIndex(columns, lambda column: [column])
+
+def test_fuzzy_search_ranks_exact_then_prefix_then_substring():
+    assert column_index().fuzzy_search('pan') == ['PAN', 'PANCARD', 'PAN_NUMBER', 'COMPANY_PAN']
+
+def test_fuzzy_search_tolerates_typos():
+    assert column_index().fuzzy_search('adress') == ['ADDRESS']
+
+def test_fuzzy_search_drops_dissimilar_keys():
+    assert column_index().fuzzy_search('zzzz') == []
+    assert column_index().fuzzy_search('adress', min_similarity=0.9) == []
+
+def test_fuzzy_search_respects_limit():
+    assert column_index().fuzzy_search('pan', limit=2) == ['PAN', 'PANCARD']
+
+def test_fuzzy_search_short_queries_fall_back_to_prefixes():
+    assert column_index().fuzzy_search('em') == ['EMAIL']
+
+def test_substring_matches_in_key_order():
+    index = column_index()
+    assert index.substring_matches('pan') == [0, 1, 2, 3]
+    assert index.substring_matches('number') == [1]
+    assert index.substring_matches('xyz') == []
+
+def test_substring_matches_skips_seen_records():
+    seen = {0, 1}
+    assert column_index().substring_matches('pan', seen=seen) == [2, 3]
+
+def test_search_lists_prefix_matches_before_substring_matches():
+    assert column_index().search('pan') == ['PAN', 'PAN_NUMBER', 'PANCARD', 'COMPANY_PAN']
+    assert column_index().search('card') == ['PANCARD']
+
+def test_repeated_keys_are_indexed_once():
+    records = [('T1', 'PAN'), ('T2', 'PAN'), ('T3', 'EMAIL')]
+    index = NgramIndex(records, lambda record: [record[1]])
+    assert index.key_texts == ['pan', 'email']
+    assert index.fuzzy_search('pan') == [('T1', 'PAN'), ('T2', 'PAN')]
@@ -0,0 +1,34 @@
+import types
+import pytest
+import session_store
+from session_store import remember, recall, forget, ensure_defaults, session_state_size
+
+@pytest.fixture
+def session(monkeypatch):
+    """A plain dict standing in for st.session_state"""
+    state = {}
+    monkeypatch.setattr(session_store, 'st', types.SimpleNamespace(session_state=state))
+    return state
+
+def test_least_recently_used_keys_are_evicted(session):
+    for key in ('a', 'b', 'c'):
+        remember('confirmed', key, True, limit=3)
+    assert recall('confirmed', 'a')
+    remember('confirmed', 'd', True, limit=3)
+    assert recall('confirmed', 'b') is None
+    assert [key for key in ('a', 'c', 'd') if recall('confirmed', key)] == ['a', 'c', 'd']
+
+def test_namespaces_are_bounded_separately(session):
+    remember('confirmed', 'a', 1, limit=1)
+    remember('drafts', 'a', 2, limit=1)
+    remember('confirmed', 'b', 3, limit=1)
+    assert (recall('confirmed', 'a'), recall('drafts', 'a')) == (None, 2)
+    forget('drafts', 'a')
+    assert recall('drafts', 'a', 'gone') == 'gone'
+
+def test_defaults_do_not_overwrite_and_size_lists_largest_first(session):
+    session['user'] = 'kept'
+    ensure_defaults({'user': 'default', 'notes': 'x' * 1000})
+    total, sizes = session_state_size()
+    assert session['user'] == 'kept'
+    assert sizes[0][0] == 'notes' and total == sum(size for _, size in sizes)
@@ -0,0 +1,75 @@
+import time
+import threading
+import pytest
+from shared_cache import SharedTabCache, REFRESH_WAIT
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedTabCache(str(tmp_path / 'shared_cache.db'))
+
+def test_read_through_fetches_once_and_serves_from_the_cache(cache, tmp_path):
+    fetches = []
+
+    def fetch(tabs):
+        fetches.append(tabs)
+        return {tab: [[tab]] for tab in tabs}
+
+    assert cache.read_through(['a', 'b'], 60, fetch) == {'a': [['a']], 'b': [['b']]}
+    # Another process sharing the file
+    other = SharedTabCache(str(tmp_path / 'shared_cache.db'))
+    assert other.read_through(['b', 'a'], 60, fetch) == {'b': [['b']], 'a': [['a']]}
+    assert fetches == [['a', 'b']]
+
+def test_invalidate_drops_cached_rows(cache):
+    cache.put({'a': [['old']]})
+    cache.invalidate(['a'])
+    assert cache.get(['a'], 60) == {}
+
+def test_refresh_overtaken_by_a_write_is_not_stored(cache):
+    def fetch(tabs):
+        rows = {tab: [['before write']] for tab in tabs}
+        # A write lands and invalidates while this fetch is in flight
+        cache.invalidate(tabs)
+        return rows
+
+    assert cache.read_through(['a'], 60, fetch) == {'a': [['before write']]}
+    assert cache.get(['a'], 60) == {}
+    assert cache.read_through(['a'], 60, lambda tabs: {'a': [['after write']]}) == {'a': [['after write']]}
+    assert cache.get(['a'], 60) == {'a': [['after write']]}
+
+def test_put_keeps_tabs_that_were_not_invalidated(cache):
+    generations = cache.generations(['a', 'b'])
+    cache.invalidate(['a'])
+    cache.put({'a': [['stale']], 'b': [['fresh']]}, generations)
+    assert cache.get(['a', 'b'], 60) == {'b': [['fresh']]}
+
+def test_lease_belongs_to_one_thread(cache):
+    assert cache.acquire('refresh:a')
+
+    def in_other_thread(work):
+        outcome = []
+        thread = threading.Thread(target=lambda: outcome.append(work()))
+        thread.start()
+        thread.join()
+        return outcome[0]
+
+    assert in_other_thread(lambda: cache.acquire('refresh:a')) is False
+    in_other_thread(lambda: cache.release('refresh:a'))
+    # The other thread's release left this thread's lease in place
+    assert in_other_thread(lambda: cache.acquire('refresh:a')) is False
+    cache.release('refresh:a')
+    assert in_other_thread(lambda: cache.acquire('refresh:a')) is True
+
+def test_unrelated_tabs_refresh_independently(cache):
+    def fetch(tabs):
+        return {tab: [[tab]] for tab in tabs}
+
+    # Another thread is busy refreshing tab a
+    holder = threading.Thread(target=cache.acquire, args=('refresh:a',))
+    holder.start()
+    holder.join()
+
+    started = time.time()
+    assert cache.read_through(['b'], 60, fetch) == {'b': [['b']]}
+    assert time.time() - started < REFRESH_WAIT
+    assert cache.get(['b'], 60) == {'b': [['b']]}
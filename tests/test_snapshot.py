@@ -0,0 +1,40 @@
+import os
+import copyreg
+import pickle
+from types import MappingProxyType
+import pytest
+import snapshot
+from snapshot import save_snapshot, load_snapshot, snapshot_path
+from refresh_cache import RefreshingCache
+
+def test_read_only_records_round_trip():
+    records = (MappingProxyType({'database': 'SALES'}),)
+    save_snapshot('catalog', ('CSPL',), records)
+    value, _ = load_snapshot('catalog', ('CSPL',), max_age=60)
+    assert isinstance(value[0], MappingProxyType) and dict(value[0]) == {'database': 'SALES'}
+    assert load_snapshot('catalog', ('CAPL',), max_age=60) is None
+
+def test_the_process_wide_pickler_is_left_alone():
+    save_snapshot('catalog', (), (MappingProxyType({}),))
+    assert MappingProxyType not in copyreg.dispatch_table
+    with pytest.raises(TypeError):
+        pickle.dumps(MappingProxyType({}))
+
+def test_old_and_other_version_snapshots_are_ignored(monkeypatch):
+    save_snapshot('catalog', (), ['SALES'])
+    assert load_snapshot('catalog', (), max_age=-1) is None
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_VERSION', 2)
+    assert not os.path.exists(snapshot_path('catalog'))
+    assert load_snapshot('catalog', (), max_age=60) is None
+
+def test_a_cold_cache_serves_the_snapshot_without_fetching():
+    calls = []
+
+    def load_catalog():
+        calls.append(1)
+        return ['fresh']
+
+    RefreshingCache(load_catalog, ttl=60, max_stale=600, snapshot=True).get(())
+    # A new process starts with an empty cache and reads the saved copy
+    assert RefreshingCache(load_catalog, ttl=60, max_stale=600, snapshot=True).get(()) == ['fresh']
+    assert len(calls) == 1
@@ -0,0 +1,60 @@
+import pytest
+from storage import MemoryBackend, SQLiteBackend
+
+HEADER = ['REQUEST_ID', 'STATUS']
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'storage.db'))
+
+@pytest.fixture
+def filled(store):
+    store.add_tabs(['responses'], HEADER)
+    store.append_rows('responses', [['A', 'Pending'], ['B', 'Approved'], ['C', 'Pending']])
+    return store
+
+def test_add_tabs_starts_with_header(store):
+    store.add_tabs(['one', 'two'], HEADER)
+    assert set(store.list_tabs()) == {'one', 'two'}
+    assert store.read_tabs(['one', 'two']) == {'one': [HEADER], 'two': [HEADER]}
+
+def test_unknown_tab_reads_empty(store):
+    assert store.read_tabs(['missing']) == {'missing': []}
+    assert store.read_row('missing', 1, 2) == []
+
+def test_append_rows_keeps_order_and_stores_text(store):
+    store.add_tabs(['responses'], HEADER)
+    store.append_rows('responses', [['A', 1]])
+    store.append_rows('responses', [['B', None], ['C', 2.5]])
+    assert store.read_tabs(['responses'])['responses'] == [HEADER, ['A', '1'], ['B', ''], ['C', '2.5']]
+
+def test_read_row_is_one_based_and_truncated(filled):
+    assert filled.read_row('responses', 1, 2) == HEADER
+    assert filled.read_row('responses', 3, 1) == ['B']
+    assert filled.read_row('responses', 10, 2) == []
+
+def test_read_columns(filled):
+    assert filled.read_columns('responses', [1, 0]) == [
+        ['STATUS', 'Pending', 'Approved', 'Pending'],
+        ['REQUEST_ID', 'A', 'B', 'C'],
+    ]
+    assert filled.read_columns('responses', [5]) == [['', '', '', '']]
+
+def test_update_cells_in_one_batch(filled):
+    filled.update_cells('responses', [(2, 1, 'Approved'), (4, 3, 'note')])
+    assert filled.read_tabs(['responses'])['responses'] == [
+        HEADER, ['A', 'Approved'], ['B', 'Approved'], ['C', 'Pending', '', 'note'],
+    ]
+
+def test_delete_rows_moves_later_rows_up(filled):
+    filled.delete_rows('responses', [2, 4])
+    assert filled.read_tabs(['responses'])['responses'] == [HEADER, ['B', 'Approved']]
+    filled.append_rows('responses', [['D', 'Pending']])
+    assert filled.read_row('responses', 3, 2) == ['D', 'Pending']
+
+def test_sqlite_rows_persist_across_instances(tmp_path):
+    path = str(tmp_path / 'storage.db')
+    SQLiteBackend(path).append_rows('responses', [HEADER, ['A', 'Pending']])
+    assert SQLiteBackend(path).read_tabs(['responses'])['responses'] == [HEADER, ['A', 'Pending']]
@@ -0,0 +1,149 @@
+import pytest
+import threading
+import submissions
+from submissions import submission_token, submit_once, record_notification, get_submission_ledger
+
+def saver(backend, request_ids, calls):
+    """A save() that appends one responses row per request ID and counts its calls"""
+    def save():
+        calls.append(request_ids)
+        backend.append_rows('responses', [['Table request', request_id] for request_id in request_ids])
+        return True
+    return save
+
+def test_tokens_depend_on_user_and_payload():
+    assert submission_token('table', 'A@x.com ', ['DB']) == submission_token('table', 'a@x.com', ['DB'])
+    assert submission_token('table', 'a@x.com', ['DB']) != submission_token('table', 'a@x.com', ['DB2'])
+    assert submission_token('table', 'a@x.com', ['DB']) != submission_token('column', 'a@x.com', ['DB'])
+
+def test_duplicate_token_returns_original_ids(backend):
+    calls = []
+    token = submission_token('table', 'a@x.com', ['DB'])
+    assert submit_once(token, ['REQ_1'], 'responses', saver(backend, ['REQ_1'], calls)) == (['REQ_1'], True)
+    record_notification(token, ['REQ_1'], True)
+
+    assert submit_once(token, ['REQ_2'], 'responses', saver(backend, ['REQ_2'], calls)) == (['REQ_1'], False)
+    assert calls == [['REQ_1']]
+    assert len(backend.tabs['responses']) == 2
+
+def test_duplicates_are_caught_by_the_shared_ledger(backend):
+    calls = []
+    token = submission_token('table', 'a@x.com', ['DB'])
+    submit_once(token, ['REQ_1'], 'responses', saver(backend, ['REQ_1'], calls))
+    record_notification(token, ['REQ_1'], True)
+
+    # Another process: nothing remembered in memory
+    get_submission_ledger.clear()
+    assert submit_once(token, ['REQ_2'], 'responses', saver(backend, ['REQ_2'], calls)) == (['REQ_1'], False)
+    assert calls == [['REQ_1']]
+
+def test_concurrent_duplicates_save_once(backend):
+    calls = []
+    token = submission_token('table', 'a@x.com', ['DB'])
+    results = []
+
+    def submit(number):
+        request_ids = [f'REQ_{number}']
+        results.append(submit_once(token, request_ids, 'responses', saver(backend, request_ids, calls)))
+
+    threads = [threading.Thread(target=submit, args=(number,)) for number in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(backend.tabs['responses']) == 2
+    assert {tuple(request_ids) for request_ids, _ in results} == {tuple(calls[0])}
+    assert sum(notify for _, notify in results) == 1
+
+def test_failed_save_releases_the_token(backend):
+    token = submission_token('table', 'a@x.com', ['DB'])
+    assert submit_once(token, ['REQ_1'], 'responses', lambda: False) == (None, False)
+
+    calls = []
+    assert submit_once(token, ['REQ_2'], 'responses', saver(backend, ['REQ_2'], calls)) == (['REQ_2'], True)
+
+def test_failed_notification_is_sent_by_the_next_repeat(backend):
+    calls = []
+    token = submission_token('table', 'a@x.com', ['DB'])
+    submit_once(token, ['REQ_1'], 'responses', saver(backend, ['REQ_1'], calls))
+    record_notification(token, ['REQ_1'], False)
+
+    assert submit_once(token, ['REQ_2'], 'responses', saver(backend, ['REQ_2'], calls)) == (['REQ_1'], True)
+    record_notification(token, ['REQ_1'], True)
+    assert submit_once(token, ['REQ_3'], 'responses', saver(backend, ['REQ_3'], calls)) == (['REQ_1'], False)
+    assert calls == [['REQ_1']]
+
+def test_memory_record_drops_expired_submissions(backend):
+    ledger = get_submission_ledger()
+    ledger.window = 0
+    ledger.remember('old', ['REQ_1'])
+    ledger.remember('new', ['REQ_2'])
+    assert list(ledger.done) == ['new']
+
+def test_submission_seen(backend):
+    token = submission_token('user', 'a@x.com', ['CSPL'])
+    assert not submissions.submission_seen(token)
+    submit_once(token, ['REQ_1'], 'user_responses', lambda: True)
+    assert submissions.submission_seen(token)
+
+def failing_append(backend, failures, applied):
+    """append_rows that raises its first `failures` calls, after writing the rows when applied"""
+    append_rows = backend.append_rows
+    calls = []
+
+    def append(tab, rows, value_input_option="RAW"):
+        calls.append(rows)
+        if len(calls) <= failures:
+            if applied:
+                append_rows(tab, rows, value_input_option)
+            raise TimeoutError("timed out")
+        append_rows(tab, rows, value_input_option)
+
+    backend.append_rows = append
+    return calls
+
+def test_append_retries_until_the_rows_land(backend, monkeypatch):
+    monkeypatch.setattr(submissions, 'APPEND_BACKOFF', 0)
+    calls = failing_append(backend, 2, applied=False)
+    submissions.append_with_retry('responses', [['Table request', 'REQ_1']], ['REQ_1'])
+    assert len(calls) == 3
+    assert [row[1] for row in backend.tabs['responses'][1:]] == ['REQ_1']
+
+def test_append_that_timed_out_after_writing_is_not_repeated(backend, monkeypatch):
+    monkeypatch.setattr(submissions, 'APPEND_BACKOFF', 0)
+    calls = failing_append(backend, 1, applied=True)
+    submissions.append_with_retry('responses', [['Table request', 'REQ_1']], ['REQ_1'])
+    assert len(calls) == 1
+    assert [row[1] for row in backend.tabs['responses'][1:]] == ['REQ_1']
+
+def test_last_attempt_that_wrote_the_rows_succeeds(backend, monkeypatch):
+    monkeypatch.setattr(submissions, 'APPEND_BACKOFF', 0)
+    append_rows = backend.append_rows
+    calls = []
+
+    def append(tab, rows, value_input_option="RAW"):
+        calls.append(rows)
+        # Only the last attempt reaches the sheet, and its reply is lost too
+        if len(calls) == submissions.APPEND_ATTEMPTS:
+            append_rows(tab, rows, value_input_option)
+        raise TimeoutError("timed out")
+
+    backend.append_rows = append
+    token = submission_token('table', 'a@x.com', ['DB'])
+
+    def save():
+        submissions.append_with_retry('responses', [['Table request', 'REQ_1']], ['REQ_1'])
+        return True
+
+    assert submit_once(token, ['REQ_1'], 'responses', save) == (['REQ_1'], True)
+    assert len(calls) == submissions.APPEND_ATTEMPTS
+    assert [row[1] for row in backend.tabs['responses'][1:]] == ['REQ_1']
+
+def test_append_that_never_lands_raises(backend, monkeypatch):
+    monkeypatch.setattr(submissions, 'APPEND_BACKOFF', 0)
+    failing_append(backend, submissions.APPEND_ATTEMPTS, applied=False)
+    with pytest.raises(TimeoutError):
+        submissions.append_with_retry('responses', [['Table request', 'REQ_1']], ['REQ_1'])
+    assert len(backend.tabs['responses']) == 1
@@ -0,0 +1,51 @@
+import table
+from table import validate_bulk_requests, send_grouped_approval_emails
+from conftest import html
+
+CATALOG = [
+    {'object_source': 'CSPL', 'database': 'SALES', 'schema': 'PUBLIC', 'table': 'ORDERS'},
+    {'object_source': 'CSPL', 'database': 'SALES', 'schema': 'PUBLIC', 'table': 'CUSTOMERS'},
+]
+DATA_APPROVERS = [{'database': 'SALES', 'approver': 'data@x.com'}]
+HEADER = "Object Source,Database,Schema,Tables,Grantee,Validity,Reason\n"
+
+def validate(rows):
+    return validate_bulk_requests(HEADER + rows, 'u@x.com', 'CSPL', 'rm@x.com', DATA_APPROVERS, CATALOG)
+
+def test_bulk_rows_are_checked_against_the_catalog():
+    requests, errors = validate(
+        "cspl,SALES,PUBLIC,ORDERS;CUSTOMERS,self,7,reporting\n"
+        "CSPL,SALES,PUBLIC,MISSING,SELF,7,reporting\n"
+        "CSPL,SALES,PUBLIC,ALL,SELF,90,reporting\n"
+    )
+    assert [request['selected_names'] for request in requests] == ["ORDERS, CUSTOMERS"]
+    assert requests[0]['requesting_for'] == 'u@x.com' and requests[0]['data_approver'] == 'data@x.com'
+    assert [line for line, _ in errors] == [3, 4]
+
+def test_missing_columns_are_reported_once():
+    assert validate_bulk_requests("Database,Schema\nSALES,PUBLIC\n", 'u@x.com', 'CSPL', 'rm@x.com',
+                                  DATA_APPROVERS, CATALOG) == ([], [(1, "Missing columns: object_source, tables, grantee, validity, reason")])
+
+def bulk_requests(rm_approver, data_approver):
+    requests, _ = validate("CSPL,SALES,PUBLIC,ORDERS,SELF,7,a\nCSPL,SALES,PUBLIC,ALL,SELF,7,b\n")
+    for request_id, request in zip(('REQ_1', 'REQ_2'), requests):
+        request.update(request_id=request_id, rm_approver=rm_approver, data_approver=data_approver)
+    return requests
+
+def test_one_email_per_approver_lists_all_their_requests(mailbox, monkeypatch):
+    monkeypatch.setattr(table, 'get_current_url', lambda: 'http://app')
+    assert send_grouped_approval_emails(bulk_requests('rm@x.com', 'data@x.com'), 'User', 'CSPL', 'u@x.com') == (True, None)
+    # Two approvers get one email each, so the user gets a separate confirmation
+    assert [to for to, _ in mailbox.sent] == [['rm@x.com'], ['data@x.com'], ['u@x.com']]
+    rm_html = html(mailbox.sent[0][1])
+    assert 'REQ_1' in rm_html and 'REQ_2' in rm_html
+    assert 'Table Access Requests - RM Approver Approval Required' in rm_html
+    assert 'Approve as' not in rm_html
+
+def test_an_approver_holding_both_roles_gets_labelled_links(mailbox, monkeypatch):
+    monkeypatch.setattr(table, 'get_current_url', lambda: 'http://app')
+    send_grouped_approval_emails(bulk_requests('both@x.com', 'Both@x.com'), 'User', 'CSPL', 'u@x.com')
+    # A single email goes out, with the user in copy
+    assert [to for to, _ in mailbox.sent] == [['both@x.com', 'u@x.com']]
+    both_html = html(mailbox.sent[0][1])
+    assert both_html.count('Approve as RM Approver') == 2 and both_html.count('Approve as Data Approver') == 2
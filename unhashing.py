@@ -1,13 +1,14 @@
 import streamlit as st
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import datetime
-import random
+from search_index import NgramIndex
+from expiry import track_approved_row
+from notifications import notify_request
+from request_index import get_request_index, record_appended_rows, transition_status
+from request_ids import new_request_id
+from storage import get_storage
+from submissions import submission_token, submit_once, record_notification, append_with_retry
+from session_store import ensure_defaults
+from table import freeze_records, OBJECT_SOURCES, GRANTEE_TYPES, REASON_MAX_CHARS
+from refresh_cache import stale_while_revalidate
 from config import *
 
 def get_current_url():
@@ -24,57 +25,48 @@ def get_current_url():
     # Fallback to default
     return DEFAULT_URL
 
-@st.cache_resource(ttl=CACHE_TTL)
-def get_sheets_service():
-    """Initialize Google Sheets service with cached credentials"""
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server()
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('sheets', 'v4', credentials=creds)
+class ColumnTabMissing(Exception):
+    pass
+
+@stale_while_revalidate(snapshot=True)  # One shared copy, refreshed in the background
+def load_sheet_data():
+    """Fetch all required data from Google Sheets; raises if it cannot be read"""
+    storage = get_storage()
+    
+    # Get all tabs first
+    tab_names = storage.list_tabs()
+    
+    # Find the correct tab for column data
+    column_tab = next((name for name in ['masked_columns', 'unhashing_columns', 'columns'] 
+                      if name in tab_names), None)
+    
+    if not column_tab:
+        raise ColumnTabMissing("Column data tab not found")
+    
+    # Fetch all data in one batch
+    ranges = ['snf_user', 'rm approvers', 'data approvers', column_tab]
+    values_by_range = storage.read_tabs(ranges)
+    value_ranges = [{'values': values_by_range[name]} for name in ranges]
+    
+    # Process data
+    users = process_user_data(value_ranges[0] if len(value_ranges) > 0 else None)
+    rm_approvers = process_rm_approvers(value_ranges[1] if len(value_ranges) > 1 else None)
+    data_approvers = process_data_approvers(value_ranges[2] if len(value_ranges) > 2 else None)
+    table_data, column_data = process_column_data(value_ranges[3] if len(value_ranges) > 3 else None)
+    
+    return (freeze_records(users), freeze_records(rm_approvers), freeze_records(data_approvers),
+            freeze_records(table_data), freeze_records(column_data))
 
-@st.cache_data(ttl=CACHE_TTL)
 def fetch_sheet_data():
-    """Fetch all required data from Google Sheets"""
+    """Reference data for the column form: the last good copy, never blocking on a scheduled refresh"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
-        # Get all tabs first
-        result = sheet.get(spreadsheetId=SPREADSHEET_ID).execute()
-        tab_names = [sheet['properties']['title'] for sheet in result.get('sheets', [])]
-        
-        # Find the correct tab for column data
-        column_tab = next((name for name in ['masked_columns', 'unhashing_columns', 'columns'] 
-                          if name in tab_names), None)
-        
-        if not column_tab:
-            st.error("Column data tab not found")
-            return [], [], [], [], []
-        
-        # Fetch all data in one batch
-        ranges = ['snf_user', 'rm approvers', 'data approvers', column_tab]
-        result = sheet.values().batchGet(spreadsheetId=SPREADSHEET_ID, ranges=ranges).execute()
-        value_ranges = result.get('valueRanges', [])
-        
-        # Process data
-        users = process_user_data(value_ranges[0] if len(value_ranges) > 0 else None)
-        rm_approvers = process_rm_approvers(value_ranges[1] if len(value_ranges) > 1 else None)
-        data_approvers = process_data_approvers(value_ranges[2] if len(value_ranges) > 2 else None)
-        table_data, column_data = process_column_data(value_ranges[3] if len(value_ranges) > 3 else None)
-        
-        return users, rm_approvers, data_approvers, table_data, column_data
-        
+        return load_sheet_data()
+    except ColumnTabMissing as e:
+        st.error(str(e))
+        return (), (), (), (), ()
     except Exception as e:
         st.error(f"Error fetching data: {e}")
-        return [], [], [], [], []
+        return (), (), (), (), ()
 
 def process_user_data(value_range):
     """Process user data from sheet"""
@@ -232,125 +224,173 @@ def process_column_data(value_range):
     except ValueError:
         return [], []
 
+@stale_while_revalidate(depends_on=load_sheet_data, snapshot=True)
+def get_column_search_index():
+    """Build the fuzzy search index over COLUMN_NAME and POLICY_NAME for every masked column"""
+    column_data = load_sheet_data()[4]
+    records = sorted(
+        (column for column in column_data if column['entity'] in OBJECT_SOURCES),
+        key=lambda column: (len(column['column']), column['column'])
+    )
+    return NgramIndex(records, lambda column: (column['column'], column['policy']))
+
+def search_columns(query, limit=20):
+    """Ranked (database, schema, table, column) matches for a column or policy name"""
+    return [
+        (column['database'], column['schema'], column['table'], column['column'])
+        for column in get_column_search_index().fuzzy_search(query, limit)
+    ]
+
+def apply_column_search_pick(matches_by_label):
+    """Fill the cascading dropdowns from the column picked in the search results"""
+    match = matches_by_label.get(st.session_state.column_search_pick_unhashing)
+    if not match:
+        return
+    
+    st.session_state.object_source_dropdown_unhashing = match['entity']
+    st.session_state.database_dropdown_unhashing = match['database']
+    st.session_state.schema_dropdown_unhashing = match['schema']
+    st.session_state.table_dropdown_unhashing = match['table']
+    st.session_state.column_selection_radio_unhashing = "Select Columns"
+    st.session_state.columns_multiselect_unhashing = [match['column']]
+
 def generate_request_id():
     """Generate unique request ID"""
-    now = datetime.datetime.now()
-    return f"{REQUEST_PREFIX}_{now.strftime('%Y%m%d_%H%M%S')}_{random.randint(REQUEST_RANDOM_MIN, REQUEST_RANDOM_MAX)}"
+    return new_request_id()
 
 def save_request(data):
     """Save request to Google Sheets"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
         # Add approval status columns
         data_with_status = data + [PENDING_STATUS, PENDING_STATUS]
-        sheet.values().append(
-            spreadsheetId=SPREADSHEET_ID,
-            range='responses',
-            valueInputOption="RAW",
-            body={"values": [data_with_status]}
-        ).execute()
+        append_with_retry('responses', [data_with_status], [data[1]])
+        record_appended_rows('responses', [data_with_status])
         return True
     except Exception as e:
         st.error(f"Error saving request: {e}")
         return False
 
 def send_approval_emails(request_id, user_name, entity, database, schema, table, columns, rm_approver, data_approver, user_email):
-    """Send approval emails to RM and Data approvers"""
-    subject = "Approval Needed: Column Access Request"
-    
-    def create_email_content(approver_type, approver_email):
-        """Create email content with correct approval links for each approver type"""
-        approver_title = "RM Approver" if approver_type == 'rm' else "Data Approver"
-        
-        return f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <h2 style="color: #2c3e50;">Column Access Request - {approver_title} Approval Required</h2>
-            <p>The user <strong>{user_name}</strong> has submitted a column access request:</p>
-            
-            <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid #007bff; margin: 20px 0;">
-                <h3 style="margin-top: 0; color: #007bff;">Request Details:</h3>
-                <ul style="list-style-type: none; padding-left: 0;">
-                    <li><strong>Request ID:</strong> {request_id}</li>
-                    <li><strong>Entity:</strong> {entity}</li>
-                    <li><strong>Database:</strong> {database}</li>
-                    <li><strong>Schema:</strong> {schema}</li>
-                    <li><strong>Table:</strong> {table}</li>
-                    <li><strong>Columns:</strong> {columns}</li>
-                </ul>
-            </div>
-            
-            <div style="text-align: center; margin: 30px 0;">
-                <a href='{get_current_url()}?approve_id={request_id}&type={approver_type}&action=approve&approver={approver_email}' 
-                   style="background-color: #28a745; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
-                   ✅ APPROVE
-                </a>
-                <a href='{get_current_url()}?approve_id={request_id}&type={approver_type}&action=reject&approver={approver_email}' 
-                   style="background-color: #dc3545; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; margin: 0 10px; display: inline-block; font-weight: bold;">
-                   ❌ REJECT
-                </a>
-            </div>
-        </body>
-        </html>
-        """
+    """Send approval emails to RM and Data approvers; one email when they are the same person"""
+    details = [("Entity", entity), ("Database", database), ("Schema", schema),
+               ("Table", table), ("Columns", columns)]
+    return notify_request("Column Access Request", user_name, request_id, details,
+                          [('rm', rm_approver), ('data', data_approver)], user_email, get_current_url())
+
+def validate_column_request(request, user_email, rm_approver, data_approvers, table_data, column_data):
+    """Check a column request dict (object_source, database, schema, table, columns,
+    grantee, requesting_for, validity, reason) against the in-memory catalog.
+    
+    columns is a list of names or "ALL". Returns (request ready for submission, errors).
+    """
+    errors = []
+    if not rm_approver:
+        errors.append("RM approver not found for your account")
+    
+    object_source = str(request.get('object_source', '')).strip().upper()
+    database = str(request.get('database', '')).strip()
+    schema = str(request.get('schema', '')).strip()
+    table = str(request.get('table', '')).strip()
+    if object_source not in OBJECT_SOURCES:
+        errors.append(f"Unknown object source '{request.get('object_source', '')}'")
+    elif not any(t['object_source'] == object_source and t['database'] == database and
+                 t['schema'] == schema and t['table'] == table for t in table_data):
+        errors.append(f"{database}.{schema}.{table} not found for {object_source}")
+    
+    columns = request.get('columns', '')
+    if isinstance(columns, str) and columns.strip().upper() == "ALL":
+        columns = "ALL"
+    else:
+        if isinstance(columns, str):
+            columns = columns.replace(';', ',').split(',')
+        columns = [str(name).strip() for name in columns if str(name).strip()]
+        known_columns = {c['column'] for c in column_data
+                         if c['entity'] == object_source and c['database'] == database and
+                         c['schema'] == schema and c['table'] == table}
+        unknown_columns = [name for name in columns if name not in known_columns]
+        if not columns:
+            errors.append("No columns given")
+        elif unknown_columns:
+            errors.append(f"Columns not found in {table}: {', '.join(unknown_columns)}")
+        columns = ", ".join(columns)
+    
+    grantee = str(request.get('grantee', 'SELF')).strip().upper().replace(' ', '_')
+    requesting_for = user_email if grantee == "SELF" else str(request.get('requesting_for', '')).strip()
+    if grantee not in GRANTEE_TYPES:
+        errors.append(f"Grantee must be one of {', '.join(GRANTEE_TYPES)}")
+    elif not requesting_for:
+        errors.append("requesting_for is required for generic users and roles")
     
     try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            
-            # Send to both approvers with different email content
-            for approver_email, approver_type in [(rm_approver, 'rm'), (data_approver, 'data')]:
-                message = MIMEMultipart("alternative")
-                message["Subject"] = subject
-                message["From"] = EMAIL_SENDER
-                message["To"] = approver_email
-                message["Cc"] = user_email  # Add user to CC
-                message.attach(MIMEText(create_email_content(approver_type, approver_email), "html"))
-                server.sendmail(EMAIL_SENDER, [approver_email, user_email], message.as_string())
-        
-        return True, None
-    except Exception as e:
-        return False, str(e)
+        validity = int(request.get('validity', 0))
+    except (TypeError, ValueError):
+        validity = 0
+    if not 1 <= validity <= 30:
+        errors.append("Validity must be a whole number of days between 1 and 30")
+    
+    reason = str(request.get('reason', '')).strip()
+    if len(reason) > REASON_MAX_CHARS:
+        errors.append(f"Reason must be at most {REASON_MAX_CHARS} characters")
+    
+    data_approver_entry = next((d for d in data_approvers if d['database'] == database), None)
+    data_approver = data_approver_entry['approver'] if data_approver_entry else ""
+    if not data_approver:
+        errors.append(f"No data approver configured for {database}")
+    
+    if errors:
+        return None, errors
+    return {
+        'object_source': object_source,
+        'database': database,
+        'schema': schema,
+        'table': table,
+        'columns': columns,
+        'grantee': grantee,
+        'requesting_for': requesting_for,
+        'validity': validity,
+        'reason': reason,
+        'rm_approver': rm_approver,
+        'data_approver': data_approver
+    }, []
 
-def update_approval_status(request_id, approver_type, new_status):
+def submit_column_request(request_id, request, user_name, email, entity, default_role, token=None):
+    """Save a column request and email its approvers.
+    
+    token is the submission's idempotency token (by default derived from the request),
+    so a repeat within the dedup window returns the original request instead of saving
+    again. Returns (saved request ID or None, mail_sent, mail_error); mail_sent is None
+    for such a repeat, unless the first attempt's emails failed and this one sent them again.
+    """
+    form_data = [
+        "Column request", request_id, user_name, email, entity, default_role,
+        request['object_source'], request['database'], request['schema'],
+        "", request['table'], request['columns'], "", request['grantee'], request['requesting_for'],
+        request['validity'], request['reason'], request['rm_approver'], request['data_approver']
+    ]
+    
+    token = token or submission_token('column', email, form_data[:1] + form_data[2:])
+    request_ids, notify = submit_once(token, [request_id], 'responses', lambda: save_request(form_data))
+    if not request_ids:
+        return None, False, None
+    if not notify:
+        return request_ids[0], None, None
+    mail_sent, mail_error = send_approval_emails(
+        request_ids[0], user_name, entity, request['database'], request['schema'],
+        request['table'], request['columns'], request['rm_approver'], request['data_approver'], email
+    )
+    record_notification(token, request_ids, mail_sent)
+    return request_ids[0], mail_sent, mail_error
+
+def update_approval_status(request_id, approver_type, new_status, approver_email=''):
     """Update approval status in Google Sheets"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
-        
-        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='responses').execute()
-        values = result.get('values', [])
+        success, _, updated_row = transition_status(request_id, approver_type, new_status, actor=approver_email)
         
-        if not values:
-            return False
+        # Fully approved grants start their validity countdown
+        if success and new_status == 'Approved':
+            track_approved_row(get_request_index().header('responses'), updated_row)
         
-        header = values[0]
-        try:
-            reqid_col = header.index('REQUEST_ID')
-            rm_col = header.index('RM_APPROVER_STATUS') 
-            data_col = header.index('DATA_APPROVER_STATUS')
-        except ValueError:
-            return False
-        
-        # Find row to update
-        for idx, row in enumerate(values[1:], start=2):
-            if len(row) > reqid_col and row[reqid_col] == request_id:
-                update_col_index = rm_col if approver_type == 'rm' else data_col
-                update_col_letter = chr(ord('A') + update_col_index)
-                range_to_update = f"responses!{update_col_letter}{idx}"
-                
-                sheet.values().update(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range=range_to_update,
-                    valueInputOption="RAW",
-                    body={"values": [[new_status]]}
-                ).execute()
-                return True
-        
-        return False
+        return success
         
     except Exception:
         return False
@@ -384,7 +424,7 @@ def handle_approval_request():
             action_icon = '✅' if action == 'approve' else '❌'
             action_color = 'green' if action == 'approve' else 'red'
             
-            success = update_approval_status(request_id, approver_type, new_status)
+            success = update_approval_status(request_id, approver_type, new_status, approver_email)
             
             if success:
                 st.markdown(f"""
@@ -416,9 +456,7 @@ def initialize_session_state():
         'selected_table': "Select Table"
     }
     
-    for key, default_value in defaults.items():
-        if key not in st.session_state:
-            st.session_state[key] = default_value
+    ensure_defaults(defaults)
 
 def main():
     """Main application"""
@@ -474,8 +512,27 @@ def main():
     email = st.session_state.email
     default_role = st.session_state.default_role
     
+    # Column search - for users who know the column name but not where it lives
+    search_query = st.text_input("Search Columns", placeholder="Type a column or policy name, e.g. pan_number", key="column_search_unhashing")
+    if search_query:
+        matches = get_column_search_index().fuzzy_search(search_query)
+        if matches:
+            matches_by_label = {
+                f"{match['column']} — {match['database']}.{match['schema']}.{match['table']} ({match['entity']})": match
+                for match in matches
+            }
+            st.selectbox(
+                "Matching Columns",
+                options=["Select a matching column"] + list(matches_by_label),
+                key="column_search_pick_unhashing",
+                on_change=apply_column_search_pick,
+                args=(matches_by_label,)
+            )
+        else:
+            st.info("No columns match your search.")
+    
     # Database selection
-    object_source_options = ["Select Object Source", "CSPL", "CAPL", "CFSPL"]
+    object_source_options = ["Select Object Source"] + OBJECT_SOURCES
     selected_object_source = st.selectbox("Object Source", options=object_source_options, key="object_source_dropdown_unhashing")
     
     if selected_object_source != st.session_state.selected_object_source:
@@ -579,10 +636,7 @@ def main():
             # Fetch generic users for the user's entity
             generic_users = []
             try:
-                service = get_sheets_service()
-                sheet = service.spreadsheets()
-                result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='generic roles/users').execute()
-                values = result.get('values', [])
+                values = get_storage().read_tabs(['generic roles/users'])['generic roles/users']
                 if len(values) > 1:
                     header = values[0]
                     try:
@@ -611,10 +665,7 @@ def main():
             # Fetch generic roles for the user's entity
             generic_roles = []
             try:
-                service = get_sheets_service()
-                sheet = service.spreadsheets()
-                result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='generic roles/users').execute()
-                values = result.get('values', [])
+                values = get_storage().read_tabs(['generic roles/users'])['generic roles/users']
                 if len(values) > 1:
                     header = values[0]
                     try:
@@ -660,22 +711,20 @@ def main():
         else:
             grantee = "SELF"
         
-        form_data = [
-            "Column request", request_id, user_name, email, entity, default_role,
-            selected_object_source, selected_database, selected_schema,
-            "", selected_table, columns, "", grantee, requesting_for, validity, reason,
-            rm_approver, data_approver
-        ]
+        request = {
+            'object_source': selected_object_source, 'database': selected_database,
+            'schema': selected_schema, 'table': selected_table, 'columns': columns,
+            'grantee': grantee, 'requesting_for': requesting_for, 'validity': validity,
+            'reason': reason, 'rm_approver': rm_approver, 'data_approver': data_approver
+        }
+        saved_id, mail_sent, mail_error = submit_column_request(request_id, request, user_name, email, entity, default_role)
         
-        if save_request(form_data):
-            mail_sent, mail_error = send_approval_emails(
-                request_id, user_name, entity, selected_database, selected_schema,
-                selected_table, columns, rm_approver, data_approver, email
-            )
-            
-            if mail_sent:
+        if saved_id:
+            if mail_sent is None:
+                st.info(f"This request was already submitted. Your request ID is: {saved_id}")
+            elif mail_sent:
                 st.success("Column access request submitted successfully! Approval emails sent.")
-                st.success(f"Your request ID is: {request_id}")
+                st.success(f"Your request ID is: {saved_id}")
             else:
                 st.error(f"Request saved but failed to send emails: {mail_error}")
         else:
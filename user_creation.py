@@ -1,17 +1,18 @@
 import streamlit as st
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import datetime
-import random
-import gspread
+from digest import digest_enabled, queue_request
+from notifications import send_messages, confirmation_body
+from request_index import get_request_index, record_appended_rows, transition_status, normalize_email
+from request_ids import new_request_id
+from storage import read_available_tabs
+from submissions import submission_token, submission_seen, submit_once, record_notification, append_with_retry
+from refresh_cache import stale_while_revalidate
 from config import *
 
 WORKSHEET_NAME = 'user_responses'
+DROPDOWN_SHEETS = ['user_bu', 'user_manager']
 def get_current_url():
     """Get the current URL dynamically"""
     try:
@@ -26,99 +27,34 @@ def get_current_url():
     # Fallback to default
     return DEFAULT_URL
 
-@st.cache_resource
-def get_authenticated_client():
-    """Get authenticated gspread client with cached credentials"""
-    try:
-        creds = None
-        
-        # Load existing credentials
-        if os.path.exists(TOKEN_FILE):
-            with open(TOKEN_FILE, 'rb') as token:
-                creds = pickle.load(token)
-        
-        # Refresh or create new credentials
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except Exception:
-                    creds = None
-            
-            if not creds:
-                flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-                creds = flow.run_local_server(port=0)
-                with open(TOKEN_FILE, 'wb') as token:
-                    pickle.dump(creds, token)
-        
-        return gspread.authorize(creds)
-    except Exception as e:
-        st.error(f"Authentication error: {e}")
-        return None
-
 def generate_request_id():
     """Generate unique request ID with timestamp and random number"""
-    now = datetime.datetime.now()
-    timestamp = now.strftime("%Y%m%d_%H%M%S")
-    random_num = random.randint(REQUEST_RANDOM_MIN, REQUEST_RANDOM_MAX)
-    return f"{REQUEST_PREFIX}_{timestamp}_{random_num}"
+    return new_request_id()
 
 def has_pending_request(user_id):
     """Check if user has a pending request"""
     try:
-        gc = get_authenticated_client()
-        if not gc:
-            return False
-            
-        worksheet = gc.open_by_key(SPREADSHEET_ID).worksheet(WORKSHEET_NAME)
-        all_data = worksheet.get_all_values()
-        
-        for row in all_data[1:]:  # Skip header
-            if row and row[0] == user_id:
-                return len(row) < 6 or (len(row) >= 6 and row[5] not in [APPROVED_STATUS, REJECTED_STATUS])
-        return False
+        # The request index tracks each user's latest request, patched on save and status changes
+        status = get_request_index().latest_status(WORKSHEET_NAME, user_id, 'Approval_status')
+        return status is not None and status not in [APPROVED_STATUS, REJECTED_STATUS]
     except Exception:
         return False
 
 def save_request(data):
     """Save new request to Google Sheets"""
     try:
-        gc = get_authenticated_client()
-        if not gc:
-            return False
-            
-        worksheet = gc.open_by_key(SPREADSHEET_ID).worksheet(WORKSHEET_NAME)
-        worksheet.append_row(data)
+        append_with_retry(WORKSHEET_NAME, [data], [data[0]])
+        record_appended_rows(WORKSHEET_NAME, [data])
         return True
     except Exception as e:
         st.error(f"Error saving request: {e}")
         return False
 
-def update_request_status(request_id, approver_type, new_status):
+def update_request_status(request_id, approver_type, new_status, approver_email=''):
     """Update request status in Google Sheets"""
     try:
-        gc = get_authenticated_client()
-        if not gc:
-            return False
-            
-        worksheet = gc.open_by_key(SPREADSHEET_ID).worksheet(WORKSHEET_NAME)
-        all_data = worksheet.get_all_values()
-        
-        if not all_data:
-            return False
-        
-        # For user creation, status is in column F (index 5)
-        # The data structure is: [Request_id, User, Manager, BU, Entity, Approval_status]
-        status_col = 5  # Column F (6th column, 0-indexed = 5)
-        request_id_col = 0  # Column A (1st column, 0-indexed = 0)
-        
-        # Find request row and update status
-        for idx, row in enumerate(all_data[1:], start=2):  # Skip header, 1-indexed
-            if row and len(row) > request_id_col and row[request_id_col] == request_id:
-                worksheet.update_cell(idx, status_col + 1, new_status)
-                return True
-                
-        return False
+        success, _, _ = transition_status(request_id, 'manager', new_status, actor=approver_email)
+        return success
     except Exception as e:
         st.error(f"Error updating status: {e}")
         return False
@@ -126,6 +62,18 @@ def update_request_status(request_id, approver_type, new_status):
 def send_approval_email(user_id, manager_email, entity, bu, request_id, user_email):
     """Send approval email with action buttons"""
     base_url = get_current_url()
+    if digest_enabled():
+        details = [("Type", "User Creation"), ("User", user_id), ("Entity", entity), ("BU", bu)]
+        queue_request(request_id, details, [('manager', manager_email)], base_url,
+                      link_type='user', u=user_id, e=entity, b=bu)
+        if normalize_email(user_email) == normalize_email(manager_email):
+            return True
+        sent, error = send_messages([(user_email, None, "Submitted: Snowflake User Creation Request",
+                                      confirmation_body("Snowflake User Creation Request", [(request_id, details[2:])], [manager_email]))])
+        if not sent:
+            st.error(f"Error sending email: {error}")
+        return sent
+    
     approve_link = f"{base_url}?approve_id={request_id}&type=user&action=approve&u={user_id}&e={entity}&b={bu}&approver={manager_email}"
     reject_link = f"{base_url}?approve_id={request_id}&type=user&action=reject&u={user_id}&e={entity}&b={bu}&approver={manager_email}"
     
@@ -155,11 +103,14 @@ def send_approval_email(user_id, manager_email, entity, bu, request_id, user_ema
     </html>
     """
     
+    # The user is CC'd on the manager's email unless they are the manager
+    cc = None if normalize_email(user_email) == normalize_email(manager_email) else user_email
     message = MIMEMultipart("alternative")
     message["Subject"] = "Approval Needed: Snowflake User Creation Request"
     message["From"] = EMAIL_SENDER
     message["To"] = manager_email
-    message["Cc"] = user_email  # Add user to CC
+    if cc:
+        message["Cc"] = cc
     
     text_part = MIMEText(f"Approval needed for user {user_id}. Please use the buttons in the email.", "plain")
     html_part = MIMEText(html_body, "html")
@@ -171,50 +122,54 @@ def send_approval_email(user_id, manager_email, entity, bu, request_id, user_ema
         with smtplib.SMTP("smtp.gmail.com", 587) as server:
             server.starttls()
             server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.sendmail(EMAIL_SENDER, [manager_email, user_email], message.as_string())
+            server.sendmail(EMAIL_SENDER, [manager_email] + ([cc] if cc else []), message.as_string())
             return True
     except Exception as e:
         st.error(f"Error sending email: {e}")
         return False
 
-@st.cache_data(ttl=CACHE_TTL)  # Cache for 5 minutes
+@stale_while_revalidate(snapshot=True)  # Served while refreshed in the background
+def read_dropdown_data():
+    """Entity-BU and user-manager maps; raises when neither tab can be read, so a
+    failed refresh keeps the last good maps rather than the fallback"""
+    # Read both reference tabs in one round trip
+    values_by_sheet = read_available_tabs(DROPDOWN_SHEETS)
+    if not values_by_sheet:
+        raise RuntimeError("Dropdown tabs could not be read")
+    return dropdown_maps(values_by_sheet)
+
 def load_dropdown_data():
     """Load data for dropdown menus with caching"""
     try:
-        gc = get_authenticated_client()
-        if not gc:
-            return {}, {}
-            
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-        
-        # Load entity-BU mapping
-        try:
-            bu_worksheet = spreadsheet.worksheet('user_bu')
-            bu_data = bu_worksheet.get_all_values()[1:]  # Skip header
-            entity_bu_mapping = {}
-            
-            for row in bu_data:
-                if len(row) >= 2 and row[0] and row[1]:
-                    entity, bu = row[0], row[1]
-                    if entity not in entity_bu_mapping:
-                        entity_bu_mapping[entity] = []
-                    entity_bu_mapping[entity].append(bu)
-        except:
-            entity_bu_mapping = {"CSPL": ["C2B", "B2B"], "CAPL": ["C2B", "B2B"], "CFSPL": ["C2B", "B2B"]}
-        
-        # Load user-manager mapping
-        try:
-            user_worksheet = spreadsheet.worksheet('user_manager')
-            user_data = user_worksheet.get_all_values()[1:]  # Skip header
-            user_manager_dict = {row[0]: row[1] for row in user_data if len(row) >= 2 and row[0]}
-        except:
-            user_manager_dict = {}
-        
-        return entity_bu_mapping, user_manager_dict
-        
+        return read_dropdown_data()
     except Exception:
         return {}, {}
 
+def dropdown_maps(values_by_sheet):
+    """Parse the reference tabs into (entity -> BUs, user -> manager) maps"""
+    # Load entity-BU mapping
+    try:
+        bu_data = values_by_sheet['user_bu'][1:]  # Skip header
+        entity_bu_mapping = {}
+        
+        for row in bu_data:
+            if len(row) >= 2 and row[0] and row[1]:
+                entity, bu = row[0], row[1]
+                if entity not in entity_bu_mapping:
+                    entity_bu_mapping[entity] = []
+                entity_bu_mapping[entity].append(bu)
+    except:
+        entity_bu_mapping = {"CSPL": ["C2B", "B2B"], "CAPL": ["C2B", "B2B"], "CFSPL": ["C2B", "B2B"]}
+    
+    # Load user-manager mapping
+    try:
+        user_data = values_by_sheet['user_manager'][1:]  # Skip header
+        user_manager_dict = {row[0]: row[1] for row in user_data if len(row) >= 2 and row[0]}
+    except:
+        user_manager_dict = {}
+    
+    return entity_bu_mapping, user_manager_dict
+
 def handle_approval_action():
     """Handle approval/rejection from email links"""
     try:
@@ -253,7 +208,7 @@ def handle_approval_action():
             action_icon = '✅' if action == 'approve' else '❌'
             action_color = 'green' if action == 'approve' else 'red'
             
-            success = update_request_status(request_id, approver_type, new_status)
+            success = update_request_status(request_id, approver_type, new_status, approver_email)
             
             if success:
                 st.markdown(f"""
@@ -276,6 +231,51 @@ def handle_approval_action():
     except Exception:
         return True
 
+def validate_user_creation(user_email, manager_email, entity, bu, entity_bu_mapping):
+    """First problem with a user creation request, or None if it can be submitted"""
+    if not user_email:
+        return "User email not found"
+    if not manager_email:
+        return "Manager email not found for selected user"
+    if entity not in entity_bu_mapping:
+        return "Please select an Entity"
+    if bu not in entity_bu_mapping[entity]:
+        return "Please select a Business Unit"
+    if has_pending_request(user_email):
+        return "You already have a pending request. Please wait for it to be processed."
+    return None
+
+def user_creation_token(user_email, manager_email, entity, bu):
+    """Idempotency token of a user creation request, derived from its fields"""
+    return submission_token('user', user_email, [user_email, manager_email, bu, entity, PENDING_STATUS])
+
+def validate_new_user_creation(token, user_email, manager_email, entity, bu, entity_bu_mapping):
+    """validate_user_creation for a submission not made before; a repeat of one already
+    made (double-click or client retry) is let through to get its original request back
+    instead of being rejected as a pending request"""
+    if submission_seen(token):
+        return None
+    return validate_user_creation(user_email, manager_email, entity, bu, entity_bu_mapping)
+
+def submit_user_creation(request_id, user_email, manager_email, entity, bu, token=None):
+    """Save a user creation request and email the manager.
+    
+    A repeat with the same idempotency token (by default derived from the request)
+    within the dedup window returns the original request instead of saving again.
+    Returns (saved request ID or None, email_sent); email_sent is None for a repeat,
+    unless the first attempt's email failed and this one sent it again.
+    """
+    form_data = [request_id, user_email, manager_email, bu, entity, PENDING_STATUS]
+    token = token or user_creation_token(user_email, manager_email, entity, bu)
+    request_ids, notify = submit_once(token, [request_id], WORKSHEET_NAME, lambda: save_request(form_data))
+    if not request_ids:
+        return None, False
+    if not notify:
+        return request_ids[0], None
+    email_sent = send_approval_email(user_email, manager_email, entity, bu, request_ids[0], user_email)
+    record_notification(token, request_ids, email_sent)
+    return request_ids[0], email_sent
+
 def main_form():
     """Main user creation form"""
     st.title("User Creation Form")
@@ -320,38 +320,20 @@ def main_form():
     # Submit form
     if st.button("Submit", key="submit_user_creation"):
         # Validation
-        if not user_email:
-            st.error("User email not found")
-            return
-        
-        if not manager_email:
-            st.error("Manager email not found for selected user")
-            return
-        
-        if selected_entity == "Select Entity":
-            st.error("Please select an Entity")
+        token = user_creation_token(user_email, manager_email, selected_entity, selected_bu)
+        error = validate_new_user_creation(token, user_email, manager_email, selected_entity, selected_bu, entity_bu_mapping)
+        if error:
+            st.error(error)
             return
         
-        if selected_bu == "Select Business Unit":
-            st.error("Please select a Business Unit")
-            return
-        
-        # Check for pending requests
-        if has_pending_request(user_email):
-            st.error("You already have a pending request. Please wait for it to be processed.")
-            return
-        
-        # Prepare and save data
-        form_data = [request_id, user_email, manager_email, selected_bu, selected_entity, PENDING_STATUS]
-        
-        if save_request(form_data):
-            # Send approval email
-            email_sent = send_approval_email(user_email, manager_email, selected_entity, selected_bu, request_id, user_email) # Pass user_email as user_email
-            
-            if email_sent:
-                st.success(f"✅ **Request Submitted Successfully!**\n\n**Request ID:** {request_id}\n**User:** {user_email}\n**Manager:** {manager_email}\n**Entity:** {selected_entity}\n**Business Unit:** {selected_bu}\n\n📧 Approval email has been sent to the manager.")
+        saved_id, email_sent = submit_user_creation(request_id, user_email, manager_email, selected_entity, selected_bu, token)
+        if saved_id:
+            if email_sent is None:
+                st.info(f"This request was already submitted. Your request ID is: {saved_id}")
+            elif email_sent:
+                st.success(f"✅ **Request Submitted Successfully!**\n\n**Request ID:** {saved_id}\n**User:** {user_email}\n**Manager:** {manager_email}\n**Entity:** {selected_entity}\n**Business Unit:** {selected_bu}\n\n📧 Approval email has been sent to the manager.")
             else:
-                st.warning(f"⚠️ **Request Submitted Successfully!**\n\n**Request ID:** {request_id}\n**User:** {user_email}\n**Entity:** {selected_entity}\n**Business Unit:** {selected_bu}\n\n❌ Manager email not found. Cannot send approval email.")
+                st.warning(f"⚠️ **Request Submitted Successfully!**\n\n**Request ID:** {saved_id}\n**User:** {user_email}\n**Entity:** {selected_entity}\n**Business Unit:** {selected_bu}\n\n❌ Manager email not found. Cannot send approval email.")
         else:
             st.error("Failed to save user creation request. Please try again.")
 
@@ -1,44 +1,44 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import os
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import numpy as np
+from archiver import get_archived_values
+from expiry import EXPIRED_STATUS
+from request_ids import request_sort_key
+from request_index import get_request_index, request_index_stamp, sheet_values_to_frame, row_last_values
+from query_cache import budget_cached
 from config import *
 
-def get_sheets_service():
-    """Initialize and return Google Sheets service with cached credentials"""
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('sheets', 'v4', credentials=creds)
+REQUEST_COLUMNS = ['request_id', 'request_type', 'entity', 'rm_status', 'data_status',
+                   'business_unit', 'submitted_date', 'comments']
+OVERALL_STATUSES = ['Pending', 'Approved', 'Rejected', EXPIRED_STATUS]
+DISPLAY_COLUMNS = ['Request ID', 'Request Type', 'Entity', 'RM Status', 'Data Status', 'Overall Status']
 
-@st.cache_data(ttl=CACHE_TTL)
-def get_user_requests(user_email):
-    """Fetch all requests for the logged-in user"""
+def with_archived_rows(values, sheet_name, include_archived):
+    """Extend an active tab's rows with its archived rows for history views"""
+    if not include_archived:
+        return values
+    archived_values = get_archived_values(sheet_name)
+    if not archived_values:
+        return values
+    if not values:
+        return archived_values
+    return values + archived_values[1:]
+
+@budget_cached(request_index_stamp)
+def get_user_requests(user_email, include_archived=False):
+    """Fetch all requests for the logged-in user as a frame with categorical status columns"""
     try:
-        service = get_sheets_service()
-        sheet = service.spreadsheets()
+        # The shared request index is patched by every submission and approval,
+        # so it is always fresh and needs no per-user Sheets read
+        index = get_request_index()
         
-        all_user_requests = []
+        user_frames = []
+        user_email = user_email.lower()
         
         # Fetch from responses sheet (Table and Column requests)
         try:
-            result = sheet.values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='responses'
-            ).execute()
-            
-            values = result.get('values', [])
+            values = with_archived_rows(index.user_values('responses', user_email), 'responses', include_archived)
             if values and len(values) >= 2:
                 header = values[0]
                 
@@ -53,33 +53,26 @@ def get_user_requests(user_email):
                 except ValueError as e:
                     st.error(f"Required columns not found in responses sheet. Error: {e}")
                     st.info(f"Available columns: {header}")
-                    return []
+                    return pd.DataFrame(columns=REQUEST_COLUMNS)
                 
-                # Process each row
-                for row in values[1:]:
-                    if len(row) > user_col and row[user_col].strip().lower() == user_email.lower():
-                        request_data = {
-                            'request_id': row[request_id_col] if request_id_col < len(row) else '',
-                            'request_type': row[request_type_col] if request_type_col < len(row) else '',
-                            'entity': row[entity_col] if entity_col < len(row) else '',
-                            'rm_status': row[rm_status_col] if rm_status_col < len(row) else 'Pending',
-                            'data_status': row[data_status_col] if data_status_col and data_status_col < len(row) else 'Pending',
-                            'business_unit': row[3] if len(row) > 3 else '',  # Column 3 for BU/Table
-                            'submitted_date': row[0] if len(row) > 0 else '',  # First column often has date
-                            'comments': row[-1] if len(row) > 0 else ''  # Last column often has comments
-                        }
-                        all_user_requests.append(request_data)
+                frame = sheet_values_to_frame(values)
+                frame = frame[frame[user_col].fillna('').str.strip().str.lower() == user_email]
+                user_frames.append(pd.DataFrame({
+                    'request_id': frame[request_id_col].fillna(''),
+                    'request_type': frame[request_type_col].fillna(''),
+                    'entity': frame[entity_col].fillna(''),
+                    'rm_status': frame[rm_status_col].fillna('Pending'),
+                    'data_status': frame[data_status_col].fillna('Pending') if data_status_col is not None else 'Pending',
+                    'business_unit': frame[3].fillna('') if 3 in frame else '',  # Column 3 for BU/Table
+                    'submitted_date': frame[0].fillna(''),  # First column often has date
+                    'comments': row_last_values(frame)  # Last column often has comments
+                }, columns=REQUEST_COLUMNS))
         except Exception as e:
             st.warning(f"Could not fetch from responses sheet: {e}")
         
         # Fetch from user_responses sheet (User Creation requests)
         try:
-            result = sheet.values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='user_responses'
-            ).execute()
-            
-            values = result.get('values', [])
+            values = with_archived_rows(index.user_values('user_responses', user_email), 'user_responses', include_archived)
             if values and len(values) >= 2:
                 header = values[0]
                 
@@ -94,30 +87,34 @@ def get_user_requests(user_email):
                     st.warning(f"Required columns not found in user_responses sheet. Error: {e}")
                     st.info(f"Available columns in user_responses: {header}")
                 else:
-                    # Process each row
-                    for row in values[1:]:
-                        if len(row) > user_col and row[user_col].strip().lower() == user_email.lower():
-                            request_data = {
-                                'request_id': row[request_id_col] if request_id_col < len(row) else '',
-                                'request_type': 'User Creation',  # Fixed type for user creation
-                                'entity': row[entity_col] if entity_col < len(row) else '',
-                                'rm_status': row[approval_status_col] if approval_status_col < len(row) else 'Pending',
-                                'data_status': 'N/A',  # User creation doesn't have data approval
-                                'business_unit': row[bu_col] if bu_col < len(row) else '',
-                                'submitted_date': row[0] if len(row) > 0 else '',
-                                'comments': row[-1] if len(row) > 0 else ''
-                            }
-                            all_user_requests.append(request_data)
+                    frame = sheet_values_to_frame(values)
+                    frame = frame[frame[user_col].fillna('').str.strip().str.lower() == user_email]
+                    user_frames.append(pd.DataFrame({
+                        'request_id': frame[request_id_col].fillna(''),
+                        'request_type': 'User Creation',  # Fixed type for user creation
+                        'entity': frame[entity_col].fillna(''),
+                        'rm_status': frame[approval_status_col].fillna('Pending'),
+                        'data_status': 'N/A',  # User creation doesn't have data approval
+                        'business_unit': frame[bu_col].fillna(''),
+                        'submitted_date': frame[0].fillna(''),
+                        'comments': row_last_values(frame)
+                    }, columns=REQUEST_COLUMNS))
         except Exception as e:
             st.warning(f"Could not fetch from user_responses sheet: {e}")
         
-        # Sort by request ID (latest first - assuming newer IDs come later)
-        all_user_requests.sort(key=lambda x: x['request_id'], reverse=True)
+        if not user_frames:
+            return pd.DataFrame(columns=REQUEST_COLUMNS)
+        
+        all_user_requests = pd.concat(user_frames, ignore_index=True)
+        all_user_requests['rm_status'] = all_user_requests['rm_status'].astype('category')
+        all_user_requests['data_status'] = all_user_requests['data_status'].astype('category')
         
-        return all_user_requests
+        # Latest submission first; legacy IDs carry local time, current ones UTC
+        return all_user_requests.sort_values('request_id', ascending=False, ignore_index=True,
+                                             key=lambda ids: ids.map(request_sort_key))
     except Exception as e:
         st.error(f"Error fetching user requests: {e}")
-        return []
+        return pd.DataFrame(columns=REQUEST_COLUMNS)
 
 def get_status_icon(status):
     """Get status icon based on status"""
@@ -125,6 +122,8 @@ def get_status_icon(status):
         return "✅"
     elif status == "Rejected":
         return "❌"
+    elif status == EXPIRED_STATUS:
+        return "⌛"
     else:
         return "⏳"
 
@@ -134,47 +133,41 @@ def get_status_color(status):
         return "color: green; font-weight: bold;"
     elif status == "Rejected":
         return "color: red; font-weight: bold;"
+    elif status == EXPIRED_STATUS:
+        return "color: gray; font-weight: bold;"
     else:
         return "color: orange; font-weight: bold;"
 
 def calculate_overall_status(rm_status, data_status):
-    """Calculate overall status based on both approvals"""
-    # Handle user creation requests where data_status is "N/A"
-    if data_status == "N/A":
-        if rm_status == "Approved":
-            return "Approved"
-        elif rm_status == "Rejected":
-            return "Rejected"
-        else:
-            return "Pending"
-    
-    # Handle regular requests (Table/Column) that need both approvals
-    if rm_status == "Rejected" or data_status == "Rejected":
-        return "Rejected"
-    elif rm_status == "Approved" and data_status == "Approved":
-        return "Approved"
-    else:
-        return "Pending"
+    """Calculate overall status based on both approvals, for whole status columns at once"""
+    # User creation requests have data_status "N/A" and only need the RM/manager approval
+    rejected = (rm_status == "Rejected") | (data_status == "Rejected")
+    expired = (rm_status == EXPIRED_STATUS) | (data_status == EXPIRED_STATUS)
+    approved = (rm_status == "Approved") & ((data_status == "Approved") | (data_status == "N/A"))
+    overall = np.select([rejected, expired, approved], ["Rejected", EXPIRED_STATUS, "Approved"], default="Pending")
+    return pd.Categorical(overall, categories=OVERALL_STATUSES)
+
+def with_status_icon(status):
+    """Prefix a categorical status column with its icon (computed once per category)"""
+    return status.map(lambda value: f"{get_status_icon(value)} {value}")
 
 def format_dashboard_data(requests):
-    """Format requests data for dashboard display"""
-    dashboard_data = []
+    """Format requests frame for dashboard display"""
+    overall_status = pd.Series(
+        calculate_overall_status(requests['rm_status'], requests['data_status']),
+        index=requests.index
+    )
     
-    for req in requests:
-        overall_status = calculate_overall_status(req['rm_status'], req['data_status'])
-        
-        dashboard_data.append({
-            'Request ID': req['request_id'],
-            'Request Type': req['request_type'],
-            'Entity': req['entity'],
-            'RM Status': f"{get_status_icon(req['rm_status'])} {req['rm_status']}",
-            'Data Status': f"{get_status_icon(req['data_status'])} {req['data_status']}",
-            'Overall Status': f"{get_status_icon(overall_status)} {overall_status}",
-            # Store full data for details modal
-            '_full_data': req
-        })
-    
-    return dashboard_data
+    return pd.DataFrame({
+        'Request ID': requests['request_id'],
+        'Request Type': requests['request_type'],
+        'Entity': requests['entity'],
+        'RM Status': with_status_icon(requests['rm_status']),
+        'Data Status': with_status_icon(requests['data_status']),
+        'Overall Status': with_status_icon(overall_status),
+        # Raw status kept for filtering and summary counts
+        'overall_status': overall_status
+    })
 
 def show_request_details(request_data):
     """Show detailed request information in a modal-like format"""
@@ -207,11 +200,14 @@ def create_dashboard():
     
     user_email = st.session_state.user_email
     
+    # Archived (finalized, older) requests are only fetched on demand
+    include_archived = st.checkbox("Include archived requests", key="include_archived_requests")
+    
     # Fetch user requests
     with st.spinner("Loading your requests..."):
-        user_requests = get_user_requests(user_email)
+        user_requests = get_user_requests(user_email, include_archived)
     
-    if not user_requests:
+    if user_requests.empty:
         st.info("No requests found. Submit your first request to see it here!")
         return
     
@@ -224,63 +220,53 @@ def create_dashboard():
     with col1:
         status_filter = st.selectbox(
             "Filter by Status",
-            ["All", "Pending", "Approved", "Rejected"],
+            ["All"] + OVERALL_STATUSES,
             key="status_filter"
         )
     
     with col2:
         type_filter = st.selectbox(
             "Filter by Type",
-            ["All"] + list(set([req['Request Type'] for req in dashboard_data])),
+            ["All"] + list(dashboard_data['Request Type'].unique()),
             key="type_filter"
         )
     
     with col3:
         search_term = st.text_input("Search by Request ID", key="search_filter")
     
-    # Apply filters
-    filtered_data = dashboard_data.copy()
+    # Apply filters as one combined mask
+    mask = pd.Series(True, index=dashboard_data.index)
     
     if status_filter != "All":
-        filtered_data = [req for req in filtered_data if status_filter in req['Overall Status']]
+        mask &= dashboard_data['overall_status'] == status_filter
     
     if type_filter != "All":
-        filtered_data = [req for req in filtered_data if req['Request Type'] == type_filter]
+        mask &= dashboard_data['Request Type'] == type_filter
     
     if search_term:
-        filtered_data = [req for req in filtered_data if search_term.lower() in req['Request ID'].lower()]
+        mask &= dashboard_data['Request ID'].str.contains(search_term, case=False, regex=False)
+    
+    filtered_data = dashboard_data[mask]
     
     # Summary statistics
+    status_counts = filtered_data['overall_status'].value_counts()
     total_requests = len(filtered_data)
-    pending_count = len([req for req in filtered_data if "Pending" in req['Overall Status']])
-    approved_count = len([req for req in filtered_data if "Approved" in req['Overall Status']])
-    rejected_count = len([req for req in filtered_data if "Rejected" in req['Overall Status']])
+    pending_count = status_counts['Pending']
+    approved_count = status_counts['Approved']
+    rejected_count = status_counts['Rejected']
+    expired_count = status_counts[EXPIRED_STATUS]
     
-    st.markdown(f"**Summary:** Total: {total_requests} | Pending: {pending_count} | Approved: {approved_count} | Rejected: {rejected_count}")
+    st.markdown(f"**Summary:** Total: {total_requests} | Pending: {pending_count} | Approved: {approved_count} | Rejected: {rejected_count} | Expired: {expired_count}")
     
     st.markdown("---")
     
     # Display requests table
-    if filtered_data:
+    if not filtered_data.empty:
         st.markdown("### Your Requests (Latest First)")
         
-        # Create DataFrame for display
-        display_data = []
-        for req in filtered_data:
-            display_data.append({
-                'Request ID': req['Request ID'],
-                'Request Type': req['Request Type'],
-                'Entity': req['Entity'],
-                'RM Status': req['RM Status'],
-                'Data Status': req['Data Status'],
-                'Overall Status': req['Overall Status']
-            })
-        
-        df = pd.DataFrame(display_data)
-        
         # Display with custom styling
         st.dataframe(
-            df,
+            filtered_data[DISPLAY_COLUMNS],
             use_container_width=True,
             hide_index=True,
             column_config={